@@ -1,9 +1,6 @@
 from __future__ import annotations
-import pyodbc
 import warnings
 import pandas as pd
-import win32com.client as win32
-from accessdb import to_accessdb
 
 
 class MSAccess:
@@ -19,6 +16,18 @@ class MSAccess:
             f'DBQ={db_path}'
         )
 
+    def connect(self):
+        """Open an ODBC connection to the database.
+
+        pyodbc is imported here rather than at module level so the application starts without loading it.
+
+        :return: database connection
+        :rtype: pyodbc.Connection
+        """
+        import pyodbc
+
+        return pyodbc.connect(self.conn_str)
+
     def download_to_excel(self, tbl_name: str, destination: str, sheet="") -> None:
         """Download Access table as an Excel sheet.
 
@@ -48,6 +57,8 @@ class MSAccess:
         :return: None
         :rtype: None
         """
+        import win32com.client as win32
+
         try:
             cnxn = win32.Dispatch('Access.Application')
             db = cnxn.OpenCurrentDatabase(self.path)
@@ -72,7 +83,7 @@ class MSAccess:
         :return: data from select query
         :rtype: None | pd.DataFrame
         """
-        cnxn = pyodbc.connect(self.conn_str)
+        cnxn = self.connect()
 
         if method == "print":
             cursor = cnxn.execute(sql_query)
@@ -95,7 +106,7 @@ class MSAccess:
         :return: None
         :rtype: None
         """
-        cnxn = pyodbc.connect(self.conn_str)
+        cnxn = self.connect()
         cursor = cnxn.execute(sql_query)
         cnxn.commit()
         cursor.close()
@@ -111,7 +122,7 @@ class MSAccess:
         :return: None
         :rtype: None
         """
-        cnxn = pyodbc.connect(self.conn_str)
+        cnxn = self.connect()
         sql = f'\u007bCALL {access_query}\u007d'
         cursor = cnxn.execute(sql)
         cnxn.commit()
@@ -130,6 +141,9 @@ class MSAccess:
         :return: None
         :rtype: None
         """
+        # importing accessdb registers DataFrame.to_accessdb
+        from accessdb import to_accessdb
+
         data = pd.read_excel(file_path, sheet_name=file_sheet)
         for col in data.columns:
             if len(col) > 25:
@@ -1,8 +1,12 @@
 import os
 import pandas as pd
 from file_processing.demo import Demo
+import file_processing.schema as schema
+import file_processing.archive_queue as archive_queue
+from file_processing.keys import email_hash
 import file_processing.constants as demo_c
 import file_processing.file_paths as const
+from logs import metrics
 
 ARCHIVE_PATH = const.ARCHIVE_PATH
 COUNTS_SHEET = "Upload_Counts"
@@ -14,73 +18,72 @@ RAW_SHEET = "Raw_Data"
 class ArchiveMgr:
     def __init__(self, demo: Demo):
         self.demo = demo
-        self.raw = None
-        self.sfdc = None
-        self.udb = None
-        self.counts = None
 
+    @property
+    def demo_key(self) -> str:
+        return f"{self.demo.demo_type}-{self.demo.demo_date.strftime('%m%d%y')}"
+
+    def queue(self, sheet: str, frame: str, new_data: pd.DataFrame, restrict: bool = False) -> None:
+        """Queue new rows for an archive sheet, the committer writes them once the archive is free.
+
+        :param sheet: archive sheet
+        :type sheet: str
+        :param frame: registered schema of the sheet
+        :type frame: str
+        :param new_data: rows of this demo
+        :type new_data: pd.DataFrame
+        :param restrict: keep only the columns the sheet already has (default False)
+        :type restrict: bool
+        :return: None
+        :rtype: None
+        """
+        metrics.count_rows(rows_in=len(new_data), rows_out=len(new_data))
+        archive_queue.enqueue(self.demo_key, sheet, frame, new_data, restrict=restrict)
+        archive_queue.COMMITTER.wake()
+
+    @metrics.timed
     def append_raw(self) -> None:
         """"""
 
         # append raw data
-        self.raw = pd.read_excel(ARCHIVE_PATH, sheet_name=RAW_SHEET)
         data_name = os.path.basename(demo_c.RAW_DATA_PATH)
         raw_path = os.path.join(self.demo.destination_path, data_name)
-        new_data = pd.read_excel(raw_path, sheet_name=demo_c.RAW_DATA_SHEET)
+        new_data = schema.read_excel(raw_path, demo_c.RAW_DATA_SHEET, "raw")
         new_data = new_data[['Attended', 'Last Name', 'First Name', 'Email Address', 'State/Province', 'Phone',
                              'Organization', 'Job Title', 'Unsubscribed']]
         new_data["Date"] = self.demo.demo_date
         new_data["Type"] = "HC Demo"
-        new_data = pd.concat([self.raw, new_data], ignore_index=True)
-        new_data["Date"] = pd.to_datetime(new_data["Date"])
-        new_data["Date"] = new_data["Date"].dt.strftime('%m/%d/%Y')
-        with pd.ExcelWriter(ARCHIVE_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            new_data.to_excel(writer, sheet_name=RAW_SHEET, index=False)
-        del new_data
-        self.raw = None
+        self.queue(RAW_SHEET, "archive_raw", new_data)
 
+    @metrics.timed
     def append_sfdc(self, new_ids: pd.DataFrame) -> None:
         """"""
-        self.sfdc = pd.read_excel(ARCHIVE_PATH, sheet_name=SFDC_SHEET)
-        new_data = pd.read_excel(self.demo.sf_path, sheet_name=self.demo.sf_upload)
+        new_data = schema.read_excel(self.demo.sf_path, self.demo.sf_upload, "sfdc")
 
-        # match new sf data to new_ids
-        new_data = pd.merge(new_data, new_ids, how="left", on=["Email"])
+        # match new sf data to new_ids by the email's hash, the first SFDC ID of each email is used
+        ids = new_ids.dropna(subset=["SFDC ID (18 digit)"])
+        id_keys = email_hash(ids["Email"])
+        first = ~pd.Series(id_keys).duplicated().to_numpy()
+        sfdc_ids = pd.Series(ids["SFDC ID (18 digit)"].astype(str).to_numpy()[first], index=id_keys[first])
+        new_data["SFDC ID (18 digit)"] = sfdc_ids.reindex(email_hash(new_data["Email"])).fillna('').to_numpy()
         new_data = new_data.fillna('')
         new_data.loc[new_data["Existing Lead ID"] == '', "Existing Lead ID"] = new_data["SFDC ID (18 digit)"]
 
-        if "AG_x" in new_data.columns:
-            new_data = new_data.rename(columns={"AG_x": "AG"})
-
-        new_data = new_data[list(set(self.sfdc.columns) & set(new_data.columns))]
         new_data["Date"] = self.demo.demo_date
         new_data["Type"] = "HC Demo"
-        new_data = pd.concat([self.sfdc, new_data], ignore_index=True)
-        new_data["Date"] = pd.to_datetime(new_data["Date"])
-        new_data["Date"] = new_data["Date"].dt.strftime('%m/%d/%Y')
-        with pd.ExcelWriter(ARCHIVE_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            new_data.to_excel(writer, sheet_name=SFDC_SHEET, index=False)
-        del new_data
-        self.sfdc = None
+        self.queue(SFDC_SHEET, "archive_sfdc", new_data, restrict=True)
 
+    @metrics.timed
     def append_udb(self) -> None:
         """"""
-        self.udb = pd.read_excel(ARCHIVE_PATH, sheet_name=UDB_SHEET)
-        new_data = pd.read_excel(self.demo.udb_path, sheet_name=self.demo.udb_upload)
+        new_data = schema.read_excel(self.demo.udb_path, self.demo.udb_upload, "udb")
         new_data["Date"] = self.demo.demo_date
         new_data["Type"] = "HC Demo"
-        new_data = new_data[list(set(self.udb.columns) & set(new_data.columns))]
-        new_data = pd.concat([self.udb, new_data], ignore_index=True)
-        new_data["Date"] = pd.to_datetime(new_data["Date"])
-        new_data["Date"] = new_data["Date"].dt.strftime('%m/%d/%Y')
-        with pd.ExcelWriter(ARCHIVE_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            new_data.to_excel(writer, sheet_name=UDB_SHEET, index=False)
-        del new_data
-        self.udb = None
+        self.queue(UDB_SHEET, "archive_udb", new_data, restrict=True)
 
+    @metrics.timed
     def append_counts(self) -> None:
         """"""
-        self.counts = pd.read_excel(ARCHIVE_PATH, sheet_name=COUNTS_SHEET)
         demo_counts = self.demo.counts
         attendee_counts = {
             "Date": self.demo.demo_date,
@@ -107,7 +110,7 @@ class ArchiveMgr:
             "Merged": demo_counts.retrieve_one("a_merged"),
             "BadEmail": demo_counts.retrieve_one("a_bad_email"),
             "FreshAddressBadEmail": demo_counts.retrieve_one("a_freshaddressbademail"),
-            "Duplicates": 0,
+            "Duplicates": demo_counts.retrieve_one("a_duplicates"),
             "Undeliverable": demo_counts.retrieve_one("a_undeliverable"),
         }
         nonattendee_counts = {
@@ -135,16 +138,8 @@ class ArchiveMgr:
             "Merged": demo_counts.retrieve_one("na_merged"),
             "BadEmail": demo_counts.retrieve_one("na_bad_email"),
             "FreshAddressBadEmail": demo_counts.retrieve_one("na_freshaddressbademail"),
-            "Duplicates": 0,
+            "Duplicates": demo_counts.retrieve_one("na_duplicates"),
             "Undeliverable": demo_counts.retrieve_one("na_undeliverable"),
         }
-        attendee_data = pd.DataFrame(attendee_counts, index=[0])
-        nonattendee_data = pd.DataFrame(nonattendee_counts, index=[0])
-        new_data = pd.concat([self.counts, attendee_data], ignore_index=True)
-        new_data = pd.concat([new_data, nonattendee_data], ignore_index=True)
-        new_data["Date"] = pd.to_datetime(new_data["Date"])
-        new_data["Date"] = new_data["Date"].dt.strftime('%m/%d/%Y')
-        with pd.ExcelWriter(ARCHIVE_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            new_data.to_excel(writer, sheet_name=COUNTS_SHEET, index=False)
-
-        self.counts = None
+        new_data = pd.DataFrame([attendee_counts, nonattendee_counts])
+        self.queue(COUNTS_SHEET, "archive_counts", new_data)
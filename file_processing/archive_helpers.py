@@ -1,9 +1,12 @@
 import pandas as pd
 from file_processing import demo
+import file_processing.schema as schema
 from logs.log import logger
+from logs import metrics
 
 
-def attend_nonattend_counts(path: str, sheet: str, tc_col: str) -> tuple:
+@metrics.timed
+def attend_nonattend_counts(path: str, sheet: str, tc_col: str, frame: str = "sfdc") -> tuple:
     """Separates a count of leads into attendees and nonattendees then adds them to the verification counts.
 
     :param path: path to the desired file
@@ -12,20 +15,26 @@ def attend_nonattend_counts(path: str, sheet: str, tc_col: str) -> tuple:
     :type sheet: str
     :param tc_col: name of the tracking code column
     :type tc_col: str
+    :param frame: schema of the desired file (default sfdc)
+    :type frame: str
     :return: attend count, nonattend count
     :rtype: tuple
     """
-    try:
-        data = pd.read_excel(path, sheet_name=sheet)
-    except ValueError:
-        logger.warning("%s sheet was not found", sheet)
-        return 0, 0
-    else:
+    with pd.ExcelFile(path) as book:
+        if sheet not in book.sheet_names:
+            logger.warning("%s sheet was not found", sheet)
+            return 0, 0
+        try:
+            data = schema.read_excel(book, sheet, frame, usecols=[tc_col])
+        except ValueError as e:
+            raise ValueError(f"The {sheet} sheet has no {tc_col} column") from e
+        metrics.count_rows(rows_in=len(data))
         attend = len(data[data[tc_col].str.contains("AC")])
         nonattend = len(data[data[tc_col].str.contains("BC")])
         return attend, nonattend
 
 
+@metrics.timed
 def sfdc_counts(demo_obj: demo.Demo) -> None:
     """Updates the sfdc demo counts for the archive.
 
@@ -57,6 +66,7 @@ def sfdc_counts(demo_obj: demo.Demo) -> None:
         demo_obj.counts.update_counts(tmnonattendee_count=demo_obj.counts.retrieve_one("sf_excluded"))
 
 
+@metrics.timed
 def udb_counts(demo_obj: demo.Demo) -> None:
     """Updates the udb demo counts for the archive.
 
@@ -65,16 +75,16 @@ def udb_counts(demo_obj: demo.Demo) -> None:
     :return: None
     :rtype: None
     """
-    udb = attend_nonattend_counts(demo_obj.udb_path, demo_obj.udb_upload, "TrackingCode")
-    exclude = pd.read_excel(demo_obj.exclude_path, sheet_name=demo_obj.udb_exclude)
+    udb = attend_nonattend_counts(demo_obj.udb_path, demo_obj.udb_upload, "TrackingCode", frame="udb")
+    exclude = schema.read_excel(demo_obj.exclude_path, demo_obj.udb_exclude, "exclude")
     a_exclude = exclude[exclude["TrackingCode"].str.contains("AC")]
-    a_ms_count = len(a_exclude[a_exclude["MasterSuppression"].notnull()])
-    a_iaf_count = len(a_exclude[a_exclude["IsActiveFalse"].notnull()])
-    a_hb_count = len(a_exclude[a_exclude["HardBounce"].notnull()])
+    a_ms_count = len(a_exclude[a_exclude["MasterSuppression"]])
+    a_iaf_count = len(a_exclude[a_exclude["IsActiveFalse"]])
+    a_hb_count = len(a_exclude[a_exclude["HardBounce"]])
     na_exclude = exclude[exclude["TrackingCode"].str.contains("BC")]
-    na_ms_count = len(na_exclude[na_exclude["MasterSuppression"].notnull()])
-    na_iaf_count = len(na_exclude[na_exclude["IsActiveFalse"].notnull()])
-    na_hb_count = len(na_exclude[na_exclude["HardBounce"].notnull()])
+    na_ms_count = len(na_exclude[na_exclude["MasterSuppression"]])
+    na_iaf_count = len(na_exclude[na_exclude["IsActiveFalse"]])
+    na_hb_count = len(na_exclude[na_exclude["HardBounce"]])
 
     demo_obj.counts.update_counts(attendee_count=udb[0],
                                   nonattendee_count=udb[1],
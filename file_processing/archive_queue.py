@@ -0,0 +1,581 @@
+from __future__ import annotations
+import os
+import json
+import time
+import datetime
+import uuid
+import socket
+import hashlib
+import threading
+import contextlib
+import pandas as pd
+import file_processing.schema as schema
+import file_processing.archive_tiers as archive_tiers
+import file_processing.file_paths as const
+from logs.log import logger
+
+# appends wait here, on this machine, until the shared archive is free, one file per queued append: a JSON header line
+# followed by the rows as CSV
+QUEUE_DIR = os.path.join(os.path.dirname(const.SETTINGS_PATH), "archive_queue")
+QUEUE_EXT = ".csv"
+BAD_EXT = ".bad"  # entries that can't be read are renamed so they don't hold up the rest
+JOURNAL_NAME = "commit.json"  # the commit being written, so one cut short is finished or undone by the next
+LOG_SHEET = "Archive_Log"  # hidden archive sheet with the batches written to it
+LOG_ROWS = 1000  # batches kept in the log sheet
+
+RETRY_SECONDS = 30  # how often the committer tries again while the archive is open or locked
+LOCK_STALE_SECONDS = 600  # a lock not refreshed for this long was left by a committer that died, it is taken over
+HEARTBEAT_SECONDS = 60  # how often a committer refreshes its lock while it works
+FLUSH_SECONDS = 20  # how long the archive step waits for its appends to be written before leaving them queued
+READ_ATTEMPTS = 3  # times a commit reads the queue again when a demo it read was queued again, before trying later
+
+
+def lock_path() -> str:
+    """Build the path of the advisory lock committers take before rewriting the archive.
+
+    :return: path to the lock file, next to the archive so every operator's committer sees it
+    :rtype: str
+    """
+    return const.ARCHIVE_PATH + ".lock"
+
+
+def owner_path() -> str:
+    """Build the path of the owner file Excel writes next to a workbook it has open.
+
+    :return: path to the ~$ file
+    :rtype: str
+    """
+    return os.path.join(os.path.dirname(const.ARCHIVE_PATH), "~$" + os.path.basename(const.ARCHIVE_PATH))
+
+
+def journal_path() -> str:
+    """Build the path of the journal of the commit being written, see commit.
+
+    :return: path to the journal, in the queue folder
+    :rtype: str
+    """
+    return os.path.join(QUEUE_DIR, JOURNAL_NAME)
+
+
+def archive_open() -> bool:
+    """Check if someone has the archive open, in which case it can't be rewritten.
+
+    :return: whether the archive is open
+    :rtype: bool
+    """
+    if os.path.exists(owner_path()):
+        return True
+    try:
+        with open(const.ARCHIVE_PATH, 'r+b'):
+            pass
+    except PermissionError:
+        return True
+    except FileNotFoundError:
+        # the share is unreachable, same as open as far as writing goes
+        return True
+    return False
+
+
+# --------------------- LOCK --------------------- #
+def acquire_lock() -> bool:
+    """Take the advisory archive lock without waiting, taking over one left by a committer that died.
+
+    :return: whether the lock was taken
+    :rtype: bool
+    """
+    path = lock_path()
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if age < LOCK_STALE_SECONDS:
+                return False
+            logger.warning("Taking over the archive lock left %.0f seconds ago", age)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        except OSError as e:
+            logger.debug("Archive lock unavailable %s", repr(e))
+            return False
+        with os.fdopen(fd, 'w') as file:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, file)
+        return True
+    return False
+
+
+def release_lock() -> None:
+    """Give up the advisory archive lock.
+
+    :return: None
+    :rtype: None
+    """
+    try:
+        os.remove(lock_path())
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def heartbeat(interval: float = HEARTBEAT_SECONDS):
+    """Refresh the archive lock every interval seconds while the block runs, so a long rewrite isn't taken for a
+    committer that died.
+
+    :param interval: seconds between refreshes (default HEARTBEAT_SECONDS)
+    :type interval: float
+    :return: context manager
+    :rtype: contextlib.AbstractContextManager
+    """
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(interval):
+            try:
+                os.utime(lock_path())
+            except OSError as e:
+                logger.warning("The archive lock couldn't be refreshed %s", repr(e))
+
+    thread = threading.Thread(target=beat, name="archive-lock-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+# --------------------- QUEUE --------------------- #
+class QueuedAppend:
+    def __init__(self, path: str, demo_key: str, sheet: str, frame: str, rows: pd.DataFrame, restrict: bool):
+        """Initialize QueuedAppend, rows of one demo waiting to be appended to an archive sheet.
+
+        :param path: path of the queue file
+        :type path: str
+        :param demo_key: demo the rows belong to, e.g. "HC-101926"
+        :type demo_key: str
+        :param sheet: archive sheet
+        :type sheet: str
+        :param frame: registered schema of the sheet (see schema.SCHEMAS)
+        :type frame: str
+        :param rows: rows to append
+        :type rows: pd.DataFrame
+        :param restrict: keep only the columns the sheet already has
+        :type restrict: bool
+        """
+        self.path = path
+        self.demo_key = demo_key
+        self.sheet = sheet
+        self.frame = frame
+        self.rows = rows
+        self.restrict = restrict
+
+    def __repr__(self):
+        return f"QueuedAppend({self.demo_key!r}, {self.sheet!r}, {len(self.rows)} rows)"
+
+
+def _kind(column: pd.Series) -> str:
+    """Find the kind of a column, a column of dates such as demo_date counts as datetime."""
+    if column.dtype == object:
+        values = column.dropna()
+        if len(values) and values.map(lambda value: isinstance(value, datetime.date)).all():
+            return 'M'
+    return column.dtype.kind
+
+
+def enqueue(demo_key: str, sheet: str, frame: str, rows: pd.DataFrame, restrict: bool = False) -> str:
+    """Queue rows of a demo to be appended to an archive sheet.
+
+    The entry is written to a file of its own and synced to disk before this returns, so it survives a crash, and
+    nothing is locked, so queuing never waits for a commit. Queuing the same demo and sheet again supersedes the entry
+    that hasn't been written yet, see commit.
+
+    :param demo_key: demo the rows belong to
+    :type demo_key: str
+    :param sheet: archive sheet
+    :type sheet: str
+    :param frame: registered schema of the sheet
+    :type frame: str
+    :param rows: rows to append
+    :type rows: pd.DataFrame
+    :param restrict: keep only the columns the sheet already has (default False)
+    :type restrict: bool
+    :return: path of the queue file
+    :rtype: str
+    """
+    os.makedirs(QUEUE_DIR, exist_ok=True)
+    path = os.path.join(QUEUE_DIR, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}-{sheet}-{demo_key}{QUEUE_EXT}")
+    # the dtypes let numbers, flags and dates be read back as they were, the rest is read as text
+    header = {"demo": demo_key, "sheet": sheet, "frame": frame, "restrict": restrict,
+              "dtypes": {str(col): _kind(rows[col]) for col in rows.columns}}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as file:
+        file.write(json.dumps(header) + "\n")
+        rows.to_csv(file, index=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    logger.info("Queued %d %s rows for %s", len(rows), sheet, demo_key)
+    return path
+
+
+def pending() -> list:
+    """List the queue files waiting to be written, oldest first.
+
+    :return: paths of the queue files
+    :rtype: list
+    """
+    try:
+        names = os.listdir(QUEUE_DIR)
+    except FileNotFoundError:
+        return []
+    names = sorted((name for name in names if name.endswith(QUEUE_EXT)), key=lambda name: int(name.split('-', 1)[0]))
+    return [os.path.join(QUEUE_DIR, name) for name in names]
+
+
+def set_aside() -> list:
+    """List the queue files that couldn't be read, their rows aren't archived until someone looks at them.
+
+    :return: paths of the .bad files
+    :rtype: list
+    """
+    try:
+        return sorted(os.path.join(QUEUE_DIR, name) for name in os.listdir(QUEUE_DIR) if name.endswith(BAD_EXT))
+    except FileNotFoundError:
+        return []
+
+
+def _restore(rows: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """Give columns read as text back the kind they were queued with."""
+    for col, kind in dtypes.items():
+        if col not in rows.columns:
+            continue
+        if kind in 'iuf':
+            rows[col] = pd.to_numeric(rows[col])
+        elif kind == 'b':
+            rows[col] = rows[col].map({"True": True, "False": False})
+        elif kind == 'M':
+            rows[col] = pd.to_datetime(rows[col])
+    return rows
+
+
+def load(path: str) -> QueuedAppend | None:
+    """Read a queue file.
+
+    :param path: path of the queue file
+    :type path: str
+    :return: queued append, None if the file is gone or can't be read (it is then renamed to .bad)
+    :rtype: QueuedAppend | None
+    """
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as file:
+            header = json.loads(file.readline())
+            rows = pd.read_csv(file, dtype=object, keep_default_na=False, na_values=[''])
+        rows = _restore(rows, header["dtypes"])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        bad_path = os.path.splitext(path)[0] + BAD_EXT
+        logger.error("Archive queue file %s can't be read, its rows were NOT archived. It was set aside as %s %s",
+                     os.path.basename(path), bad_path, repr(e))
+        try:
+            os.replace(path, bad_path)
+        except FileNotFoundError:
+            pass
+        return None
+    return QueuedAppend(path, header["demo"], header["sheet"], header["frame"], rows, header["restrict"])
+
+
+def queued_rows(sheet: str) -> pd.DataFrame | None:
+    """Collect the rows queued for a sheet that haven't been written yet, so readers of the archive can include them.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :return: queued rows with the sheet's schema applied, None if nothing is queued for the sheet
+    :rtype: pd.DataFrame | None
+    """
+    entries = {}
+    for path in pending():
+        if f"-{sheet}-" not in os.path.basename(path):
+            continue
+        entry = load(path)
+        if entry is not None and entry.sheet == sheet:
+            entries[entry.demo_key] = entry
+    if not entries:
+        return None
+    return pd.concat([schema.apply_schema(entry.rows.copy(), entry.frame) for entry in entries.values()],
+                     ignore_index=True)
+
+
+def batch_name(paths: list) -> str:
+    """Name the batch of queue files a commit writes, the same files always give the same name.
+
+    :param paths: queue files, oldest first
+    :type paths: list
+    :return: time of the newest file and a hash of the file names
+    :rtype: str
+    """
+    names = [os.path.basename(path) for path in paths]
+    digest = hashlib.sha1("\n".join(names).encode()).hexdigest()[:12]
+    return f"{names[-1].split('-', 1)[0]}-{digest}"
+
+
+def commit() -> int | None:
+    """Write every queued append to the archive in one rewrite.
+
+    The queue files present when the commit starts are read, a demo and sheet queued more than once is appended once
+    with its newest rows, and files queued while the commit runs are left for the next one. Each sheet with appends is
+    read once and all its demos are added together, a demo queued again while they are read has the queue read again.
+    Rows older than the hot window are moved to the cold files first, so the workbook stays a few months long.
+
+    A journal names the batch and its files before anything is written, and the batch is recorded in the workbook's
+    log sheet in the same save as the rows. A commit cut short is then finished by the next one if the workbook was
+    saved, its files are removed without being appended again, or undone if it wasn't, its cold files are removed.
+
+    :return: appends written, None if the archive is open, another committer holds the lock or the queue kept changing
+    :rtype: int | None
+    """
+    if not pending() and not os.path.exists(journal_path()):
+        return 0
+    if archive_open() or not acquire_lock():
+        return None
+
+    try:
+        with heartbeat():
+            _recover()
+            for _ in range(READ_ATTEMPTS):
+                paths = pending()
+                entries, sheets = _prepare(paths)
+                if not entries:
+                    return 0
+                # a demo queued again while the sheets were read would be appended twice, so the queue is read again
+                if not _superseded(paths):
+                    return _write(paths, entries, sheets)
+                logger.info("A queued append was superseded while the archive was read, reading the queue again")
+            return None
+    finally:
+        release_lock()
+
+
+def _key(path: str) -> tuple:
+    # queue files are named <time>-<id>-<sheet>-<demo>.csv
+    _, _, sheet, demo_key = os.path.basename(path)[:-len(QUEUE_EXT)].split('-', 3)
+    return sheet, demo_key
+
+
+def _superseded(paths: list) -> bool:
+    """Check if a demo and sheet of the read queue files was queued again since they were listed."""
+    read = set(paths)
+    keys = {_key(path) for path in paths}
+    return any(_key(path) in keys for path in pending() if path not in read)
+
+
+def _recover() -> None:
+    """Finish or undo the commit of a journal left by a committer that stopped, see commit."""
+    try:
+        with open(journal_path(), 'r') as file:
+            journal = json.load(file)
+    except FileNotFoundError:
+        return
+
+    if journal["batch"] in _logged_batches():
+        logger.warning("The archive commit of batch %s was saved but not finished, removing its queue files",
+                       journal["batch"])
+        _remove(journal["paths"])
+    else:
+        logger.warning("The archive commit of batch %s wasn't saved, removing its cold files", journal["batch"])
+        archive_tiers.remove_cold(journal["batch"])
+    os.remove(journal_path())
+
+
+def _logged_batches() -> set:
+    try:
+        log = pd.read_excel(const.ARCHIVE_PATH, sheet_name=LOG_SHEET, dtype=object)
+    except ValueError:
+        # no log sheet yet
+        return set()
+    return set(log["Batch"].astype(str))
+
+
+def _log_batch(book, batch: str, appends: int) -> None:
+    """Add a batch to the workbook's hidden log sheet, it is saved with the rows of the batch."""
+    if LOG_SHEET in book.sheetnames:
+        log = book[LOG_SHEET]
+    else:
+        log = book.create_sheet(LOG_SHEET)
+        log.sheet_state = 'hidden'
+        log.append(["Batch", "Committed", "Appends"])
+    log.append([batch, time.strftime('%m/%d/%Y %H:%M'), appends])
+    if log.max_row > LOG_ROWS + 1:
+        log.delete_rows(2, log.max_row - LOG_ROWS - 1)
+
+
+def _remove(paths: list) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _prepare(paths: list) -> tuple:
+    """Read queue files and build the sheets they are written to, see commit.
+
+    :param paths: queue files, oldest first
+    :type paths: list
+    :return: ({(sheet, demo): newest entry}, {sheet: (rows kept in the workbook, rows for the cold files)})
+    :rtype: tuple
+    """
+    entries = {}
+    for path in paths:
+        entry = load(path)
+        if entry is not None:
+            # the newest entry of a demo and sheet wins, the older ones are superseded and only removed
+            entries[(entry.sheet, entry.demo_key)] = entry
+
+    by_sheet = {}
+    for entry in entries.values():
+        by_sheet.setdefault(entry.sheet, []).append(entry)
+
+    cutoff = archive_tiers.hot_cutoff()
+    sheets = {}
+    for sheet, sheet_entries in by_sheet.items():
+        current = schema.read_excel(const.ARCHIVE_PATH, sheet, sheet_entries[0].frame)
+        rows = [entry.rows[[col for col in entry.rows.columns if col in current.columns]] if entry.restrict
+                else entry.rows for entry in sheet_entries]
+        data = pd.concat([current, *rows], ignore_index=True)
+        if "Date" in data.columns:
+            data["Date"] = pd.to_datetime(data["Date"]).dt.strftime('%m/%d/%Y')
+        sheets[sheet] = archive_tiers.split(data, cutoff)
+    return entries, sheets
+
+
+def _write(paths: list, entries: dict, sheets: dict) -> int:
+    """Write prepared sheets to the cold files and the archive, then remove the queue files, see commit."""
+    batch = batch_name(paths)
+    journal = {"batch": batch, "paths": paths, "time": time.time()}
+    tmp_path = journal_path() + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(journal, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, journal_path())
+
+    for sheet, (_, cold) in sheets.items():
+        archive_tiers.write_cold(sheet, cold, batch)
+
+    with pd.ExcelWriter(const.ARCHIVE_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+        for sheet, (data, _) in sheets.items():
+            data.to_excel(writer, sheet_name=sheet, index=False)
+        _log_batch(writer.book, batch, len(entries))
+
+    _remove(paths)
+    os.remove(journal_path())
+    logger.info("Archived %s", ', '.join(f"{entry.sheet} for {entry.demo_key}" for entry in entries.values()))
+    return len(entries)
+
+
+# --------------------- COMMITTER --------------------- #
+class ArchiveCommitter:
+    def __init__(self, retry_seconds: float = RETRY_SECONDS):
+        """Initialize ArchiveCommitter.
+
+        Writes queued appends on a background thread as soon as the archive is free, trying again every retry_seconds
+        while it is open or locked and straight away when something is queued.
+
+        :param retry_seconds: seconds between tries (default RETRY_SECONDS)
+        :type retry_seconds: float
+        """
+        self.retry_seconds = retry_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._commit_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the committer thread, does nothing if it is running.
+
+        :return: None
+        :rtype: None
+        """
+        with self._start_lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._wake.set()
+            self._thread = threading.Thread(target=self._loop, name="archive-committer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the committer, a rewrite that is running finishes first so the archive isn't left half written.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        left = len(pending())
+        if left:
+            logger.info("%d archive appends are still queued, they are written the next time the app runs", left)
+
+    def wake(self) -> None:
+        """Try to write the queue now instead of at the next retry.
+
+        :return: None
+        :rtype: None
+        """
+        self.start()
+        self._wake.set()
+
+    def commit(self) -> int | None:
+        """Write the queue once, see commit.
+
+        :return: appends written, None if the archive isn't free
+        :rtype: int | None
+        """
+        with self._commit_lock:
+            try:
+                return commit()
+            except Exception as e:
+                # the queue files are kept, the next try writes them
+                logger.error("Archive commit error %s", repr(e))
+                return None
+
+    def flush(self, timeout: float = FLUSH_SECONDS) -> bool:
+        """Wait a while for the queue to be written.
+
+        :param timeout: most seconds to wait (default FLUSH_SECONDS)
+        :type timeout: float
+        :return: whether the queue is empty
+        :rtype: bool
+        """
+        self.wake()
+        deadline = time.monotonic() + timeout
+        while pending():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.retry_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.commit()
+
+
+COMMITTER = ArchiveCommitter()
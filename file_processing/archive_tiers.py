@@ -0,0 +1,338 @@
+from __future__ import annotations
+import os
+import glob
+import json
+import datetime
+import threading
+import pandas as pd
+import file_processing.schema as schema
+import file_processing.file_paths as const
+from file_processing.settings import SETTINGS
+from logs.log import logger
+
+# rows older than the hot window leave the archive workbook for compressed files, one folder per sheet and month and
+# one file per move, named after the batch of queued appends that moved them (see archive_queue.batch_name)
+COLD_EXT = ".csv.gz"
+DATE_FORMAT = '%m/%d/%Y'
+
+
+def cold_root() -> str:
+    """Build the folder of the cold files.
+
+    :return: path to the folder, next to the archive so every operator reads the same history
+    :rtype: str
+    """
+    return os.path.splitext(const.ARCHIVE_PATH)[0] + "_cold"
+
+
+def cold_dir(sheet: str) -> str:
+    """Build the folder of a sheet's cold files.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :return: path to the folder
+    :rtype: str
+    """
+    return os.path.join(cold_root(), sheet)
+
+
+def month_dir(sheet: str, month: pd.Period) -> str:
+    """Build the folder of a sheet's cold files for a month.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :param month: month of the rows
+    :type month: pd.Period
+    :return: path to the folder, e.g. Raw_Data/2025-03
+    :rtype: str
+    """
+    return os.path.join(cold_dir(sheet), month.strftime('%Y-%m'))
+
+
+def cold_path(sheet: str, month: pd.Period, batch: str) -> str:
+    """Build the path of the rows of a sheet and month one move put in the cold files.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :param month: month of the rows
+    :type month: pd.Period
+    :param batch: move the rows came from, see archive_queue.batch_name
+    :type batch: str
+    :return: path to the .csv.gz file
+    :rtype: str
+    """
+    return os.path.join(month_dir(sheet, month), f"{batch}{COLD_EXT}")
+
+
+def cold_months(sheet: str) -> list:
+    """List the months a sheet has cold files for, oldest first.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :return: months
+    :rtype: list
+    """
+    try:
+        names = os.listdir(cold_dir(sheet))
+    except FileNotFoundError:
+        return []
+    months = []
+    for name in names:
+        try:
+            months.append(pd.Period(name, freq='M'))
+        except ValueError:
+            continue
+    return sorted(months)
+
+
+def cold_paths(sheet: str, month: pd.Period) -> list:
+    """List a sheet's cold files for a month in the order they were moved.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :param month: month of the rows
+    :type month: pd.Period
+    :return: paths to the .csv.gz files
+    :rtype: list
+    """
+    folder = month_dir(sheet, month)
+    names = [name for name in os.listdir(folder) if name.endswith(COLD_EXT)]
+    names.sort(key=lambda name: int(name.split('-', 1)[0]) if name.split('-', 1)[0].isdigit() else 0)
+    return [os.path.join(folder, name) for name in names]
+
+
+def cold_files(sheet: str) -> dict:
+    """List every cold file of a sheet, oldest month first.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :return: path relative to the sheet's folder: size and modified time, which change if a move rewrites the file
+    :rtype: dict
+    """
+    files = {}
+    for month in cold_months(sheet):
+        for path in cold_paths(sheet, month):
+            stat = os.stat(path)
+            files[os.path.relpath(path, cold_dir(sheet))] = f"{stat.st_size}-{stat.st_mtime_ns}"
+    return files
+
+
+def hot_cutoff(months: int = None, today: datetime.date = None) -> pd.Timestamp | None:
+    """Find the first day kept in the archive workbook.
+
+    :param months: months kept, the current one included (default the Archive Hot Months setting)
+    :type months: int
+    :param today: day the window ends (default today)
+    :type today: datetime.date
+    :return: first day of the oldest hot month, None if tiering is off
+    :rtype: pd.Timestamp | None
+    """
+    months = months if months is not None else SETTINGS.archive_hot_months
+    if not months:
+        return None
+    return (pd.Period(today or datetime.date.today(), freq='M') - (months - 1)).to_timestamp()
+
+
+# --------------------- TIERING --------------------- #
+def split(data: pd.DataFrame, cutoff: pd.Timestamp | None) -> tuple:
+    """Split archive rows into the ones that stay in the workbook and the ones that go to the cold files.
+
+    Rows without a readable date stay in the workbook, where someone can fix them.
+
+    :param data: rows of an archive sheet
+    :type data: pd.DataFrame
+    :param cutoff: first day kept in the workbook, None keeps everything
+    :type cutoff: pd.Timestamp | None
+    :return: (hot rows, cold rows)
+    :rtype: tuple
+    """
+    if cutoff is None or "Date" not in data.columns:
+        return data, data.iloc[:0]
+    cold = (pd.to_datetime(data["Date"], errors='coerce') < cutoff).to_numpy()
+    return data[~cold], data[cold]
+
+
+def write_cold(sheet: str, rows: pd.DataFrame, batch: str) -> int:
+    """Put rows moved out of the workbook in the sheet's cold files, one file per month.
+
+    Each month's rows go to one file named after the move. A move tried again replaces the file of its first try
+    instead of adding to it, rows already in the cold files are never compared or dropped.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :param rows: rows to move, they need a Date
+    :type rows: pd.DataFrame
+    :param batch: name of the move, see archive_queue.batch_name
+    :type batch: str
+    :return: rows written
+    :rtype: int
+    """
+    if not len(rows):
+        return 0
+    rows = rows.copy()
+    dates = pd.to_datetime(rows["Date"])
+    rows["Date"] = dates.dt.strftime(DATE_FORMAT)
+
+    for month, month_rows in rows.groupby(dates.dt.to_period('M').to_numpy(), sort=True):
+        os.makedirs(month_dir(sheet, month), exist_ok=True)
+        path = cold_path(sheet, month, batch)
+        tmp_path = path + ".tmp"
+        month_rows.to_csv(tmp_path, index=False, compression='gzip')
+        os.replace(tmp_path, path)
+    logger.info("Moved %d %s rows to the cold archive", len(rows), sheet)
+    return len(rows)
+
+
+def remove_cold(batch: str) -> int:
+    """Remove the cold files a move wrote, for a move whose rows were never taken out of the workbook.
+
+    :param batch: name of the move, see archive_queue.batch_name
+    :type batch: str
+    :return: files removed
+    :rtype: int
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(glob.escape(cold_root()), '*', '*', f"{glob.escape(batch)}{COLD_EXT}")):
+        os.remove(path)
+        removed += 1
+    return removed
+
+
+# --------------------- QUERY --------------------- #
+def query(sheet: str, frame: str, start: datetime.date = None, end: datetime.date = None,
+          usecols=None) -> pd.DataFrame:
+    """Read an archive sheet across the workbook and the cold files, oldest rows first.
+
+    Only the cold files of the months between start and end are opened. A reader that goes over the whole history
+    every time the archive changes keeps a ColdSummary instead.
+
+    :param sheet: archive sheet
+    :type sheet: str
+    :param frame: registered schema of the sheet (see schema.SCHEMAS)
+    :type frame: str
+    :param start: first date wanted (default the oldest)
+    :type start: datetime.date
+    :param end: last date wanted (default the newest)
+    :type end: datetime.date
+    :param usecols: columns wanted, a list or a function of the column name as for pd.read_excel (default all)
+    :type usecols: list | callable
+    :return: rows of the sheet
+    :rtype: pd.DataFrame
+    """
+    wanted = usecols if usecols is None or callable(usecols) else set(usecols).__contains__
+    filtered = start is not None or end is not None
+    read_cols = None if wanted is None else (lambda col: wanted(col) or (filtered and col == "Date"))
+
+    months = cold_months(sheet)
+    if start is not None:
+        months = [month for month in months if month >= pd.Period(start, freq='M')]
+    if end is not None:
+        months = [month for month in months if month <= pd.Period(end, freq='M')]
+    parts = [schema.read_csv(path, frame, usecols=read_cols) for month in months for path in cold_paths(sheet, month)]
+    parts.append(schema.read_excel(const.ARCHIVE_PATH, sheet, frame, usecols=read_cols))
+    data = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    # sheets gain columns over time, rows from before a column existed have it blank
+    data = schema.apply_schema(data, frame)
+
+    if filtered:
+        dates = pd.to_datetime(data["Date"], errors='coerce')
+        keep = pd.Series(True, index=data.index)
+        if start is not None:
+            keep &= dates >= pd.Timestamp(start)
+        if end is not None:
+            keep &= dates <= pd.Timestamp(end)
+        data = data[keep.to_numpy()].reset_index(drop=True)
+        if wanted is not None and not wanted("Date"):
+            data = data.drop(columns="Date")
+    return data
+
+
+# --------------------- SUMMARY --------------------- #
+class ColdSummary:
+    def __init__(self, name: str, sheet: str, frame: str, reduce, columns: list = None):
+        """Initialize ColdSummary, the rows of a sheet's history a reader keeps, updated one cold file at a time.
+
+        Cold files don't change once written, so a reader that only needs some of the history, e.g. the latest row of
+        every address, keeps those rows of the cold files and reads only the cold files added since and the workbook,
+        instead of every file each time the archive changes.
+
+        :param name: name of the summary, it is saved next to the settings as <name>.csv
+        :type name: str
+        :param sheet: archive sheet
+        :type sheet: str
+        :param frame: registered schema of the sheet (see schema.SCHEMAS)
+        :type frame: str
+        :param reduce: function keeping the rows the reader needs of a frame, oldest rows first. It is given the rows
+            it kept before with the new rows after them, so it must keep the same rows as when given everything at once
+        :type reduce: callable
+        :param columns: columns kept (default all)
+        :type columns: list
+        """
+        self.name = name
+        self.sheet = sheet
+        self.frame = frame
+        self.reduce = reduce
+        self.columns = columns
+        self.path = os.path.join(os.path.dirname(const.SETTINGS_PATH), f"{name}.csv")
+        self._lock = threading.Lock()
+
+    def _usecols(self):
+        return None if self.columns is None else set(self.columns).__contains__
+
+    def _read(self) -> tuple:
+        # the first line lists the cold files the rows were kept from, the rest is the CSV
+        try:
+            with open(self.path, 'r', newline='', encoding='utf-8') as file:
+                files = json.loads(file.readline())
+                data = pd.read_csv(file, dtype=object, keep_default_na=False)
+        except FileNotFoundError:
+            return {}, None
+        except ValueError as e:
+            logger.warning("The %s summary can't be read and is rebuilt %s", self.name, repr(e))
+            return {}, None
+        return files, schema.apply_schema(data, self.frame)
+
+    def _write(self, files: dict, data: pd.DataFrame) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as file:
+            file.write(json.dumps(files) + "\n")
+            data.to_csv(file, index=False)
+        os.replace(tmp_path, self.path)
+
+    def cold(self) -> pd.DataFrame:
+        """Get the kept rows of the cold files, reading only the files added since the last call.
+
+        If a kept file was removed or rewritten, every cold file is read again.
+
+        :return: kept rows
+        :rtype: pd.DataFrame
+        """
+        with self._lock:
+            files = cold_files(self.sheet)
+            kept_files, kept = self._read()
+            if kept is None or any(files.get(name) != signature for name, signature in kept_files.items()):
+                kept_files, kept = {}, None
+            new = [name for name in files if name not in kept_files]
+            if kept is not None and not new:
+                return kept
+
+            parts = [] if kept is None else [kept]
+            parts += [schema.read_csv(os.path.join(cold_dir(self.sheet), name), self.frame, usecols=self._usecols())
+                      for name in new]
+            if not parts:
+                data = schema.apply_schema(pd.DataFrame(columns=self.columns or []), self.frame)
+            else:
+                data = self.reduce(schema.apply_schema(pd.concat(parts, ignore_index=True), self.frame))
+            data = data.reset_index(drop=True)
+            self._write(files, data)
+            logger.info("%s summary read %d cold files, %d rows kept", self.name, len(new), len(data))
+            return data
+
+    def rows(self) -> pd.DataFrame:
+        """Get the kept rows of the cold files followed by every row of the workbook, oldest first.
+
+        :return: rows with the sheet's schema applied
+        :rtype: pd.DataFrame
+        """
+        hot = schema.read_excel(const.ARCHIVE_PATH, self.sheet, self.frame, usecols=self._usecols())
+        return schema.apply_schema(pd.concat([self.cold(), hot], ignore_index=True), self.frame)
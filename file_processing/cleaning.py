@@ -0,0 +1,164 @@
+from __future__ import annotations
+import re
+import numpy as np
+import pandas as pd
+from logs.log import logger
+
+UNKNOWN = "[Unknown]"
+
+
+class Rule:
+    def __init__(self, name: str, pattern: str = None, repl: str = '', func=None):
+        """Initialize Rule, one cleaning step for the values of a column.
+
+        Either a regex substitution (pattern and repl) or a function from value to cleaned value.
+
+        :param name: name the cells it changes are counted under
+        :type name: str
+        :param pattern: regex to replace, compiled once here (default None)
+        :type pattern: str
+        :param repl: replacement for the regex (default '')
+        :type repl: str
+        :param func: function from value to cleaned value (default None)
+        :type func: callable
+        """
+        if (pattern is None) == (func is None):
+            raise ValueError(f"Rule {name} needs either a pattern or a function")
+        self.name = name
+        self.regex = None if pattern is None else re.compile(pattern)
+        self.repl = repl
+        self.func = func
+
+    def __call__(self, value: str) -> str:
+        if self.regex is not None:
+            return self.regex.sub(self.repl, value)
+        return self.func(value)
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+def _proper_case(name: str) -> str:
+    # only names typed all upper or all lower case, so McDonald or DeLuca aren't flattened to Mcdonald or Deluca
+    return name.title() if name.isupper() or name.islower() else name
+
+
+def _uniquify(string: str, splitter: str = " ") -> str:
+    output = []
+    seen = set()
+    for word in string.split(splitter):
+        if word not in seen or word == '/':
+            output.append(word)
+            seen.add(word)
+
+    if splitter != " ":
+        for item in output:
+            for thing in seen:
+                if item != thing and item in thing:
+                    try:
+                        output.remove(item)
+                    except ValueError:
+                        pass
+
+    return splitter.join(output)
+
+
+def _dedupe_description(desc: str) -> str:
+    # remove repeated sections, then repeated words within each section
+    sections = _uniquify(desc, splitter=" / ").split(" / ")
+    return " / ".join(_uniquify(section) for section in sections)
+
+
+# --------------------- RULES --------------------- #
+PROPER_CASE = Rule("proper_case", func=_proper_case)
+UNKNOWN_IF_BLANK = Rule("unknown_last_name", func=lambda value: UNKNOWN if value == '' else value)
+DEDUPE_DESCRIPTION = Rule("duplicate_description", func=_dedupe_description)
+BLANK_UNKNOWN = Rule("unknown_placeholder", pattern=r"^\[Unknown\]$")
+NO_INDIVIDUAL = Rule("individual_company", pattern=r"Individual")
+TITLE_SLASH = Rule("title_slash", pattern=r"/", repl=" ")
+EXTRA_SPACES = Rule("extra_spaces", pattern=r"\s+", repl=" ")
+
+# column: rules in the order they are applied
+SFDC_RULES = {
+    "FirstName": [PROPER_CASE],
+    "LastName": [PROPER_CASE, UNKNOWN_IF_BLANK],
+    "Current Secondary Description": [DEDUPE_DESCRIPTION],
+}
+
+# the [Unknown] placeholders come over from sfdc with the transferred fields
+UDB_RULES = {
+    "FirstName": [BLANK_UNKNOWN],
+    "LastName": [BLANK_UNKNOWN],
+    "State": [BLANK_UNKNOWN],
+    "PhoneNumber": [BLANK_UNKNOWN],
+    "PhoneExt": [BLANK_UNKNOWN],
+    "Company": [BLANK_UNKNOWN, NO_INDIVIDUAL],
+    "CustomerTitle": [BLANK_UNKNOWN, TITLE_SLASH, EXTRA_SPACES],
+}
+
+
+def clean_column(values: pd.Series, rules: list) -> tuple:
+    """Run a column's rules in one pass over its distinct values.
+
+    The rules are fused into a single function that is called once per distinct value, the results are mapped back
+    onto the rows by their codes.
+
+    :param values: column to clean
+    :type values: pd.Series
+    :param rules: rules in the order they are applied
+    :type rules: list
+    :return: cleaned column, cells each rule changed
+    :rtype: tuple
+    """
+    codes, uniques = pd.factorize(values.astype(object), sort=False)
+    occurrences = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+    cleaned = np.empty(len(uniques), dtype=object)
+    touched = np.zeros((len(rules), len(uniques)), dtype=bool)
+    for i, value in enumerate(uniques):
+        if isinstance(value, str):
+            for r, rule in enumerate(rules):
+                new = rule(value)
+                touched[r, i] = new != value
+                value = new
+        cleaned[i] = value
+
+    result = pd.Series(cleaned.take(codes), index=values.index)
+    if (codes < 0).any():
+        result[codes < 0] = values[codes < 0]
+
+    counts = {rule.name: int(occurrences[touched[r]].sum()) for r, rule in enumerate(rules)}
+    return result, counts
+
+
+def apply_rules(data: pd.DataFrame, rules: dict, name: str = "") -> dict:
+    """Clean the columns of a frame in place.
+
+    Columns missing from the frame are skipped. The dtype of each column is kept.
+
+    :param data: frame to clean
+    :type data: pd.DataFrame
+    :param rules: column: rules in the order they are applied, e.g. SFDC_RULES
+    :type rules: dict
+    :param name: name of the frame, used in the log (default "")
+    :type name: str
+    :return: rule name: cells it changed, over every column
+    :rtype: dict
+    """
+    totals = {}
+    for col, col_rules in rules.items():
+        if col not in data.columns:
+            continue
+        result, counts = clean_column(data[col], col_rules)
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            result = result.astype("category")
+            if '' not in result.cat.categories:
+                result = result.cat.add_categories([''])
+        else:
+            result = result.astype(data[col].dtype)
+        data[col] = result
+        for rule, count in counts.items():
+            totals[rule] = totals.get(rule, 0) + count
+
+    logger.info("%s cleaning: %s", name, totals)
+    return totals
@@ -1,19 +1,24 @@
-import os
-import re
-import json
-import file_processing.file_paths as demo_paths
+from file_processing.settings import SETTINGS
 
-with open(demo_paths.SETTINGS_PATH, 'r') as file:
-    settings = json.load(file)
+# module attribute: Settings accessor, looked up on every use so changes to the settings file apply without a restart
+SETTINGS_ACCESSORS = {
+    "ACCESS_PATH": "access_path",
+    "RAW_DATA_PATH": "raw_data_path",
+    "RAW_DATA_SHEET": "raw_data_sheet",
+    "ACCESS_TBL": "access_table",
+    "ACCESS_FORM": "access_form",
+    "SF_UPLOAD": "sf_upload",
+    "SF_EXCLUDE": "sf_exclude",
+    "UDB_UPLOAD": "udb_upload",
+    "UDB_EXCLUDE": "udb_exclude",
+    "DEMO_DEST_PATH": "demo_dest_path",
+    "SOP_PATH": "sop_path",
+}
 
-ACCESS_PATH = settings["Access Database Path"]
-RAW_DATA_PATH = settings["Raw Data Path"]
-RAW_DATA_SHEET = settings["Raw Data Sheet Name"]
-ACCESS_TBL = settings["Import Access Table Name"]
-ACCESS_FORM = settings["Access Form Name"]
-SF_UPLOAD = settings["SF Upload File Name"]
-SF_EXCLUDE = settings["SF Exclude File Name"]
-UDB_UPLOAD = settings["UDB Upload File Name"]
-UDB_EXCLUDE = settings["UDB Exclude File Name"]
-DEMO_DEST_PATH = settings["Demo Folder Destination Path"]
-SOP_PATH = settings["Demo SOP Path"]
+
+def __getattr__(name: str):
+    if name == "settings":
+        return SETTINGS.all()
+    if name in SETTINGS_ACCESSORS:
+        return getattr(SETTINGS, SETTINGS_ACCESSORS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,236 @@
+from __future__ import annotations
+import os
+import numpy as np
+import pandas as pd
+import file_processing.demo as demo
+import file_processing.schema as schema
+import file_processing.constants as demo_c
+import file_processing.file_paths as const
+from file_processing.keys import normalize_email
+from logs.log import logger
+from logs import metrics
+
+# personal mail providers, their domain says nothing about the company
+FREE_MAIL = frozenset({
+    "gmail.com", "googlemail.com", "yahoo.com", "ymail.com", "hotmail.com", "outlook.com", "live.com", "msn.com",
+    "aol.com", "icloud.com", "me.com", "mac.com", "comcast.net", "att.net", "verizon.net", "sbcglobal.net",
+    "protonmail.com", "proton.me", "gmx.com", "mail.com",
+})
+
+# legal suffixes left off company names so "Acme, Inc." and "ACME" block together
+ORG_SUFFIXES = r"\b(?:the|inc|incorporated|llc|llp|ltd|limited|corp|corporation|co|company|pc|pa|pllc)\b"
+
+MAX_BLOCK = 50  # larger blocks are a shared value (e.g. a switchboard phone), not one person, and are skipped
+MIN_PHONE_DIGITS = 7
+
+EMAIL = "email"
+NAME_DOMAIN = "name + domain"
+NAME_COMPANY = "name + company"
+PHONE = "phone"
+
+
+def duplicates_path(demo_obj: demo.Demo) -> str:
+    """Build the path of the demo's duplicate report.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: path to the .csv file
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-Duplicates.csv")
+
+
+def _plain(values: pd.Series) -> pd.Series:
+    return values.astype(str).str.lower().str.replace(r"[^a-z0-9]", '', regex=True)
+
+
+def _key(*parts: pd.Series) -> pd.Series:
+    """Join key parts, blank if any part is blank so records missing a value never block together."""
+    key = parts[0]
+    blank = parts[0] == ''
+    for part in parts[1:]:
+        key = key + '|' + part
+        blank |= part == ''
+    return key.where(~blank, '')
+
+
+def blocking_keys(data: pd.DataFrame) -> dict:
+    """Build the blocking keys of raw registrations, records sharing a key are compared with each other.
+
+    :param data: raw registrations
+    :type data: pd.DataFrame
+    :return: block name: key per row, '' where the row has no key
+    :rtype: dict
+    """
+    email = normalize_email(data["Email Address"])
+    last = _plain(data["Last Name"])
+    initial = _plain(data["First Name"]).str[:1]
+    domain = email.str.partition('@')[2]
+    domain = domain.where(~domain.isin(FREE_MAIL), '')
+    company = data["Organization"].astype(str).str.lower().str.replace(ORG_SUFFIXES, '', regex=True)
+    company = company.str.replace(r"[^a-z0-9]", '', regex=True)
+    phone = data["Phone"].astype(str).str.replace(r"\D", '', regex=True).str[-10:]
+    phone = phone.where(phone.str.len() >= MIN_PHONE_DIGITS, '')
+    return {
+        EMAIL: email,
+        NAME_DOMAIN: _key(last, initial, domain),
+        NAME_COMPANY: _key(last, initial, company),
+        PHONE: _key(last, initial, phone),
+    }
+
+
+def _agree(a: str, b: str) -> bool:
+    """Check two first names, equal or one is the other's initial ("J" and "John", not "John" and "Jim")."""
+    return a == b or (len(a) == 1 and b.startswith(a)) or (len(b) == 1 and a.startswith(b))
+
+
+def _first_names_agree(first: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Check first names pairwise, see _agree."""
+    return np.array([_agree(a, b) for a, b in zip(first, other)], dtype=bool)
+
+
+def _clusters_agree(names: set, other: set) -> bool:
+    """Check that every first name of a cluster agrees with every first name of another.
+
+    Comparing only the two rows that matched would let an initial bridge two people, "J Smith" matches both
+    "John Smith" and "Jane Smith" but they aren't the same person.
+    """
+    return all(_agree(a, b) for a in names for b in other)
+
+
+def _root(parent: np.ndarray, i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_duplicates(data: pd.DataFrame) -> pd.DataFrame:
+    """Group the registrations that are the same person.
+
+    Each row is compared only with the first row of every block it's in, so the work grows with the number of rows
+    rather than the number of pairs. Matches are joined into clusters with a union-find, a person who registered with
+    a work and a personal address and a typo'd domain ends up in one cluster. Two clusters are only joined when every
+    first name in one agrees with every first name in the other.
+
+    :param data: raw registrations
+    :type data: pd.DataFrame
+    :return: one row per registration in a cluster of more than one - Row (position in data), Cluster, Survivor,
+        Matched On
+    :rtype: pd.DataFrame
+    """
+    n = len(data)
+    parent = np.arange(n)
+    names = {}  # first names per cluster root, only kept for clusters of more than one row
+    matched = {}
+    first = _plain(data["First Name"]).to_numpy(dtype=object)
+
+    for block, keys in blocking_keys(data).items():
+        rows = pd.DataFrame({"key": keys.to_numpy(), "row": np.arange(n)})
+        rows = rows[rows["key"] != '']
+        size = rows.groupby("key")["row"].transform('size')
+        skipped = rows.loc[size > MAX_BLOCK, "key"].nunique()
+        if skipped:
+            logger.debug("%d %s blocks were too large to compare", skipped, block)
+        rows = rows[(size > 1) & (size <= MAX_BLOCK)]
+        anchor = rows.groupby("key")["row"].transform('first').to_numpy()
+        row = rows["row"].to_numpy()
+        pairs = anchor != row
+        anchor, row = anchor[pairs], row[pairs]
+        if block != EMAIL:
+            agree = _first_names_agree(first[anchor], first[row])
+            anchor, row = anchor[agree], row[agree]
+
+        for a, b in zip(anchor.tolist(), row.tolist()):
+            root_a, root_b = _root(parent, a), _root(parent, b)
+            if root_a != root_b:
+                names_a = names.get(root_a) or {first[root_a]}
+                names_b = names.get(root_b) or {first[root_b]}
+                # the same email is the same person whatever name they typed
+                if block != EMAIL and not _clusters_agree(names_a, names_b):
+                    continue
+                keep, gone = min(root_a, root_b), max(root_a, root_b)
+                parent[gone] = keep
+                names.pop(gone, None)
+                names[keep] = names_a | names_b
+            matched.setdefault(a, set()).add(block)
+            matched.setdefault(b, set()).add(block)
+
+    clusters = np.array([_root(parent, i) for i in range(n)], dtype=np.int64)
+    sizes = np.bincount(clusters, minlength=n)
+    members = np.flatnonzero(sizes[clusters] > 1)
+    if not len(members):
+        return pd.DataFrame({"Row": [], "Cluster": [], "Survivor": [], "Matched On": []})
+
+    report = pd.DataFrame({
+        "Row": members,
+        "Cluster": clusters[members],
+        "Attended": (data["Attended"].astype(str).to_numpy() == "Yes")[members],
+    })
+    # the survivor is the first attended registration of the person, or their first registration if none attended
+    order = report.sort_values(["Cluster", "Attended", "Row"], ascending=[True, False, True])
+    report["Survivor"] = ~order["Cluster"].duplicated().reindex(report.index)
+    report["Matched On"] = [", ".join(sorted(matched.get(row, ()))) for row in members]
+    # number clusters from 1 in the order they appear
+    report["Cluster"] = pd.factorize(report["Cluster"])[0] + 1
+    return report.drop(columns="Attended")
+
+
+# --------------------- STAGE --------------------- #
+@metrics.timed
+def flag_duplicates(demo_obj: demo.Demo) -> pd.DataFrame:
+    """Find the people who registered more than once and save them for review.
+
+    Internal records are left out, they are counted and removed on their own. The report lists every registration of
+    each duplicated person, the ones that aren't the survivor are counted as duplicates of their audience and taken
+    out of the sfdc upload in sfdc_pre_val.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: duplicate report
+    :rtype: pd.DataFrame
+    """
+    data = schema.read_excel(demo_c.RAW_DATA_PATH, demo_c.RAW_DATA_SHEET, "raw")
+    metrics.count_rows(rows_in=len(data))
+    internal = data["Email Address"].str.contains('|'.join(const.INTERNAL))
+    data = data[~internal].reset_index(drop=True)
+
+    found = find_duplicates(data)
+    report = pd.concat([found[["Cluster", "Survivor", "Matched On"]].reset_index(drop=True),
+                        data.loc[found["Row"], ["Attended", "Email Address", "First Name", "Last Name", "Organization",
+                                                "Phone"]].reset_index(drop=True)], axis=1)
+    report["Survivor"] = np.where(report["Survivor"].astype(bool), "Yes", "No")
+    report = report.sort_values(["Cluster", "Survivor"], ascending=[True, False], kind='mergesort')
+
+    extra = report[report["Survivor"] == "No"]
+    a_duplicates = int((extra["Attended"] == "Yes").sum())
+    na_duplicates = int((extra["Attended"] == "No").sum())
+    demo_obj.counts.update_counts(a_duplicates=a_duplicates, na_duplicates=na_duplicates)
+    logger.info("%d people registered more than once, %d attendee and %d nonattendee duplicates",
+                report["Cluster"].nunique(), a_duplicates, na_duplicates)
+
+    os.makedirs(demo_obj.destination_path, exist_ok=True)
+    report.to_csv(duplicates_path(demo_obj), index=False)
+    metrics.count_rows(rows_out=len(report))
+    return report
+
+
+def duplicate_emails(demo_obj: demo.Demo) -> pd.Series:
+    """Read the emails of the registrations that duplicate a survivor with a different email.
+
+    Registrations with the same email as their survivor can't be told apart downstream, so they aren't listed.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: normalized emails, empty if the demo has no duplicate report
+    :rtype: pd.Series
+    """
+    try:
+        report = pd.read_csv(duplicates_path(demo_obj), dtype=str, keep_default_na=False)
+    except FileNotFoundError:
+        return pd.Series([], dtype=str)
+    emails = normalize_email(report["Email Address"])
+    survivors = emails[report["Survivor"] == "Yes"]
+    duplicates = emails[(report["Survivor"] == "No") & ~emails.isin(survivors)]
+    return duplicates.drop_duplicates().reset_index(drop=True)
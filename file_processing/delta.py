@@ -0,0 +1,192 @@
+from __future__ import annotations
+import os
+import json
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+import file_processing.archive as archive
+import file_processing.archive_queue as archive_queue
+import file_processing.archive_tiers as archive_tiers
+import file_processing.schema as schema
+import file_processing.file_paths as const
+from logs.log import logger
+from logs import metrics
+
+# delta modes
+OFF = "off"
+ROWS = "rows"  # leave out rows where nothing changed
+COLUMNS = "columns"  # also blank the unchanged values and leave out columns that changed for no row
+MODES = (OFF, ROWS, COLUMNS)
+
+LEAD_KEY = "Existing Lead ID"
+CONTACT_KEY = "Existing Contact ID"
+
+
+# latest archived uploads of every id, rebuilt whenever the archive changes
+LATEST_CACHE_PATH = os.path.join(os.path.dirname(const.SETTINGS_PATH), "latest_uploads.csv")
+KEPT_UPLOADS = 2  # uploads kept per id, so a demo processed again is compared with the upload before its own
+
+
+def _text(data: pd.DataFrame) -> np.ndarray:
+    return data.astype(object).where(data.notna(), '').astype(str).apply(lambda col: col.str.strip()).to_numpy()
+
+
+def _by_date(uploads: pd.DataFrame) -> pd.DataFrame:
+    # stable sort so uploads on the same date keep the order they were archived in
+    dates = pd.to_datetime(uploads["Date"], errors='coerce')
+    return uploads.iloc[np.argsort(dates.to_numpy(), kind='mergesort')]
+
+
+def _read_latest_cache(path: str) -> tuple:
+    # the first line is the archive signature the rows were read from, the rest is the CSV
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as file:
+            source = json.loads(file.readline())
+            data = pd.read_csv(file, dtype=object, keep_default_na=False)
+    except FileNotFoundError:
+        return None, None
+    except ValueError as e:
+        logger.warning("The latest uploads cache can't be read and is rebuilt %s", repr(e))
+        return None, None
+    return source, schema.apply_schema(data, "archive_sfdc")
+
+
+def _write_latest_cache(path: str, source: str, data: pd.DataFrame) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as file:
+        file.write(json.dumps(source) + "\n")
+        data.to_csv(file, index=False)
+    os.replace(tmp_path, path)
+
+
+def _keep_latest(uploads: pd.DataFrame) -> pd.DataFrame:
+    """Keep the last KEPT_UPLOADS uploads of every id, oldest first."""
+    uploads = _by_date(uploads)
+    kept = np.zeros(len(uploads), dtype=bool)
+    for key in (LEAD_KEY, CONTACT_KEY):
+        if key in uploads.columns:
+            has_key = (uploads[key] != '').to_numpy()
+            last = uploads[has_key].groupby(key, observed=True, sort=False).cumcount(ascending=False)
+            kept[np.flatnonzero(has_key)[(last < KEPT_UPLOADS).to_numpy()]] = True
+    return uploads[kept]
+
+
+# uploads of the cold archive, so a changed archive only has its new cold files and the workbook read
+COLD_SUMMARY = archive_tiers.ColdSummary("latest-uploads-cold", archive.SFDC_SHEET, "archive_sfdc", _keep_latest)
+
+_latest = None  # (archive signature, rows)
+_latest_lock = threading.Lock()
+
+
+def archived_latest() -> pd.DataFrame:
+    """Get the last KEPT_UPLOADS archived uploads of every SFDC ID, reading the archive again only when it changed.
+
+    The index is kept next to the settings so it survives a restart. It is rebuilt from the workbook and the uploads
+    kept of the cold files, see COLD_SUMMARY, so only the cold files added since are read.
+
+    :return: archived rows, oldest first
+    :rtype: pd.DataFrame
+    """
+    global _latest
+    with _latest_lock:
+        stat = os.stat(const.ARCHIVE_PATH)
+        source = f"{stat.st_size}-{stat.st_mtime_ns}"
+        if _latest is not None and _latest[0] == source:
+            return _latest[1]
+
+        cached_source, latest = _read_latest_cache(LATEST_CACHE_PATH)
+        if cached_source != source:
+            uploads = COLD_SUMMARY.rows()
+            latest = _keep_latest(uploads).reset_index(drop=True)
+            _write_latest_cache(LATEST_CACHE_PATH, source, latest)
+            logger.info("Latest uploads index rebuilt, %d of %d archived uploads kept", len(latest), len(uploads))
+        _latest = (source, latest)
+        return latest
+
+
+@metrics.timed
+def latest_uploads(keys: list, columns: list, before: datetime.datetime = None) -> dict:
+    """Find the most recent archived upload of every SFDC ID.
+
+    The uploads come from the index of archived_latest, uploads still in the archive queue are included. An id whose
+    kept uploads are all from before isn't found, so its rows are sent in full.
+
+    :param keys: id columns to index by, e.g. [LEAD_KEY, CONTACT_KEY]
+    :type keys: list
+    :param columns: columns that will be compared
+    :type columns: list
+    :param before: only use uploads archived for demos before this date, so a demo isn't compared with its own
+        archived upload when it is processed again (default every upload)
+    :type before: datetime.datetime
+    :return: key: latest archived row per id, indexed by the id
+    :rtype: dict
+    """
+    wanted = set(keys) | set(columns) | {"Date"}
+    uploads = archived_latest()
+    uploads = uploads[[col for col in uploads.columns if col in wanted]]
+    # uploads still waiting in the archive queue count as archived
+    queued = archive_queue.queued_rows(archive.SFDC_SHEET)
+    if queued is not None:
+        uploads = pd.concat([uploads, queued[[col for col in uploads.columns if col in queued.columns]]],
+                            ignore_index=True).fillna('')
+    metrics.count_rows(rows_in=len(uploads))
+
+    if before is not None:
+        dates = pd.to_datetime(uploads["Date"], errors='coerce')
+        uploads = uploads[(dates < pd.Timestamp(before)).to_numpy()]
+    uploads = _by_date(uploads)
+
+    latest = {}
+    for key in keys:
+        archived = uploads[uploads[key] != '']
+        latest[key] = archived.drop_duplicates(subset=key, keep='last').set_index(key)
+    return latest
+
+
+def delta(data: pd.DataFrame, latest: pd.DataFrame, key: str, mode: str, name: str = "") -> pd.DataFrame:
+    """Remove what didn't change since the id was last uploaded.
+
+    Each outgoing row is matched to its latest archived row by an index lookup on the id. Rows whose id was never
+    archived are kept whole. Columns the archive doesn't have aren't compared and are kept as they are.
+
+    COLUMNS mode leaves unchanged values blank, which the loader skips as long as it isn't set to write nulls.
+
+    :param data: outgoing upload
+    :type data: pd.DataFrame
+    :param latest: latest archived row per id, from latest_uploads
+    :type latest: pd.DataFrame
+    :param key: id column
+    :type key: str
+    :param mode: OFF, ROWS or COLUMNS
+    :type mode: str
+    :param name: name of the upload, used in the log (default "")
+    :type name: str
+    :return: upload with unchanged rows and, in COLUMNS mode, unchanged values removed
+    :rtype: pd.DataFrame
+    """
+    if mode not in MODES:
+        raise ValueError(f"{mode} is not a valid delta mode, use one of {', '.join(MODES)}")
+    if mode == OFF or data.empty:
+        return data
+
+    compared = [col for col in data.columns if col != key and col in latest.columns]
+    if not compared:
+        return data
+    previous = latest[compared].reindex(data[key].to_numpy())
+    archived = data[key].isin(latest.index).to_numpy()
+
+    changed = (_text(data[compared]) != _text(previous)) | ~archived[:, None]
+    keep = changed.any(axis=1)
+    logger.info("%s delta: %d of %d rows changed since their last upload", name, keep.sum(), len(data))
+
+    if mode == ROWS:
+        return data[keep]
+
+    result = data[keep].astype({col: object for col in compared})
+    changed = changed[keep]
+    for i, col in enumerate(compared):
+        result.loc[~changed[:, i], col] = ''
+    unchanged = [col for i, col in enumerate(compared) if not changed[:, i].any()]
+    logger.info("%s delta: columns left out %s", name, unchanged)
+    return result.drop(columns=unchanged)
@@ -1,15 +1,48 @@
 import os
 import datetime
+import threading
 import pandas as pd
 import access_interface.access as access
 import file_processing.constants as demo_c
 import file_processing.validation as v
+import file_processing.initialize_data as init_data
 import file_processing.file_paths as const
+from file_processing.settings import SETTINGS
 from logs.log import logger
+from logs import metrics
 
 DEMO_INFO_PATH = const.DEMO_INFO_PATH
-logger.debug(DEMO_INFO_PATH)
-DEMO_INFO = pd.read_csv(DEMO_INFO_PATH)
+
+
+_demo_info = None  # (modified time, schedule)
+_demo_info_lock = threading.Lock()
+
+
+def load_demo_info() -> pd.DataFrame:
+    """Read the demo schedule, once per modified time.
+
+    Demos added to the schedule while the app, the watcher or the service is running are seen on the next call.
+
+    :return: demo info
+    :rtype: pd.DataFrame
+    """
+    global _demo_info
+    mtime = os.stat(DEMO_INFO_PATH).st_mtime_ns
+    with _demo_info_lock:
+        if _demo_info is not None and _demo_info[0] == mtime:
+            return _demo_info[1]
+    logger.debug(DEMO_INFO_PATH)
+    schedule = pd.read_csv(DEMO_INFO_PATH)
+    with _demo_info_lock:
+        _demo_info = (mtime, schedule)
+    return schedule
+
+
+def __getattr__(name: str):
+    # DEMO_INFO used to be read at import, keep it available as a module attribute
+    if name == "DEMO_INFO":
+        return load_demo_info()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Demo:
@@ -24,7 +57,8 @@ class Demo:
         logger.debug("Demo's date %s", date)
 
         self.demo_date = date
-        demo_info = DEMO_INFO[(DEMO_INFO["Webinar Date"] == self.demo_date.strftime('%#m/%#d/%Y'))]
+        schedule = load_demo_info()
+        demo_info = schedule[(schedule["Webinar Date"] == self.demo_date.strftime('%#m/%#d/%Y'))]
 
         if demo_type is None:
             self.demo_type = demo_info["Demo Type"].iloc[0]
@@ -38,6 +72,23 @@ class Demo:
         self.udb_non_attend = demo_info["Tracking Code"].iloc[3]
         self.pub = demo_info["Pub Code"].iloc[0]
 
+        self.set_paths()
+        SETTINGS.subscribe(self.settings_changed)
+
+        self.flip_to_open = []
+        self.sf_validation_cache = None
+
+        self.counts = v.Validation(self.demo_type, self.demo_date)
+        # demos added to the schedule since the counts were last initialized get theirs when first opened
+        if not self.counts.registered():
+            init_data.initialize()
+
+    def set_paths(self) -> None:
+        """Set the file names and paths of the demo from the current settings.
+
+        :return: None
+        :rtype: None
+        """
         self.sf_upload = demo_c.SF_UPLOAD
         self.sf_exclude = demo_c.SF_EXCLUDE
         self.udb_upload = demo_c.UDB_UPLOAD
@@ -53,9 +104,16 @@ class Demo:
         self.exclude_file = f"{self.demo_type}-{self.demo_date.strftime('%m%d%y')}-{self.udb_exclude}.xlsx"
         self.exclude_path = os.path.join(self.destination_path, self.exclude_file)
 
-        self.flip_to_open = []
+    def settings_changed(self, changed: dict) -> None:
+        """Recompute the paths when the settings file changes.
 
-        self.counts = v.Validation(self.demo_type, self.demo_date)
+        :param changed: settings that changed, setting: new value
+        :type changed: dict
+        :return: None
+        :rtype: None
+        """
+        logger.debug("Updating %s paths after settings change", self.demo_type)
+        self.set_paths()
 
     @property
     def demo_date(self):
@@ -70,12 +128,13 @@ class Demo:
         :return: None
         :rtype: None
         """
-        valid_date = DEMO_INFO["Webinar Date"].str.contains(date.strftime('%#m/%#d/%Y')).any()
+        valid_date = load_demo_info()["Webinar Date"].str.contains(date.strftime('%#m/%#d/%Y')).any()
         if valid_date:
             self._demo_date = date
         else:
             raise ValueError(f"There is no demo scheduled for {date}")
 
+    @metrics.timed
     def run_through_access(self) -> None:
         """Process demo through Access.
 
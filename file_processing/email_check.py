@@ -0,0 +1,288 @@
+from __future__ import annotations
+import os
+import threading
+import numpy as np
+import pandas as pd
+import file_processing.demo as demo
+import file_processing.schema as schema
+import file_processing.archive as archive
+import file_processing.archive_tiers as archive_tiers
+import file_processing.constants as demo_c
+import file_processing.file_paths as const
+from file_processing.keys import normalize_email, email_hash
+from logs.log import logger
+from logs import metrics
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+ROLE_ACCOUNTS_PATH = os.path.join(FILES_DIR, "role_accounts.txt")
+DISPOSABLE_DOMAINS_PATH = os.path.join(FILES_DIR, "disposable_domains.txt")
+# verdicts of every archived upload, rebuilt whenever the archive changes
+VERDICT_CACHE_PATH = os.path.join(os.path.dirname(const.SETTINGS_PATH), "email_verdicts.npz")
+
+# RFC 5322 dot-atom local part and a domain of dot separated labels ending in a letters-only top level domain
+_ATOM = r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+"
+SYNTAX = rf"{_ATOM}(?:\.{_ATOM})*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{{2,}}"
+
+# misspellings of the common mail domains: the domain that was meant
+DOMAIN_TYPOS = {
+    "gmial.com": "gmail.com", "gmai.com": "gmail.com", "gamil.com": "gmail.com", "gnail.com": "gmail.com",
+    "gmail.co": "gmail.com", "gmail.con": "gmail.com", "gmail.cm": "gmail.com", "gmaill.com": "gmail.com",
+    "yaho.com": "yahoo.com", "yahooo.com": "yahoo.com", "yahoo.co": "yahoo.com", "yahoo.con": "yahoo.com",
+    "hotmial.com": "hotmail.com", "hotmal.com": "hotmail.com", "hotmail.co": "hotmail.com",
+    "hotmail.con": "hotmail.com", "outlok.com": "outlook.com", "outlook.co": "outlook.com",
+    "outlook.con": "outlook.com", "aol.co": "aol.com", "aol.con": "aol.com", "icloud.co": "icloud.com",
+    "iclod.com": "icloud.com",
+}
+
+# other names of the same mail domain
+DOMAIN_ALIASES = {"googlemail.com": "gmail.com"}
+
+# verdict bits kept in the cache
+INVALID = 1 << 0  # EmailValidation FALSE
+BAD_EMAIL = 1 << 1  # FreshAddressBadEmail Y
+UNDELIVERABLE = 1 << 2  # Undeliverable Y
+
+# reasons, in the order they are listed
+SYNTAX_ERROR = "syntax"
+DOMAIN_TYPO = "domain typo"
+DISPOSABLE = "disposable domain"
+ROLE = "role account"
+ARCHIVED_INVALID = "archived invalid"
+ARCHIVED_BAD = "archived bad email"
+ARCHIVED_UNDELIVERABLE = "archived undeliverable"
+
+# the flag columns Access adds, check returns them with the same values
+FLAGS = ("EmailValidation", "FreshAddressBadEmail", "Undeliverable")
+
+
+def _read_list(path: str) -> frozenset:
+    with open(path, 'r') as file:
+        return frozenset(line.strip().lower() for line in file if line.strip() and not line.startswith('#'))
+
+
+_lists = {}
+_lists_lock = threading.Lock()
+
+
+def bundled_list(path: str) -> frozenset:
+    """Read one of the bundled lists, once per modified time.
+
+    :param path: path to the list, one entry per line, # starts a comment
+    :type path: str
+    :return: entries
+    :rtype: frozenset
+    """
+    mtime = os.stat(path).st_mtime_ns
+    with _lists_lock:
+        cached = _lists.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    entries = _read_list(path)
+    with _lists_lock:
+        _lists[path] = (mtime, entries)
+    return entries
+
+
+# --------------------- VERDICT CACHE --------------------- #
+class VerdictCache:
+    def __init__(self, keys: np.ndarray, verdicts: np.ndarray, source: str = ''):
+        """Initialize VerdictCache, the flags every archived address was last uploaded with.
+
+        :param keys: email hash per address, sorted, see keys.email_hash
+        :type keys: np.ndarray
+        :param verdicts: verdict bits per address
+        :type verdicts: np.ndarray
+        :param source: signature of the archive the verdicts were read from
+        :type source: str
+        """
+        self.keys = keys
+        self.verdicts = verdicts
+        self.source = source
+
+    @classmethod
+    def empty(cls) -> VerdictCache:
+        return cls(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint8))
+
+    @classmethod
+    def from_uploads(cls, uploads: pd.DataFrame, source: str = '') -> VerdictCache:
+        """Build the cache from archived uploads, the latest upload of an address wins.
+
+        :param uploads: Email and flag columns, oldest first
+        :type uploads: pd.DataFrame
+        :param source: signature of the archive
+        :type source: str
+        :return: cache
+        :rtype: VerdictCache
+        """
+        verdicts = np.zeros(len(uploads), dtype=np.uint8)
+        for col, bit, bad in (("EmailValidation", INVALID, "FALSE"), ("FreshAddressBadEmail", BAD_EMAIL, "Y"),
+                              ("Undeliverable", UNDELIVERABLE, "Y")):
+            if col in uploads.columns:
+                verdicts |= np.where(uploads[col].astype(str).str.strip().str.upper() == bad, bit, 0).astype(np.uint8)
+
+        keys = email_hash(uploads["Email"])
+        # reversed so np.unique's first index is the latest upload
+        unique, last = np.unique(keys[::-1], return_index=True)
+        return cls(unique, verdicts[::-1][last], source)
+
+    @classmethod
+    def load(cls, path: str = None) -> VerdictCache:
+        with np.load(path or VERDICT_CACHE_PATH) as arrays:
+            return cls(arrays["keys"], arrays["verdicts"], str(arrays["source"]))
+
+    def save(self, path: str = None) -> None:
+        path = path or VERDICT_CACHE_PATH
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, keys=self.keys, verdicts=self.verdicts, source=np.array(self.source))
+        os.replace(tmp_path, path)
+
+    def lookup(self, emails: pd.Series) -> np.ndarray:
+        """Find the archived verdict of each email.
+
+        :param emails: email addresses
+        :type emails: pd.Series
+        :return: verdict bits per email, 0 for addresses that were never archived
+        :rtype: np.ndarray
+        """
+        if not len(self.keys):
+            return np.zeros(len(emails), dtype=np.uint8)
+        keys = email_hash(emails)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.verdicts[pos], 0).astype(np.uint8)
+
+
+def _last_upload(uploads: pd.DataFrame) -> pd.DataFrame:
+    """Keep the latest upload of every address, the reduce of VERDICT_SUMMARY."""
+    return uploads[~pd.Series(email_hash(uploads["Email"])).duplicated(keep='last').to_numpy()]
+
+
+# verdicts of the cold archive, so a changed archive only has its new cold files and the workbook read
+VERDICT_SUMMARY = archive_tiers.ColdSummary("email-verdicts", archive.UDB_SHEET, "archive_udb", _last_upload,
+                                            ["Email", *FLAGS])
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _archive_signature() -> str:
+    stat = os.stat(const.ARCHIVE_PATH)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def verdict_cache() -> VerdictCache:
+    """Get the verdicts of the archived uploads, reading the archive again only when it changed.
+
+    :return: cache, empty if the archive can't be read
+    :rtype: VerdictCache
+    """
+    global _cache
+    with _cache_lock:
+        try:
+            source = _archive_signature()
+        except OSError as e:
+            logger.warning("The archive can't be reached, emails are checked without past verdicts %s", repr(e))
+            return _cache or VerdictCache.empty()
+        if _cache is not None and _cache.source == source:
+            return _cache
+
+        try:
+            cache = VerdictCache.load()
+        except (OSError, KeyError, ValueError):
+            cache = None
+        if cache is None or cache.source != source:
+            try:
+                uploads = VERDICT_SUMMARY.rows()
+            except (OSError, ValueError) as e:
+                logger.warning("The archive can't be read, emails are checked without past verdicts %s", repr(e))
+                return _cache or VerdictCache.empty()
+            cache = VerdictCache.from_uploads(uploads, source)
+            cache.save()
+            logger.info("Email verdict cache rebuilt from %d archived uploads", len(uploads))
+        _cache = cache
+        return cache
+
+
+# --------------------- CHECK --------------------- #
+def check(emails: pd.Series, cache: VerdictCache = None) -> pd.DataFrame:
+    """Check a column of emails in one pass, offline.
+
+    :param emails: email addresses
+    :type emails: pd.Series
+    :param cache: past verdicts (default verdict_cache())
+    :type cache: VerdictCache
+    :return: per email, with the same index - Domain (normalized), Reason, and the Access flag columns
+        EmailValidation (TRUE/FALSE), FreshAddressBadEmail (Y/N) and Undeliverable (Y/N)
+    :rtype: pd.DataFrame
+    """
+    cache = verdict_cache() if cache is None else cache
+    normalized = normalize_email(emails)
+    parts = normalized.str.partition('@')
+    local, domain = parts[0], parts[2].str.rstrip('.')
+    role_name = local.str.partition('+')[0].str.replace(r"[._-]", '', regex=True)
+
+    reasons = {
+        SYNTAX_ERROR: ~normalized.str.fullmatch(SYNTAX).fillna(False).astype(bool),
+        DOMAIN_TYPO: domain.isin(list(DOMAIN_TYPOS)),
+        DISPOSABLE: domain.isin(bundled_list(DISPOSABLE_DOMAINS_PATH)),
+        ROLE: role_name.isin(bundled_list(ROLE_ACCOUNTS_PATH)),
+    }
+    archived = cache.lookup(normalized)
+    reasons[ARCHIVED_INVALID] = pd.Series((archived & INVALID) != 0, index=emails.index)
+    reasons[ARCHIVED_BAD] = pd.Series((archived & BAD_EMAIL) != 0, index=emails.index)
+    reasons[ARCHIVED_UNDELIVERABLE] = pd.Series((archived & UNDELIVERABLE) != 0, index=emails.index)
+
+    reason = np.full(len(emails), '', dtype=object)
+    for name, mask in reasons.items():
+        reason = reason + np.where(mask.to_numpy(dtype=bool), name + ", ", '')
+    invalid = reasons[SYNTAX_ERROR] | reasons[DOMAIN_TYPO] | reasons[ARCHIVED_INVALID]
+    bad = reasons[DISPOSABLE] | reasons[ROLE] | reasons[ARCHIVED_BAD]
+
+    return pd.DataFrame({
+        "Domain": domain.map({**DOMAIN_TYPOS, **DOMAIN_ALIASES}).fillna(domain),
+        "Reason": pd.Series(reason, index=emails.index, dtype=str).str[:-2],
+        "EmailValidation": np.where(invalid, "FALSE", "TRUE"),
+        "FreshAddressBadEmail": np.where(bad, "Y", "N"),
+        "Undeliverable": np.where(reasons[ARCHIVED_UNDELIVERABLE], "Y", "N"),
+    }, index=emails.index)
+
+
+# --------------------- STAGE --------------------- #
+def report_path(demo_obj: demo.Demo) -> str:
+    """Build the path of the demo's email check report.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: path to the .csv file
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-EmailCheck.csv")
+
+
+@metrics.timed
+def check_emails(demo_obj: demo.Demo) -> pd.DataFrame:
+    """Check the raw registrations' emails before the Access round trip and save the ones that fail.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: registrations whose email failed a check, with the reasons and flags
+    :rtype: pd.DataFrame
+    """
+    data = schema.read_excel(demo_c.RAW_DATA_PATH, demo_c.RAW_DATA_SHEET, "raw",
+                             usecols=["Attended", "Email Address"])
+    metrics.count_rows(rows_in=len(data))
+    internal = data["Email Address"].str.contains('|'.join(const.INTERNAL))
+    data = data[~internal]
+
+    verdicts = check(data["Email Address"])
+    failed = verdicts["Reason"] != ''
+    report = pd.concat([data[failed], verdicts[failed]], axis=1)
+
+    attended = report["Attended"] == "Yes"
+    demo_obj.counts.update_counts(a_local_bad_email=int(attended.sum()), na_local_bad_email=int((~attended).sum()))
+    logger.info("%d of %d emails failed the local check", len(report), len(data))
+
+    os.makedirs(demo_obj.destination_path, exist_ok=True)
+    report.to_csv(report_path(demo_obj), index=False)
+    metrics.count_rows(rows_out=len(report))
+    return report
@@ -1,10 +1,22 @@
 import os
 import re
+import json
 import pandas as pd
-from win32com.client import constants, gencache
 from logs.log import logger
+from logs import metrics
 import file_processing.demo as demo
+import file_processing.dedup as dedup
+import file_processing.delta as delta
+import file_processing.lineage as lineage
+import file_processing.phones as phones
+import file_processing.cleaning as cleaning
+import file_processing.schema as schema
+import file_processing.writers as writers
+import file_processing.template as template
+import file_processing.transfer as transfer
 import file_processing.constants as demo_c
+from file_processing.keys import email_hash, normalize_email
+from file_processing.settings import SETTINGS
 import file_processing.file_paths as const
 import file_processing.archive_helpers as demo_a
 
@@ -12,6 +24,7 @@ pd.io.formats.excel.ExcelFormatter.header_style = None
 
 
 # --------------------- INITIAL COUNTS --------------------- #
+@metrics.timed
 def initial_counts(demo_obj: demo.Demo) -> None:
     """Find initial and internal counts.
 
@@ -23,7 +36,8 @@ def initial_counts(demo_obj: demo.Demo) -> None:
     internal_emails = const.INTERNAL
     pattern = '|'.join(internal_emails)
 
-    data = pd.read_excel(demo_c.RAW_DATA_PATH, sheet_name=demo_c.RAW_DATA_SHEET)
+    data = schema.read_excel(demo_c.RAW_DATA_PATH, demo_c.RAW_DATA_SHEET, "raw")
+    metrics.count_rows(rows_in=len(data))
     a_initial = data[data["Attended"] == "Yes"]
     na_initial = data[data["Attended"] == "No"]
     a_internal = a_initial[a_initial["Email Address"].str.contains(pattern)]
@@ -33,6 +47,10 @@ def initial_counts(demo_obj: demo.Demo) -> None:
                                   a_internal_records=len(a_internal),
                                   na_internal_records=len(na_internal))
 
+    # key every raw record so later stages can record where it went
+    internal = pd.concat([a_internal["Email Address"], na_internal["Email Address"]])
+    lineage.start(demo_obj, data["Email Address"], data["Attended"] == "Yes", internal)
+
 
 # --------------------- DESTINATION FOLDER --------------------- #
 def create_destination(path: str) -> None:
@@ -49,7 +67,88 @@ def create_destination(path: str) -> None:
         logger.warning("The folder for this demo already exists. This could indicate the demo was already processed.")
 
 
+# --------------------- OUTPUT PATHS --------------------- #
+def csv_path(demo_obj: demo.Demo, name: str) -> str:
+    """Build the path of an upload CSV in the demo folder.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :param name: end of the file name, e.g. "SFDC_Upload-New"
+    :type name: str
+    :return: path to the CSV
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-{name}.csv")
+
+
+def manifest_path(demo_obj: demo.Demo, name: str) -> str:
+    """Build the path of an upload manifest in the demo folder.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :param name: end of the file name, e.g. "SFDC_Upload-manifest"
+    :type name: str
+    :return: path to the manifest
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-{name}.json")
+
+
+def sf_validation_path(demo_obj: demo.Demo) -> str:
+    """Find the newest SF validation export in the demo folder.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: path to the validation export
+    :rtype: str
+    """
+    # Excel's lock files (~$name.xlsx) of an open export match the name too
+    r = re.compile(r"^(?!~\$).*SF.*Validation.*\.xls[xm]?$")
+    exports = [os.path.join(demo_obj.destination_path, file) for file in os.listdir(demo_obj.destination_path)
+               if r.match(file)]
+    if not exports:
+        raise IndexError(f"No SF validation export in {demo_obj.destination_path}")
+    return max(exports, key=os.path.getmtime)
+
+
+def sf_validation_cache_path(demo_obj: demo.Demo) -> str:
+    """Build the path of the cached SF validation export.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: path to the CSV file
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-ExportCache.csv")
+
+
+def _read_validation_cache(path: str) -> dict:
+    # the first line is the version the rows were read from, the rest is the CSV
+    try:
+        with open(path, 'r', newline='') as file:
+            version = json.loads(file.readline())
+            data = pd.read_csv(file, dtype=object)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("The SF validation cache can't be read and is rebuilt %s", repr(e))
+        return None
+    return {"version": version, "data": data}
+
+
+def _write_validation_cache(path: str, cached: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='') as file:
+        file.write(json.dumps(cached["version"]) + "\n")
+        cached["data"].to_csv(file, index=False)
+    os.replace(tmp_path, path)
+
+
 # --------------------- CREATE PIVOT TABLES --------------------- #
+@metrics.timed
 def pivot_table(file: str, sheet: str, tables: list) -> None:
     """Create pivot table(s) in file.
 
@@ -62,6 +161,9 @@ def pivot_table(file: str, sheet: str, tables: list) -> None:
     :return: None
     :rtype: None
     """
+    # pywin32 is slow to import, only load it when a pivot table is made
+    from win32com.client import constants, gencache
+
     excel = gencache.EnsureDispatch('Excel.Application')
     excel.Visible = True
 
@@ -104,6 +206,7 @@ def pivot_table(file: str, sheet: str, tables: list) -> None:
 
 
 # --------------------- SFDC PRE-VALIDATION --------------------- #
+@metrics.timed
 def sfdc_pre_val(demo_obj: demo.Demo) -> None:
     """Clean the sfdc file for review.
 
@@ -113,17 +216,29 @@ def sfdc_pre_val(demo_obj: demo.Demo) -> None:
     :rtype: None
     """
     # put the salesforce leads into a variable
-    sfdc = pd.read_excel(demo_obj.sf_path, sheet_name=demo_obj.sf_upload)
+    sfdc = schema.read_excel(demo_obj.sf_path, demo_obj.sf_upload, "sfdc")
     sfdc = sfdc.fillna('')
+    metrics.count_rows(rows_in=len(sfdc))
+
+    # proper case names, fill in missing last names and remove repeats from the secondary description
+    cleaned = cleaning.apply_rules(sfdc, cleaning.SFDC_RULES, "SFDC")
+
+    # people who registered again under another email are uploaded once, the other registrations are stored
+    # separately to be reviewed on the Duplicates tab
+    is_duplicate = normalize_email(sfdc["Email"]).isin(dedup.duplicate_emails(demo_obj))
+    duplicates = sfdc[is_duplicate]
+    sfdc = sfdc[~is_duplicate].copy()
 
-    # validates name proper casing
-    sfdc.LastName.str.title()
-    sfdc.FirstName.str.title()
-    sfdc.loc[sfdc.LastName == '', 'LastName'] = '[Unknown]'
+    # splits extensions typed into the phone number off into PhoneExt and writes every number one way
+    sfdc["PhoneNumber"], typed_ext = phones.normalize(sfdc["PhoneNumber"])
+    sfdc.loc[sfdc["PhoneExt"] == '', 'PhoneExt'] = typed_ext
+    sfdc["Existing Lead Phone"] = phones.normalize(sfdc["Existing Lead Phone"])[0]
 
-    # if the phone number is empty, it tries to populate it with the existing lead phone. If both fields are empty,
+    # if the phone number is empty, it tries to populate it with the existing lead phone, then with the phone typed
+    # in the raw data and then with the latest phone the archive has for the email. If it's still empty,
     # it stores the record separately to be uploaded into the NullPhone tab
     sfdc.loc[sfdc["PhoneNumber"] == '', 'PhoneNumber'] = sfdc["Existing Lead Phone"]
+    recovered = phones.recover(sfdc, [phones.raw_phones(demo_obj), phones.archived_phones()])
     null_phone = sfdc[sfdc["PhoneNumber"] == '']
     sfdc = sfdc[sfdc["PhoneNumber"] != '']
     sfdc = sfdc.drop(['Existing Lead Phone'], axis=1)
@@ -137,37 +252,6 @@ def sfdc_pre_val(demo_obj: demo.Demo) -> None:
     sfdc.loc[sfdc["Master Name"] != '', 'Company'] = sfdc['Master Name']
     sfdc.loc[sfdc["Master Name"] == '', 'Company'] = 'REVIEW ' + sfdc.Company
 
-    # cleans the secondary description of duplicates
-    def uniquify(string, splitter=" "):
-        output = []
-        seen = set()
-        for word in string.split(splitter):
-            if word not in seen or word == '/':
-                output.append(word)
-                seen.add(word)
-
-        if splitter != " ":
-            for item in output:
-                for thing in seen:
-                    if item != thing and item in thing:
-                        try:
-                            output.remove(item)
-                        except ValueError:
-                            pass
-
-        return splitter.join(output)
-
-    for idx, desc in sfdc["Current Secondary Description"].items():
-        try:
-            sfdc.at[idx, "Current Secondary Description"] = uniquify(desc, splitter=" / ")
-            sections = sfdc.at[idx, "Current Secondary Description"].split(' / ')
-            new_line = []
-            for section in sections:
-                new_line.append(uniquify(section))
-            sfdc.at[idx, "Current Secondary Description"] = ' / '.join(new_line)
-        except AttributeError:
-            pass
-
     # checks each record that is marked dead in salesforce and determines if they were an attendee or not
     # if not, it stores the record separately to be uploaded to the DeadNonAttendee tab, if they were
     # an attendee, the record's email will be presented, so they can be manually flipped to open
@@ -184,36 +268,39 @@ def sfdc_pre_val(demo_obj: demo.Demo) -> None:
     sfdc = sfdc[(sfdc["Existing Contact ID"] == '') | (sfdc["Existing Lead ID"] != '')]
 
     # removes unnecessary columns
-    dfs = [sfdc, null_phone, dead, cnl]
+    dfs = [sfdc, null_phone, dead, cnl, duplicates]
     for df in dfs:
         df.drop(["Prior Marketing Note", "Prior Sales Note", "Prior Description", "Prior Secondary Description",
                  "Prior Lead Status", "Existing Lead Owner", "Existing Lead Owner ID", "ID"], axis=1, inplace=True)
 
     # counts any excluded sf leads
     try:
-        exclude = pd.read_excel(demo_obj.sf_exclude_path, sheet_name=demo_obj.sf_exclude)
+        exclude = schema.read_excel(demo_obj.sf_exclude_path, demo_obj.sf_exclude, "sfdc")
     except FileNotFoundError:
         logger.warning("There was no sf exclude file")
-        excluded = 0
-    else:
-        excluded = len(exclude)
+        exclude = pd.DataFrame({"Email": []})
+    excluded = len(exclude)
 
     # update validation counts
     demo_obj.counts.update_counts(left_dead=len(dead),
                                   flipped_open=len(demo_obj.flip_to_open),
                                   null_phone=len(null_phone),
+                                  sf_phones_recovered=recovered,
                                   contact_no_lead=len(cnl),
-                                  sf_excluded=excluded)
+                                  sf_excluded=excluded,
+                                  sf_duplicates=len(duplicates),
+                                  sf_cleaned=cleaned)
+    lineage.record(demo_obj, {lineage.SF_EXCLUDED: exclude["Email"], lineage.NULL_PHONE: null_phone["Email"],
+                              lineage.DEAD: dead["Email"], lineage.CONTACT_NO_LEAD: cnl["Email"],
+                              lineage.DUPLICATE_ROW: duplicates["Email"]})
+
+    metrics.count_rows(rows_out=len(sfdc) + len(cnl) + len(null_phone) + len(dead) + len(duplicates))
 
     # reformat the Excel file and separates it into the correct sheets
-    with pd.ExcelWriter(demo_obj.sf_path, engine='openpyxl', mode='w') as writer:
-        sfdc.to_excel(writer, sheet_name=demo_obj.sf_upload, index=False)
-        if cnl.shape[0] > 0:
-            cnl.to_excel(writer, sheet_name='ContactNoLead', index=False)
-        if null_phone.shape[0] > 0:
-            null_phone.to_excel(writer, sheet_name='NullPhone', index=False)
-        if dead.shape[0] > 0:
-            dead.to_excel(writer, sheet_name='DeadNonAttendee', index=False)
+    sheets = {demo_obj.sf_upload: sfdc, 'ContactNoLead': cnl, 'NullPhone': null_phone, 'DeadNonAttendee': dead,
+              'Duplicates': duplicates}
+    writers.write_all([writers.WriteJob(data, demo_obj.sf_path, sheet=sheet) for sheet, data in sheets.items()
+                       if sheet == demo_obj.sf_upload or data.shape[0] > 0])
 
             # create validation pivot tables
     pts = [
@@ -255,6 +342,7 @@ def sfdc_pre_val(demo_obj: demo.Demo) -> None:
 
 
 # --------------------- UDB PRE-VALIDATION --------------------- #
+@metrics.timed
 def udb_pre_val(demo_obj: demo.Demo) -> None:
     """Clean the udb file using the cleaned sfdc file for review.
 
@@ -263,57 +351,28 @@ def udb_pre_val(demo_obj: demo.Demo) -> None:
     :return: None
     :rtype: None
     """
-    sfdc = pd.read_excel(demo_obj.sf_path, sheet_name=demo_obj.sf_upload)
-    udb = pd.read_excel(demo_obj.udb_path, sheet_name=demo_obj.udb_upload)
-    cols = list(udb.columns)
-
-    # merge udb and sfdc data on email
-    udb = pd.merge(udb, sfdc, how="left", on="Email", suffixes=("", "_sf"))
-    udb = udb.fillna('')
-
-    # transfer the clean data from the sfdc file to the udb file
-    def transfer_sfdc(udb_col, sfdc_col, review=False):
-        nonlocal udb
-        # where the salesforce field is not blank, fill in the udb field
-        udb.loc[udb[sfdc_col] != '', udb_col] = udb[sfdc_col]
-        if review:
-            # if review is true, it will mark the field as needing to be reviewed
-            udb.loc[udb[sfdc_col] == '', udb_col] = 'REVIEW ' + udb[udb_col]
-
-    transfer_sfdc('FirstName', 'FirstName_sf')
-    transfer_sfdc('LastName', 'LastName_sf')
-    transfer_sfdc('State', 'State_sf')
-    transfer_sfdc('PhoneNumber', 'PhoneNumber_sf')
-    transfer_sfdc('Company', 'Company_sf', review=True)
-    transfer_sfdc('CustomerTitle', 'CustomerTitle_sf')
-    if 'PhoneExt_sf' in udb.columns:
-        transfer_sfdc('PhoneExt', 'PhoneExt_sf')
-    elif (udb['PhoneExt'] == '').all():
-        udb = udb.drop(['PhoneExt'], axis=1)
-
-    # remove [Unknown] and Individual from file
-    udb = udb.replace(to_replace=r"[Unknown]", value="")
-    udb['Company'] = udb['Company'].str.replace('Individual', '')
-
-    # remove / from title field
-    udb.CustomerTitle = udb.CustomerTitle.replace(to_replace='\/', value=' ', regex=True)
-    udb.CustomerTitle = udb.CustomerTitle.replace('\s+', value=' ', regex=True)
-
-    # removing the sf columns
-    for col in udb.columns:
-        if col not in cols:
-            udb = udb.drop([col], axis=1)
+    sfdc = schema.read_excel(demo_obj.sf_path, demo_obj.sf_upload, "sfdc")
+    udb = schema.read_excel(demo_obj.udb_path, demo_obj.udb_upload, "udb")
+    metrics.count_rows(rows_in=len(udb))
+
+    # transfer the clean data from the sfdc file to the udb file, matched on email
+    transfer.transfer(udb, sfdc, transfer.UDB_FROM_SFDC)
+    if 'PhoneExt' not in sfdc.columns and 'PhoneExt' in udb.columns and (udb['PhoneExt'] == '').all():
+        udb = udb.drop(columns=['PhoneExt'])
+
+    # remove [Unknown] and Individual, and / and extra spaces from titles
+    cleaned = cleaning.apply_rules(udb, cleaning.UDB_RULES, "UDB")
 
     # update validation counts
-    exclude = pd.read_excel(demo_obj.exclude_path, sheet_name=demo_obj.udb_exclude)
+    exclude = schema.read_excel(demo_obj.exclude_path, demo_obj.udb_exclude, "exclude")
 
     # FreshAddressBadEmail:
     a_upload_bademail = len(udb[(udb["TrackingCode"].str.contains("AC")) & (udb["FreshAddressBadEmail"] == "Y")])
     na_upload_bademail = len(udb[(udb["TrackingCode"].str.contains("BC")) & (udb["FreshAddressBadEmail"] == "Y")])
     a_exclude_bademail = len(exclude[(exclude["TrackingCode"].str.contains("AC")) &
-                                     (exclude["FreshAddressBadEmail"] == "Y")])
+                                     exclude["FreshAddressBadEmail"]])
     na_exclude_bademail = len(exclude[(exclude["TrackingCode"].str.contains("BC")) &
-                                      (exclude["FreshAddressBadEmail"] == "Y")])
+                                      exclude["FreshAddressBadEmail"]])
     attendee_bad_email = a_upload_bademail + a_exclude_bademail
     nonattendee_bad_email = na_upload_bademail + na_exclude_bademail
 
@@ -321,9 +380,9 @@ def udb_pre_val(demo_obj: demo.Demo) -> None:
     a_upload_undeliverable = len(udb[(udb["TrackingCode"].str.contains("AC")) & (udb["Undeliverable"] == "Y")])
     na_upload_undeliverable = len(udb[(udb["TrackingCode"].str.contains("BC")) & (udb["Undeliverable"] == "Y")])
     a_exclude_undeliverable = len(exclude[(exclude["TrackingCode"].str.contains("AC")) &
-                                          (exclude["Undeliverable"] == "Y")])
+                                          exclude["Undeliverable"]])
     na_exclude_undeliverable = len(exclude[(exclude["TrackingCode"].str.contains("BC")) &
-                                           (exclude["Undeliverable"] == "Y")])
+                                           exclude["Undeliverable"]])
     attendee_undeliverable = a_upload_undeliverable + a_exclude_undeliverable
     nonattendee_undeliverable = na_upload_undeliverable + na_exclude_undeliverable
 
@@ -335,16 +394,19 @@ def udb_pre_val(demo_obj: demo.Demo) -> None:
                                   nonattendee_code=demo_obj.udb_non_attend,
                                   udb_excluded=len(exclude),
                                   udb_uploaded=len(udb),
+                                  udb_cleaned=cleaned,
                                   a_freshaddressbademail=attendee_bad_email,
                                   na_freshaddressbademail=nonattendee_bad_email,
                                   a_bad_email=attendee_invalid_email,
                                   na_bad_email=nonattendee_invalid_email,
                                   a_undeliverable=attendee_undeliverable,
                                   na_undeliverable=nonattendee_undeliverable)
+    lineage.record(demo_obj, {lineage.UDB_UPLOAD: udb["Email"], lineage.UDB_EXCLUDE: exclude["Email"]})
+
+    metrics.count_rows(rows_out=len(udb))
 
     # save the Excel file
-    with pd.ExcelWriter(demo_obj.udb_path, engine='openpyxl', mode='w') as writer:
-        udb.to_excel(writer, sheet_name=demo_obj.udb_upload, index=False)
+    writers.write_all([writers.WriteJob(udb, demo_obj.udb_path, sheet=demo_obj.udb_upload)])
 
     # TODO create validation pivot tables
     pts = [
@@ -377,7 +439,115 @@ def udb_pre_val(demo_obj: demo.Demo) -> None:
     pivot_table(demo_obj.udb_path, demo_obj.udb_upload, pts)
 
 
-# --------------------- SFDC POST-VALIDATION --------------------- #
+# --------------------- POST-VALIDATION --------------------- #
+# columns left out of each upload file
+NEW_DROP = ['Existing Lead ID', 'Existing Contact ID', 'Domain', 'AG', 'Current Secondary Description', 'Dead Reason',
+            'LastNameValidation', 'FirstNameValidation', 'EmailValidation', 'CompanyValidation', 'TitleValidation',
+            'Master Name', 'LastActivityDate', 'Existing Lead Compnay']
+LEAD_UPDATE_DROP = ['Existing Contact ID', 'Domain', 'AG', 'Dead Reason', 'Existing Lead Compnay', 'LastNameValidation',
+                    'FirstNameValidation', 'EmailValidation', 'CompanyValidation', 'TitleValidation', 'Master Name',
+                    'LastActivityDate']
+CONTACT_UPDATE_DROP = ['Existing Lead ID', 'LastName', 'FirstName', 'Email', 'Domain', 'State', 'PhoneNumber',
+                       'Company', 'Existing Lead Compnay', 'CustomerTitle', 'AG', 'Record Type ID', 'LeadSource',
+                       'Current Lead Status', 'Dead Reason', 'EmailValidation', 'Current Owner', 'Current Owner ID',
+                       'PhoneExt', 'LastNameValidation', 'FirstNameValidation', 'CompanyValidation',
+                       'TitleValidation', 'Master Name', 'LastActivityDate', 'Country']
+UDB_DROP = ['EmailValidation', 'Current Owner', 'Current Owner ID', 'LastNameValidation', 'FirstNameValidation',
+            'CompanyValidation', 'TitleValidation', 'Master Name']
+
+
+def partition(sfdc: pd.DataFrame) -> dict:
+    """Classify each reviewed sfdc row into its upload bucket.
+
+    A row with both an existing lead and an existing contact goes to both LeadUpdate and ContactUpdate.
+
+    :param sfdc: reviewed sfdc data
+    :type sfdc: pd.DataFrame
+    :return: bucket name: boolean row mask
+    :rtype: dict
+    """
+    has_lead = sfdc["Existing Lead ID"] != ''
+    has_contact = sfdc["Existing Contact ID"] != ''
+    return {
+        "New": ~(has_lead | has_contact),
+        "LeadUpdate": has_lead,
+        "ContactUpdate": has_contact,
+    }
+
+
+def project(data: pd.DataFrame, rows: pd.Series, drop: list, name: str, drop_blank: tuple = ()) -> pd.DataFrame:
+    """Select the rows and the upload columns of a bucket with a single copy.
+
+    :param data: data to select from
+    :type data: pd.DataFrame
+    :param rows: boolean row mask, None for every row
+    :type rows: pd.Series
+    :param drop: columns left out of the upload
+    :type drop: list
+    :param name: name of the bucket, used in the log
+    :type name: str
+    :param drop_blank: columns also left out when they are blank for every selected row (default ())
+    :type drop_blank: tuple
+    :return: projected bucket
+    :rtype: pd.DataFrame
+    """
+    missing = [col for col in drop if col not in data.columns]
+    if missing:
+        logger.info('missing from %s: %s', name, missing)
+
+    drop = set(drop)
+    for col in drop_blank:
+        if col in data.columns and col not in drop:
+            values = data[col] if rows is None else data.loc[rows, col]
+            if (values == '').all():
+                drop.add(col)
+
+    columns = [col for col in data.columns if col not in drop]
+    if rows is None:
+        return data[columns]
+    return data.loc[rows, columns]
+
+
+def write_uploads(demo_obj: demo.Demo, uploads: dict, manifest: str, prefix: str = None,
+                  workbook: str = None, sheets: dict = None) -> dict:
+    """Write each upload frame to numbered CSV parts and, if a workbook is given, to a sheet of the same name in it.
+
+    The CSVs are split under the loaders' row and size caps from the settings, a frame that fits in one part keeps
+    the unnumbered name. All files are written concurrently, see writers.write_all.
+
+    :param demo_obj: current demo object
+    :type demo_obj: Demo
+    :param uploads: sheet name: data
+    :type uploads: dict
+    :param manifest: end of the manifest file name, e.g. "SFDC_Upload-manifest"
+    :type manifest: str
+    :param prefix: put in front of the sheet name to name the CSV (default None)
+    :type prefix: str
+    :param workbook: Excel file to add the sheets to, replacing them if the step is run again (default None)
+    :type workbook: str
+    :param sheets: sheet name: data for the workbook, if it gets other frames than the CSVs (default the uploads)
+    :type sheets: dict
+    :return: manifest with the rows, bytes and sha256 of every part
+    :rtype: dict
+    """
+    max_rows = SETTINGS.upload_max_rows
+    max_bytes = SETTINGS.upload_max_bytes
+
+    jobs = []
+    if workbook is not None:
+        sheets = uploads if sheets is None else sheets
+        jobs += [writers.WriteJob(data, workbook, sheet=sheet, append=True) for sheet, data in sheets.items()]
+    parts = {}
+    for sheet, data in uploads.items():
+        target = csv_path(demo_obj, sheet if prefix is None else f"{prefix}-{sheet}")
+        parts[target] = writers.csv_part_jobs(data, target, max_rows, max_bytes)
+        jobs += parts[target]
+
+    results = writers.write_all(jobs)
+    return writers.write_manifest(manifest_path(demo_obj, manifest), parts, results, max_rows, max_bytes)
+
+
+@metrics.timed
 def sfdc_post_val(demo_obj: demo.Demo) -> None:
     """Prepare sfdc file for upload.
 
@@ -387,99 +557,54 @@ def sfdc_post_val(demo_obj: demo.Demo) -> None:
     :rtype: None
     """
     # reads in the manually approved data
-    sfdc = pd.read_excel(demo_obj.sf_path, sheet_name=demo_obj.sf_upload)
+    sfdc = schema.read_excel(demo_obj.sf_path, demo_obj.sf_upload, "sfdc").fillna('')
     try:
-        cnl = pd.read_excel(demo_obj.sf_path, sheet_name="ContactNoLead")
+        cnl = schema.read_excel(demo_obj.sf_path, "ContactNoLead", "sfdc").fillna('')
     except ValueError:
         cnl = None
 
-    sfdc = sfdc.fillna('')
-    if cnl is not None:
-        cnl = cnl.fillna('')
-        cnl = cnl.drop(['Existing Lead ID'], axis=1)
+    metrics.count_rows(rows_in=len(sfdc) + (0 if cnl is None else len(cnl)))
 
     review_count = (sfdc["Company"].str.contains("REVIEW")).sum()
     if review_count > 0:
         logger.warning("Data may not have been manually reviewed, REVIEW found in Company column")
 
     # separates the data into new leads, lead updates, and contact updates
-    new = sfdc[(sfdc["Existing Contact ID"] == '') & (sfdc["Existing Lead ID"] == '')]
-    lead_update = sfdc[sfdc["Existing Lead ID"] != '']
-    contact_update = sfdc[sfdc["Existing Contact ID"] != '']
+    buckets = partition(sfdc)
+    new = project(sfdc, buckets["New"], NEW_DROP, "New", drop_blank=('PhoneExt',))
+    lead_update = project(sfdc, buckets["LeadUpdate"], LEAD_UPDATE_DROP, "LeadUpdate", drop_blank=('PhoneExt',))
+    contact_update = project(sfdc, buckets["ContactUpdate"], CONTACT_UPDATE_DROP, "ContactUpdate")
     if cnl is not None:
+        cnl = project(cnl, None, CONTACT_UPDATE_DROP, "ContactNoLead")
         contact_update = pd.concat([contact_update, cnl], ignore_index=True)
 
-    new = new.fillna('')
-    lead_update = lead_update.fillna('')
-    contact_update = contact_update.fillna('')
-
-    # remove necessary columns for upload
-    # new
-    new_cols = ['Existing Lead ID', 'Existing Contact ID', 'Domain', 'AG', 'Current Secondary Description',
-                'Dead Reason', 'LastNameValidation', 'FirstNameValidation', 'EmailValidation', 'CompanyValidation',
-                'TitleValidation', 'Master Name', 'LastActivityDate', 'Existing Lead Compnay']
-    for col in new_cols:
-        try:
-            new = new.drop([col], axis=1)
-        except KeyError:
-            logger.info('%s missing from New', col)
-
-    if 'PhoneExt' in new.columns and (new['PhoneExt'] == '').all():
-        new = new.drop(['PhoneExt'], axis=1)
-
-    # lead update
-    lead_cols = ['Existing Contact ID', 'Domain', 'AG', 'Dead Reason', 'Existing Lead Compnay', 'LastNameValidation',
-                 'FirstNameValidation', 'EmailValidation', 'CompanyValidation', 'TitleValidation', 'Master Name',
-                 'LastActivityDate']
-    for col in lead_cols:
-        try:
-            lead_update = lead_update.drop([col], axis=1)
-        except KeyError:
-            logger.info('%s missing from LeadUpdate', col)
-
-    if 'PhoneExt' in lead_update.columns and (lead_update['PhoneExt'] == '').all():
-        lead_update = lead_update.drop(['PhoneExt'], axis=1)
-
-    # contact update
-    contact_cols = ['Existing Lead ID', 'LastName', 'FirstName', 'Email', 'Domain', 'State', 'PhoneNumber', 'Company',
-                    'Existing Lead Compnay', 'CustomerTitle', 'AG', 'Record Type ID', 'LeadSource',
-                    'Current Lead Status', 'Dead Reason', 'EmailValidation', 'Current Owner', 'Current Owner ID',
-                    'Dead Reason', 'PhoneExt', 'LastNameValidation', 'FirstNameValidation', 'EmailValidation',
-                    'CompanyValidation', 'TitleValidation', 'Master Name', 'LastActivityDate', 'Country']
-    for col in contact_cols:
-        try:
-            contact_update = contact_update.drop([col], axis=1)
-        except KeyError:
-            logger.info('%s missing from ContactUpdate', col)
-
-    # add new sheets to the Excel file
-    with pd.ExcelWriter(demo_obj.sf_path, engine='openpyxl', mode='a') as writer:
-        if new.shape[0] > 0:
-            new.to_excel(writer, sheet_name='New', index=False)
-        if lead_update.shape[0] > 0:
-            lead_update.to_excel(writer, sheet_name="LeadUpdate", index=False)
-        if contact_update.shape[0] > 0:
-            contact_update.to_excel(writer, sheet_name="ContactUpdate", index=False)
-
-    # save the new sheets as CSVs
-    if new.shape[0] > 0:
-        new_path = os.path.join(demo_obj.destination_path,
-                                f"{demo_obj.demo_type}-"
-                                f"{demo_obj.demo_date.strftime('%m%d%y')}-{demo_obj.sf_upload}-New.csv")
-        new.to_csv(new_path, index=False)
-    if lead_update.shape[0] > 0:
-        lead_path = os.path.join(demo_obj.destination_path,
-                                 f"{demo_obj.demo_type}-"
-                                 f"{demo_obj.demo_date.strftime('%m%d%y')}-{demo_obj.sf_upload}-LeadUpdate.csv")
-        lead_update.to_csv(lead_path, index=False)
-    if contact_update.shape[0] > 0:
-        contact_path = os.path.join(demo_obj.destination_path,
-                                    f"{demo_obj.demo_type}"
-                                    f"-{demo_obj.demo_date.strftime('%m%d%y')}-{demo_obj.sf_upload}-ContactUpdate.csv")
-        contact_update.to_csv(contact_path, index=False)
-
-
-# --------------------- UDB POST-VALIDATION --------------------- #
+    # the ContactNoLead rows were recorded by sfdc_pre_val, before delta so rows left out as unchanged still count
+    lineage.record(demo_obj, {lineage.NEW: sfdc.loc[buckets["New"], "Email"],
+                              lineage.LEAD_UPDATE: sfdc.loc[buckets["LeadUpdate"], "Email"],
+                              lineage.CONTACT_UPDATE: sfdc.loc[buckets["ContactUpdate"], "Email"]})
+
+    sheets = {"New": new, "LeadUpdate": lead_update, "ContactUpdate": contact_update}
+
+    # only send what changed since each record was last uploaded
+    mode = SETTINGS.upload_delta_mode
+    if mode != delta.OFF and (lead_update.shape[0] > 0 or contact_update.shape[0] > 0):
+        latest = delta.latest_uploads([delta.LEAD_KEY, delta.CONTACT_KEY],
+                                      list(lead_update.columns) + list(contact_update.columns), demo_obj.demo_date)
+        lead_update = delta.delta(lead_update, latest[delta.LEAD_KEY], delta.LEAD_KEY, mode, "LeadUpdate")
+        contact_update = delta.delta(contact_update, latest[delta.CONTACT_KEY], delta.CONTACT_KEY, mode,
+                                     "ContactUpdate")
+
+    uploads = {"New": new, "LeadUpdate": lead_update, "ContactUpdate": contact_update}
+    uploads = {sheet: data for sheet, data in uploads.items() if data.shape[0] > 0}
+    metrics.count_rows(rows_out=sum(len(data) for data in uploads.values()))
+
+    # the Excel file keeps the whole buckets, sfdc_counts counts them for the archive, only the CSVs are cut down
+    sheets = {sheet: data for sheet, data in sheets.items() if data.shape[0] > 0}
+    write_uploads(demo_obj, uploads, f"{demo_obj.sf_upload}-manifest", prefix=demo_obj.sf_upload,
+                  workbook=demo_obj.sf_path, sheets=sheets)
+
+
+@metrics.timed
 def udb_post_val(demo_obj: demo.Demo) -> None:
     """Prepare udb file for upload
 
@@ -488,54 +613,81 @@ def udb_post_val(demo_obj: demo.Demo) -> None:
     :return: None
     :rtype: None
     """
-    udb = pd.read_excel(demo_obj.udb_path, sheet_name=demo_obj.udb_upload)
-    udb = udb.fillna('')
-
-    udb_cols = ['EmailValidation', 'Current Owner', 'Current Owner ID', 'LastNameValidation', 'FirstNameValidation',
-                'EmailValidation', 'CompanyValidation', 'TitleValidation', 'Master Name']
-    for col in udb_cols:
-        try:
-            udb = udb.drop([col], axis=1)
-        except KeyError:
-            logger.info('%s missing from UDB', col)
+    udb = schema.read_excel(demo_obj.udb_path, demo_obj.udb_upload, "udb").fillna('')
 
     review_count = (udb["Company"].str.contains("REVIEW")).sum()
     if review_count > 0:
         logger.warning("Data may not have been manually reviewed, REVIEW found in Company column")
 
+    udb = project(udb, None, UDB_DROP, "UDB")
+
     # save the file as a CSV
-    udb_csv_path = os.path.join(demo_obj.destination_path,
-                                f"{demo_obj.demo_type}-"
-                                f"{demo_obj.demo_date.strftime('%m%d%y')}-{demo_obj.udb_upload}.csv")
-    udb.to_csv(udb_csv_path, index=False)
+    write_uploads(demo_obj, {demo_obj.udb_upload: udb}, f"{demo_obj.udb_upload}-manifest")
+    metrics.count_rows(rows_in=len(udb), rows_out=len(udb))
 
 
 # --------------------- VALIDATION COUNTS --------------------- #
-def validation_counts(demo_obj: demo.Demo) -> pd.DataFrame:
-    """Find counts after sfdc records upload.
+# columns of the SF validation export that are used
+VALIDATION_COLUMNS = ["Stage", "Converted Date", "Lead Owner", "SFDC ID (18 digit)", "Tracking Code", "Email"]
+
+
+@metrics.timed
+def sf_validation(demo_obj: demo.Demo) -> pd.DataFrame:
+    """Read the newest SF validation export with the AG of each record from the upload.
+
+    Only the used columns are read, and the AG is looked up by the email's hash. The result is cached on the demo and
+    in the demo folder until the export or the upload changes, don't modify it.
 
     :param demo_obj: current demo object
     :type demo_obj: demo.Demo
-    :return: None
-    :rtype: None
+    :return: uploaded records with an owner in the export, one row per SFDC ID
+    :rtype: pd.DataFrame
     """
-    files = os.listdir(demo_obj.destination_path)
-    r = re.compile(".*SF.*Validation.*")
-    sfdc_validation_file = sorted(list(filter(r.match, files)), reverse=True)[0]
+    path = sf_validation_path(demo_obj)
+    version = [os.path.basename(path), os.stat(path).st_mtime_ns, os.stat(demo_obj.sf_path).st_mtime_ns]
+    cached = demo_obj.sf_validation_cache
+    if cached is None:
+        cached = _read_validation_cache(sf_validation_cache_path(demo_obj))
+    if cached is not None and cached["version"] == version:
+        demo_obj.sf_validation_cache = cached
+        return cached["data"]
+
+    validation = pd.read_excel(path, sheet_name=1, usecols=lambda col: col in VALIDATION_COLUMNS)
+    upload = schema.read_excel(demo_obj.sf_path, demo_obj.sf_upload, "sfdc", usecols=lambda col: col in ("Email", "AG"))
+    metrics.count_rows(rows_in=len(validation))
+
+    # AG of the first upload row with each email
+    upload_keys = email_hash(upload["Email"])
+    first = ~pd.Series(upload_keys).duplicated().to_numpy()
+    ag = pd.Series(upload["AG"].to_numpy()[first], index=upload_keys[first])
+    validation["AG"] = ag.reindex(email_hash(validation["Email"])).to_numpy()
+
+    valid = validation.loc[validation["Lead Owner"].notnull(),
+                           ["Stage", "Converted Date", "Lead Owner", "AG", "SFDC ID (18 digit)", "Tracking Code",
+                            "Email"]]
+    valid = valid.drop_duplicates(subset=["SFDC ID (18 digit)"])
+    metrics.count_rows(rows_out=len(valid))
+
+    demo_obj.sf_validation_cache = {"version": version, "data": valid}
+    _write_validation_cache(sf_validation_cache_path(demo_obj), demo_obj.sf_validation_cache)
+    return valid
 
-    sfdc_validation_path = os.path.join(demo_obj.destination_path, sfdc_validation_file)
-    validation = pd.read_excel(sfdc_validation_path, sheet_name=1)
-    upload = pd.read_excel(demo_obj.sf_path, sheet_name=demo_obj.sf_upload)
 
-    valid = pd.merge(validation, upload, how="left", left_on=["Last Name", "Email"], right_on=["LastName", "Email"])
-    valid = valid[["Stage", "Converted Date", "Lead Owner", "AG", "SFDC ID (18 digit)", "Tracking Code", "Email"]]
-    valid = valid[valid["Lead Owner"].notnull()]
-    valid.drop_duplicates(subset=["SFDC ID (18 digit)"], inplace=True)
+@metrics.timed
+def validation_counts(demo_obj: demo.Demo) -> pd.DataFrame:
+    """Find counts after sfdc records upload.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: uploaded records with an owner in the SF validation export, see sf_validation
+    :rtype: pd.DataFrame
+    """
+    valid = sf_validation(demo_obj)
 
-    updated_records = len(valid[(valid["AG"] == "Active") & (valid["Converted Date"].isnull()) &
-                                (valid["Stage"].isnull())]["Lead Owner"])
-    requested_records = len((valid[(valid["AG"] != "Active") & (valid["Converted Date"].isnull()) &
-                                   (valid["Stage"].isnull())]["Lead Owner"]))
+    updated = valid[(valid["AG"] == "Active") & (valid["Converted Date"].isnull()) & (valid["Stage"].isnull())]
+    requested = valid[(valid["AG"] != "Active") & (valid["Converted Date"].isnull()) & (valid["Stage"].isnull())]
+    updated_records = len(updated["Lead Owner"])
+    requested_records = len(requested["Lead Owner"])
 
     # tracking code counts
     nc_validation = valid[(valid["Converted Date"].isnull()) & (valid["Stage"].isnull())]
@@ -557,11 +709,26 @@ def validation_counts(demo_obj: demo.Demo) -> pd.DataFrame:
                                   tmnonattendee_count=nonattendee_count,
                                   total=total_count,
                                   converted=a_convert + na_convert)
+    # the records behind converted, updated_leads and as_requested, the uploaded total of the validation window
+    lineage.record(demo_obj, {lineage.SF_VALIDATED: pd.concat([c_validation["Email"], updated["Email"],
+                                                               requested["Email"]], ignore_index=True)})
 
     return valid
 
 
 # --------------------- GENERATE EMAIL --------------------- #
+def email_values(demo_obj: demo.Demo) -> dict:
+    """Collect the values the demo template is filled in with.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: placeholder name: value
+    :rtype: dict
+    """
+    return {"demo type": demo_obj.demo_type, **demo_obj.counts.retrieve_all()}
+
+
+@metrics.timed
 def generate_email(demo_obj: demo.Demo) -> None:
     """Generates demo communication from template.
 
@@ -570,22 +737,20 @@ def generate_email(demo_obj: demo.Demo) -> None:
     :return: None
     :rtype: None
     """
-    with open(const.DEMO_TEMPLATE, 'r') as file:
-        data = file.read()
-
-        data = data.replace("[demo type]", demo_obj.demo_type)
+    template.load(const.DEMO_TEMPLATE).render_to(const.EMAIL_TEMPLATE, email_values(demo_obj))
+    os.startfile(const.EMAIL_TEMPLATE)
 
-        for item, value in demo_obj.counts.retrieve_all().items():
-            data = data.replace(f"[{item}]", str(value))
 
-    with open(const.EMAIL_TEMPLATE, 'w') as file:
-        file.write(data)
+def generate_digest(demo_objs: list, path: str = None) -> str:
+    """Generate the communication of several demos into one file.
 
-    with open(const.EMAIL_TEMPLATE, 'r+') as file:
-        lines = file.readlines()
-        file.seek(0)
-        for line in lines:
-            if "- 0 " not in line:
-                file.write(line)
-        file.truncate()
-    os.startfile(const.EMAIL_TEMPLATE)
+    :param demo_objs: demo objects in the order they are written
+    :type demo_objs: list
+    :param path: path to the output file (default the email template output)
+    :type path: str
+    :return: path to the output file
+    :rtype: str
+    """
+    path = path or const.EMAIL_TEMPLATE
+    template.load(const.DEMO_TEMPLATE).render_many_to(path, [email_values(demo_obj) for demo_obj in demo_objs])
+    return path
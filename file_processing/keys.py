@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+
+def normalize_email(emails: pd.Series) -> pd.Series:
+    """Build the join key for an email column.
+
+    The registration form, Access and Salesforce don't agree on case or surrounding spaces, so the same address can
+    be spelled several ways.
+
+    :param emails: email addresses
+    :type emails: pd.Series
+    :return: emails stripped and lowercased, '' where missing
+    :rtype: pd.Series
+    """
+    return emails.astype(object).where(emails.notna(), '').astype(str).str.strip().str.lower()
+
+
+def email_hash(emails: pd.Series) -> np.ndarray:
+    """Build a stable integer key for each email.
+
+    The key is the same across runs and machines, so arrays saved by one stage can be matched by a later one without
+    keeping the email text.
+
+    :param emails: email addresses
+    :type emails: pd.Series
+    :return: 64 bit hash of the normalized email per row
+    :rtype: np.ndarray
+    """
+    return pd.util.hash_pandas_object(normalize_email(emails), index=False).to_numpy(dtype=np.uint64)
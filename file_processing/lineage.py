@@ -0,0 +1,296 @@
+from __future__ import annotations
+import os
+import numpy as np
+import pandas as pd
+import file_processing.demo as demo
+from file_processing.keys import email_hash
+from logs.log import logger
+
+# buckets a record can land in, one bit each, a record can be in more than one
+INTERNAL = 1 << 0
+SF_EXCLUDED = 1 << 1
+NULL_PHONE = 1 << 2
+DEAD = 1 << 3
+CONTACT_NO_LEAD = 1 << 4
+NEW = 1 << 5
+LEAD_UPDATE = 1 << 6
+CONTACT_UPDATE = 1 << 7
+UDB_UPLOAD = 1 << 8
+UDB_EXCLUDE = 1 << 9
+DUPLICATE_ROW = 1 << 10
+SF_VALIDATED = 1 << 11  # counted as converted, updated or as requested from the SF validation export
+
+BUCKETS = {
+    "internal": INTERNAL,
+    "sf excluded": SF_EXCLUDED,
+    "NullPhone": NULL_PHONE,
+    "DeadNonAttendee": DEAD,
+    "ContactNoLead": CONTACT_NO_LEAD,
+    "New": NEW,
+    "LeadUpdate": LEAD_UPDATE,
+    "ContactUpdate": CONTACT_UPDATE,
+    "udb upload": UDB_UPLOAD,
+    "udb excluded": UDB_EXCLUDE,
+    "Duplicates": DUPLICATE_ROW,
+    "sf validated": SF_VALIDATED,
+}
+
+# the groups the validation totals add up on each side, every raw record should be in exactly one group per side
+SIDES = {
+    "SFDC": {
+        "internal": INTERNAL,
+        "excluded": SF_EXCLUDED,
+        "null_phone": NULL_PHONE,
+        "left_dead": DEAD,
+        "contact_no_lead": CONTACT_NO_LEAD,
+        "duplicates": DUPLICATE_ROW,
+        # what the validation window counts as uploaded, so records lost or merged in the SF upload show up here
+        "uploaded": SF_VALIDATED,
+    },
+    "UDB": {
+        "internal": INTERNAL,
+        "uploaded": UDB_UPLOAD,
+        "excluded": UDB_EXCLUDE,
+    },
+}
+
+MISSING = "missing"  # in the raw data but in no group
+MULTIPLE = "multiple"  # in more than one group
+NOT_RAW = "not in raw data"  # in a group but not in the raw data
+DUPLICATE = "duplicate registration"  # more than one raw row with the same email
+
+
+def lineage_path(demo_obj: demo.Demo) -> str:
+    """Build the path of the demo's lineage arrays.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: path to the .npz file
+    :rtype: str
+    """
+    return os.path.join(demo_obj.destination_path,
+                        f"{demo_obj.demo_type}-{demo_obj.demo_date.strftime('%m%d%y')}-Lineage.npz")
+
+
+def bucket_names(bits: int) -> str:
+    """Name the buckets set in a bitset.
+
+    :param bits: bucket bits
+    :type bits: int
+    :return: bucket names joined by commas
+    :rtype: str
+    """
+    return ", ".join(name for name, bit in BUCKETS.items() if bits & bit)
+
+
+class Lineage:
+    def __init__(self, keys: np.ndarray, emails: np.ndarray, rows: np.ndarray, attended: np.ndarray,
+                 buckets: np.ndarray):
+        """Initialize Lineage, the buckets each record of a demo landed in.
+
+        One entry per distinct email, sorted by key so stages can find their records with a binary search.
+
+        :param keys: email hash per record, see keys.email_hash
+        :type keys: np.ndarray
+        :param emails: email as first spelled in the raw data
+        :type emails: np.ndarray
+        :param rows: raw rows with the email, 0 for emails a stage found that weren't in the raw data
+        :type rows: np.ndarray
+        :param attended: whether any of the raw rows attended
+        :type attended: np.ndarray
+        :param buckets: bucket bits per record
+        :type buckets: np.ndarray
+        """
+        self.keys = keys
+        self.emails = emails
+        self.rows = rows
+        self.attended = attended
+        self.buckets = buckets
+
+    @classmethod
+    def from_raw(cls, emails: pd.Series, attended: pd.Series) -> Lineage:
+        """Key the raw registrations.
+
+        :param emails: raw email column
+        :type emails: pd.Series
+        :param attended: whether each row attended
+        :type attended: pd.Series
+        :return: lineage with every record in no bucket yet
+        :rtype: Lineage
+        """
+        keys, first, inverse = np.unique(email_hash(emails), return_index=True, return_inverse=True)
+        rows = np.bincount(inverse, minlength=len(keys)).astype(np.uint32)
+        seen = np.zeros(len(keys), dtype=bool)
+        np.logical_or.at(seen, inverse, attended.to_numpy(dtype=bool))
+        return cls(keys, emails.astype(str).to_numpy(dtype=str)[first], rows, seen,
+                   np.zeros(len(keys), dtype=np.uint16))
+
+    @classmethod
+    def load(cls, path: str) -> Lineage:
+        """Read saved lineage arrays.
+
+        :param path: path to the .npz file
+        :type path: str
+        :return: lineage
+        :rtype: Lineage
+        """
+        with np.load(path) as arrays:
+            return cls(arrays["keys"], arrays["emails"], arrays["rows"], arrays["attended"], arrays["buckets"])
+
+    def save(self, path: str) -> None:
+        """Write the lineage arrays.
+
+        :param path: path to the .npz file
+        :type path: str
+        :return: None
+        :rtype: None
+        """
+        np.savez_compressed(path, keys=self.keys, emails=self.emails, rows=self.rows, attended=self.attended,
+                            buckets=self.buckets)
+
+    def assign(self, bit: int, emails: pd.Series) -> int:
+        """Put exactly these emails in a bucket, taking every other record out of it.
+
+        A stage that runs again replaces what it recorded before. Emails that weren't in the raw data are added with 0
+        raw rows.
+
+        :param bit: bucket bit
+        :type bit: int
+        :param emails: emails that landed in the bucket
+        :type emails: pd.Series
+        :return: emails that weren't in the raw data
+        :rtype: int
+        """
+        self.buckets &= np.uint16(~bit & 0xFFFF)
+        keys = email_hash(emails)
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+
+        new_keys, first = np.unique(keys[~found], return_index=True)
+        if len(new_keys):
+            new_emails = emails.astype(str).to_numpy(dtype=str)[~found][first]
+            keys_all = np.concatenate([self.keys, new_keys])
+            order = np.argsort(keys_all, kind='mergesort')
+            self.keys = keys_all[order]
+            self.emails = np.concatenate([self.emails, new_emails])[order]
+            self.rows = np.concatenate([self.rows, np.zeros(len(new_keys), dtype=self.rows.dtype)])[order]
+            self.attended = np.concatenate([self.attended, np.zeros(len(new_keys), dtype=bool)])[order]
+            self.buckets = np.concatenate([self.buckets, np.zeros(len(new_keys), dtype=np.uint16)])[order]
+            pos = np.searchsorted(self.keys, keys)
+
+        self.buckets[pos] |= np.uint16(bit)
+        return len(new_keys)
+
+    def groups(self, side: str) -> np.ndarray:
+        """Find which of a side's groups each record is in.
+
+        :param side: "SFDC" or "UDB"
+        :type side: str
+        :return: boolean array, one row per group in SIDES order and one column per record
+        :rtype: np.ndarray
+        """
+        return np.stack([(self.buckets & mask) != 0 for mask in SIDES[side].values()])
+
+    def reconcile(self) -> pd.DataFrame:
+        """Explain the variance between the raw count and the group totals record by record.
+
+        The variance of a record is the groups it is in minus its raw rows, records that reconcile have none, so the
+        Variance column of a side adds up to the side's variance.
+
+        :return: Side, Issues, Email, Attended, Rows, Buckets and Variance per record and side that doesn't reconcile
+        :rtype: pd.DataFrame
+        """
+        frames = []
+        for side in SIDES:
+            hits = self.groups(side).sum(axis=0)
+            raw = self.rows > 0
+            issues = {
+                MISSING: raw & (hits == 0),
+                MULTIPLE: hits > 1,
+                NOT_RAW: ~raw & (hits > 0),
+                DUPLICATE: (self.rows > 1) & (hits > 0),
+            }
+            idx = np.flatnonzero(np.logical_or.reduce(list(issues.values())))
+            frames.append(pd.DataFrame({
+                "Side": side,
+                "Issues": ["; ".join(issue for issue, mask in issues.items() if mask[i]) for i in idx],
+                "Email": self.emails[idx],
+                "Attended": np.where(self.attended[idx], "Yes", "No"),
+                "Rows": self.rows[idx],
+                "Buckets": [bucket_names(int(bits)) for bits in self.buckets[idx]],
+                "Variance": hits[idx].astype(np.int64) - self.rows[idx].astype(np.int64),
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+    def variance(self, side: str) -> int:
+        """Find a side's variance, the records in its groups minus the raw rows.
+
+        :param side: "SFDC" or "UDB"
+        :type side: str
+        :return: variance
+        :rtype: int
+        """
+        return int(self.groups(side).sum()) - int(self.rows.sum())
+
+
+# --------------------- STAGES --------------------- #
+def start(demo_obj: demo.Demo, emails: pd.Series, attended: pd.Series, internal: pd.Series) -> None:
+    """Key the raw records of a demo, replacing any lineage from an earlier run.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :param emails: raw email column
+    :type emails: pd.Series
+    :param attended: whether each row attended
+    :type attended: pd.Series
+    :param internal: emails of the internal records
+    :type internal: pd.Series
+    :return: None
+    :rtype: None
+    """
+    lineage = Lineage.from_raw(emails, attended)
+    lineage.assign(INTERNAL, internal)
+    os.makedirs(demo_obj.destination_path, exist_ok=True)
+    lineage.save(lineage_path(demo_obj))
+
+
+def record(demo_obj: demo.Demo, buckets: dict) -> None:
+    """Record the records a stage put in each of its buckets.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :param buckets: bucket bit: emails in the bucket
+    :type buckets: dict
+    :return: None
+    :rtype: None
+    """
+    path = lineage_path(demo_obj)
+    try:
+        lineage = Lineage.load(path)
+    except FileNotFoundError:
+        logger.warning("No lineage for this demo, run initial counts to start one")
+        return
+
+    for bit, emails in buckets.items():
+        added = lineage.assign(bit, emails)
+        if added:
+            logger.warning("%d %s emails weren't in the raw data", added, bucket_names(bit))
+    lineage.save(path)
+
+
+def explain(demo_obj: demo.Demo) -> pd.DataFrame:
+    """Reconcile the demo and save the records that explain its variance next to its uploads.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: records that don't reconcile, see Lineage.reconcile
+    :rtype: pd.DataFrame
+    """
+    lineage = Lineage.load(lineage_path(demo_obj))
+    report = lineage.reconcile()
+    for side in SIDES:
+        logger.info("%s variance %d, explained by %d records", side, lineage.variance(side),
+                    (report["Side"] == side).sum())
+    report.to_csv(os.path.splitext(lineage_path(demo_obj))[0] + "-report.csv", index=False)
+    return report
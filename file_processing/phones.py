@@ -0,0 +1,261 @@
+from __future__ import annotations
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+import file_processing.demo as demo
+import file_processing.schema as schema
+import file_processing.archive as archive
+import file_processing.archive_tiers as archive_tiers
+import file_processing.constants as demo_c
+import file_processing.file_paths as const
+from file_processing.keys import email_hash
+from logs.log import logger
+
+# phones of every archived registration and upload, rebuilt whenever the archive changes
+HISTORY_CACHE_PATH = os.path.join(os.path.dirname(const.SETTINGS_PATH), "phone_history.npz")
+
+# an extension typed after the number, e.g. "555-123-4567 ext. 89", "5551234567x89" or "555.123.4567 #89"
+EXTENSION = re.compile(r"^(.*?\d.*?)[\s,;]*(?:extension|ext\.?|x|#)\s*(\d{1,6})$", re.IGNORECASE)
+MIN_DIGITS = 7  # fewer digits than a local number is a placeholder, not a phone
+
+
+def _text(phones: pd.Series) -> pd.Series:
+    return phones.astype(object).where(phones.notna(), '').astype(str).str.strip()
+
+
+def split_extension(phones: pd.Series) -> tuple:
+    """Split extensions typed into the phone number off the number.
+
+    :param phones: phone numbers
+    :type phones: pd.Series
+    :return: (number without the extension, extension or '')
+    :rtype: tuple
+    """
+    text = _text(phones)
+    found = text.str.extract(EXTENSION)
+    has_ext = found[1].notna()
+    return text.where(~has_ext, found[0]), found[1].fillna('')
+
+
+def canonical(phones: pd.Series) -> pd.Series:
+    """Write phone numbers one way.
+
+    North American numbers (10 digits, or 11 starting with 1, with an area code starting 2-9) become 555-123-4567,
+    other numbers starting with + become + and their digits, anything else is kept as typed. Values with fewer than
+    MIN_DIGITS digits or a single repeated digit (0000000000) are blanked.
+
+    :param phones: phone numbers without extensions
+    :type phones: pd.Series
+    :return: canonical numbers, '' where there is no phone
+    :rtype: pd.Series
+    """
+    text = _text(phones)
+    digits = text.str.replace(r"\D", '', regex=True)
+    length = digits.str.len()
+    international = text.str.startswith('+') & ~digits.str.startswith('1')
+    last10 = digits.str[-10:]
+    # North American area codes don't start with 0 or 1
+    nanp = ~international & ((length == 10) | ((length == 11) & digits.str.startswith('1'))) & \
+        last10.str.match(r"[2-9]")
+    junk = (length < MIN_DIGITS) | digits.str.fullmatch(r"(\d)\1*")
+
+    result = text.where(~international, '+' + digits)
+    result = result.where(~nanp, last10.str[:3] + '-' + last10.str[3:6] + '-' + last10.str[6:])
+    return result.where(~junk, '')
+
+
+def normalize(phones: pd.Series) -> tuple:
+    """Split off extensions and write the numbers one way.
+
+    :param phones: phone numbers as typed
+    :type phones: pd.Series
+    :return: (canonical number, extension)
+    :rtype: tuple
+    """
+    number, ext = split_extension(phones)
+    return canonical(number), ext
+
+
+# --------------------- LOOKUP --------------------- #
+class PhoneIndex:
+    def __init__(self, keys: np.ndarray, phones: np.ndarray, exts: np.ndarray, source: str = ''):
+        """Initialize PhoneIndex, the latest known phone of each email.
+
+        :param keys: email hash per address, sorted, see keys.email_hash
+        :type keys: np.ndarray
+        :param phones: canonical phone per address
+        :type phones: np.ndarray
+        :param exts: extension per address
+        :type exts: np.ndarray
+        :param source: signature of the archive the phones were read from
+        :type source: str
+        """
+        self.keys = keys
+        self.phones = phones
+        self.exts = exts
+        self.source = source
+
+    @classmethod
+    def empty(cls) -> PhoneIndex:
+        return cls(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=str), np.zeros(0, dtype=str))
+
+    @classmethod
+    def from_frame(cls, emails: pd.Series, phones: pd.Series, source: str = '') -> PhoneIndex:
+        """Index the phones of a frame, the last row with a phone wins.
+
+        :param emails: email addresses
+        :type emails: pd.Series
+        :param phones: phone numbers as typed
+        :type phones: pd.Series
+        :param source: signature of the archive
+        :type source: str
+        :return: index
+        :rtype: PhoneIndex
+        """
+        number, ext = normalize(phones)
+        known = (number != '').to_numpy()
+        keys = email_hash(emails)[known][::-1]
+        unique, last = np.unique(keys, return_index=True)
+        return cls(unique, number.to_numpy(dtype=str)[known][::-1][last], ext.to_numpy(dtype=str)[known][::-1][last],
+                   source)
+
+    @classmethod
+    def load(cls, path: str = None) -> PhoneIndex:
+        with np.load(path or HISTORY_CACHE_PATH) as arrays:
+            return cls(arrays["keys"], arrays["phones"], arrays["exts"], str(arrays["source"]))
+
+    def save(self, path: str = None) -> None:
+        path = path or HISTORY_CACHE_PATH
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, keys=self.keys, phones=self.phones, exts=self.exts, source=np.array(self.source))
+        os.replace(tmp_path, path)
+
+    def lookup(self, emails: pd.Series) -> tuple:
+        """Find the phone of each email.
+
+        :param emails: email addresses
+        :type emails: pd.Series
+        :return: (phone, extension) arrays, '' for emails without a known phone
+        :rtype: tuple
+        """
+        if not len(self.keys):
+            return np.full(len(emails), '', dtype=object), np.full(len(emails), '', dtype=object)
+        keys = email_hash(emails)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        return (np.where(found, self.phones[pos], '').astype(object),
+                np.where(found, self.exts[pos], '').astype(object))
+
+
+def _last_phones(email_col: str, phone_col: str):
+    """Build a reduce for archive_tiers.ColdSummary keeping the last row with a phone of every email."""
+    def reduce(data: pd.DataFrame) -> pd.DataFrame:
+        number, _ = normalize(data[phone_col])
+        data = data[(number != '').to_numpy()]
+        return data[~pd.Series(email_hash(data[email_col])).duplicated(keep='last').to_numpy()]
+    return reduce
+
+
+# phones of the cold archive, so a changed archive only has its new cold files and the workbook read
+RAW_SUMMARY = archive_tiers.ColdSummary("phones-raw", archive.RAW_SHEET, "archive_raw",
+                                        _last_phones("Email Address", "Phone"), ["Email Address", "Phone"])
+SFDC_SUMMARY = archive_tiers.ColdSummary("phones-sfdc", archive.SFDC_SHEET, "archive_sfdc",
+                                         _last_phones("Email", "PhoneNumber"), ["Email", "PhoneNumber"])
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def archived_phones() -> PhoneIndex:
+    """Get the phones of the archived registrations and uploads, reading the archive again only when it changed.
+
+    Uploads are indexed after registrations, so an upload's cleaned phone wins over the phone typed at registration.
+
+    :return: index, empty if the archive can't be read
+    :rtype: PhoneIndex
+    """
+    global _history
+    with _history_lock:
+        try:
+            stat = os.stat(const.ARCHIVE_PATH)
+        except OSError as e:
+            logger.warning("The archive can't be reached, phones are recovered without it %s", repr(e))
+            return _history or PhoneIndex.empty()
+        source = f"{stat.st_size}-{stat.st_mtime_ns}"
+        if _history is not None and _history.source == source:
+            return _history
+
+        try:
+            history = PhoneIndex.load()
+        except (OSError, KeyError, ValueError):
+            history = None
+        if history is None or history.source != source:
+            try:
+                raw = RAW_SUMMARY.rows()
+                uploads = SFDC_SUMMARY.rows()
+            except (OSError, ValueError) as e:
+                logger.warning("The archive can't be read, phones are recovered without it %s", repr(e))
+                return _history or PhoneIndex.empty()
+            history = PhoneIndex.from_frame(pd.concat([raw["Email Address"], uploads["Email"]], ignore_index=True),
+                                            pd.concat([raw["Phone"], uploads["PhoneNumber"]], ignore_index=True),
+                                            source)
+            history.save()
+            logger.info("Phone history rebuilt, %d archived phones", len(history.keys))
+        _history = history
+        return history
+
+
+def raw_phones(demo_obj: demo.Demo) -> PhoneIndex:
+    """Index the phones the demo's registrants typed in the raw data.
+
+    :param demo_obj: current demo object
+    :type demo_obj: demo.Demo
+    :return: index, empty if the raw data can't be found
+    :rtype: PhoneIndex
+    """
+    # the raw data is moved into the demo folder after step one, unless the watcher ran it
+    for path in (os.path.join(demo_obj.destination_path, os.path.basename(demo_c.RAW_DATA_PATH)),
+                 demo_c.RAW_DATA_PATH):
+        if os.path.exists(path):
+            raw = schema.read_excel(path, demo_c.RAW_DATA_SHEET, "raw", usecols=["Email Address", "Phone"])
+            return PhoneIndex.from_frame(raw["Email Address"], raw["Phone"])
+    logger.warning("There was no raw data to recover phones from")
+    return PhoneIndex.empty()
+
+
+def recover(data: pd.DataFrame, indexes: list, phone: str = "PhoneNumber", ext: str = "PhoneExt",
+            key: str = "Email") -> int:
+    """Fill in empty phones from the indexes, in place.
+
+    :param data: frame with email and phone columns
+    :type data: pd.DataFrame
+    :param indexes: PhoneIndex per source, the first one with a phone for an email is used
+    :type indexes: list
+    :param phone: phone column (default "PhoneNumber")
+    :type phone: str
+    :param ext: extension column, filled only where it is empty (default "PhoneExt")
+    :type ext: str
+    :param key: email column (default "Email")
+    :type key: str
+    :return: phones recovered
+    :rtype: int
+    """
+    missing = (data[phone] == '').to_numpy(copy=True)
+    recovered = 0
+    for index in indexes:
+        if not missing.any():
+            break
+        rows = data.index[missing]
+        phones, exts = index.lookup(data.loc[rows, key])
+        found = phones != ''
+        if not found.any():
+            continue
+        data.loc[rows[found], phone] = phones[found]
+        if ext in data.columns:
+            fill_ext = found & (data.loc[rows, ext] == '').to_numpy()
+            data.loc[rows[fill_ext], ext] = exts[fill_ext]
+        missing[np.flatnonzero(missing)[found]] = False
+        recovered += int(found.sum())
+    return recovered
@@ -0,0 +1,370 @@
+from __future__ import annotations
+import os
+import json
+import hashlib
+from operator import attrgetter
+import file_processing.demo as demo
+import file_processing.dedup as dedup
+import file_processing.email_check as email_check
+import file_processing.helpers as demo_f
+import file_processing.constants as demo_c
+import file_processing.archive_helpers as demo_a
+from file_processing.archive import ArchiveMgr
+from logs.log import logger, log_context
+from logs import metrics
+
+STATE_FILE = "pipeline_state.json"
+
+
+class Stage:
+    def __init__(self, name: str, func, inputs=(), outputs=(), rewrites=(), optional=(), after=(), manual=False):
+        """Initialize Stage.
+
+        Every path argument is a list of functions that take the demo object and return a path.
+
+        :param name: name of the stage
+        :type name: str
+        :param func: function run by the stage, called with the demo object
+        :type func: callable
+        :param inputs: files the stage reads
+        :type inputs: tuple
+        :param outputs: files the stage writes
+        :type outputs: tuple
+        :param rewrites: inputs the stage rewrites in place; later edits to these only invalidate downstream stages
+        :type rewrites: tuple
+        :param optional: inputs that are allowed to be missing
+        :type optional: tuple
+        :param after: names of stages this one depends on without sharing a file
+        :type after: tuple
+        :param manual: the stage has side effects outside the demo folder (archive appends, opening an email), so
+            Pipeline.run only reruns it once it has been run from its own step (default False)
+        :type manual: bool
+        """
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = tuple(outputs) + tuple(rewrites)
+        self.rewrites = rewrites
+        self.optional = optional
+        self.after = after
+        self.manual = manual
+
+    @staticmethod
+    def _resolve(getters, demo_obj: demo.Demo) -> list:
+        paths = []
+        for getter in getters:
+            try:
+                paths.append(getter(demo_obj))
+            except (IndexError, FileNotFoundError):
+                # e.g. no SF validation export has been saved yet
+                continue
+        return paths
+
+    def input_paths(self, demo_obj: demo.Demo) -> list:
+        return self._resolve(self.inputs, demo_obj)
+
+    def output_paths(self, demo_obj: demo.Demo) -> list:
+        return self._resolve(self.outputs, demo_obj)
+
+    def rewrite_paths(self, demo_obj: demo.Demo) -> list:
+        return self._resolve(self.rewrites, demo_obj)
+
+    def missing_inputs(self, demo_obj: demo.Demo) -> list:
+        """List the required inputs that don't exist.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :return: missing paths
+        :rtype: list
+        """
+        optional = self._resolve(self.optional, demo_obj)
+        paths = self.input_paths(demo_obj)
+        missing = [path for path in paths if path not in optional and not os.path.exists(path)]
+        if len(paths) < len(self.inputs):
+            missing.append(f"{len(self.inputs) - len(paths)} unresolved input(s)")
+        return missing
+
+
+def file_hash(path: str) -> str | None:
+    """Hash the contents of a file.
+
+    :param path: path to the file
+    :type path: str
+    :return: hex digest, None if the file doesn't exist
+    :rtype: str | None
+    """
+    try:
+        with open(path, 'rb') as file:
+            digest = hashlib.blake2b()
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, stages: list):
+        """Initialize Pipeline.
+
+        :param stages: stages in the order they are run
+        :type stages: list
+        """
+        self.stages = {stage.name: stage for stage in stages}
+
+    # --------------------- STATE --------------------- #
+    @staticmethod
+    def _state_path(demo_obj: demo.Demo) -> str:
+        return os.path.join(demo_obj.destination_path, STATE_FILE)
+
+    def load_state(self, demo_obj: demo.Demo) -> dict:
+        """Load the recorded hashes for the demo.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :return: recorded inputs and outputs per stage
+        :rtype: dict
+        """
+        try:
+            with open(self._state_path(demo_obj), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, demo_obj: demo.Demo, state: dict) -> None:
+        os.makedirs(demo_obj.destination_path, exist_ok=True)
+        with open(self._state_path(demo_obj), 'w') as file:
+            json.dump(state, file, indent=2)
+
+    # --------------------- GRAPH --------------------- #
+    def dependencies(self, demo_obj: demo.Demo, name: str) -> list:
+        """Find the earlier stages a stage depends on.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param name: name of the stage
+        :type name: str
+        :return: names of upstream stages
+        :rtype: list
+        """
+        stage = self.stages[name]
+        inputs = set(stage.input_paths(demo_obj))
+        deps = list(stage.after)
+        for upstream in self.stages.values():
+            if upstream is stage:
+                break
+            if inputs & set(upstream.output_paths(demo_obj)) and upstream.name not in deps:
+                deps.append(upstream.name)
+        return deps
+
+    def _producer(self, demo_obj: demo.Demo, name: str, path: str) -> str | None:
+        """Find the last stage before name that writes path."""
+        producer = None
+        for upstream in self.stages.values():
+            if upstream.name == name:
+                break
+            if path in upstream.output_paths(demo_obj):
+                producer = upstream.name
+        return producer
+
+    def _input_versions(self, demo_obj: demo.Demo, name: str, state: dict) -> dict:
+        """Hash the inputs of a stage.
+
+        Files the stage rewrites in place are versioned by what their upstream stage last wrote, so a manual edit
+        made after the stage ran doesn't make the stage itself rerun.
+        """
+        stage = self.stages[name]
+        rewrites = stage.rewrite_paths(demo_obj)
+        recorded = state.get(name, {}).get("inputs", {})
+        versions = {}
+        for path in stage.input_paths(demo_obj):
+            if path not in rewrites:
+                versions[path] = file_hash(path)
+                continue
+
+            producer = self._producer(demo_obj, name, path)
+            if producer in state:
+                versions[path] = state[producer]["outputs"].get(path)
+            elif path in recorded:
+                # the upstream stage ran outside the pipeline, so there is nothing newer to compare against
+                versions[path] = recorded[path]
+            else:
+                versions[path] = file_hash(path)
+        return versions
+
+    def stale(self, demo_obj: demo.Demo, name: str, state: dict = None) -> bool:
+        """Check if a stage's inputs changed since it last ran.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param name: name of the stage
+        :type name: str
+        :param state: recorded state (default loaded from the demo folder)
+        :type state: dict
+        :return: whether the stage needs to run
+        :rtype: bool
+        """
+        if state is None:
+            state = self.load_state(demo_obj)
+        if name not in state:
+            return True
+        return self._input_versions(demo_obj, name, state) != state[name]["inputs"]
+
+    def fresh_rewrites(self, demo_obj: demo.Demo, name: str, state: dict = None) -> bool:
+        """Check if an upstream stage wrote a new version of a file the stage rewrites in place.
+
+        Until then the file holds the stage's own output, and running the stage over it again would clean it twice.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param name: name of the stage
+        :type name: str
+        :param state: recorded state (default loaded from the demo folder)
+        :type state: dict
+        :return: whether a rewritten file is new, True if the stage hasn't run
+        :rtype: bool
+        """
+        if state is None:
+            state = self.load_state(demo_obj)
+        if name not in state:
+            return True
+        versions = self._input_versions(demo_obj, name, state)
+        recorded = state[name]["inputs"]
+        return any(versions.get(path) != recorded.get(path) for path in self.stages[name].rewrite_paths(demo_obj))
+
+    # --------------------- RUN --------------------- #
+    def run_stage(self, demo_obj: demo.Demo, name: str, *args, **kwargs):
+        """Run one stage and record the hashes of its inputs and outputs.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param name: name of the stage
+        :type name: str
+        :param args: extra arguments for the stage function
+        :type args: any
+        :param kwargs: extra keyword arguments for the stage function
+        :type kwargs: any
+        :return: what the stage function returns
+        :rtype: any
+        """
+        stage = self.stages[name]
+        os.makedirs(demo_obj.destination_path, exist_ok=True)
+        outputs = stage.output_paths(demo_obj)
+        before = {path: file_hash(path) for path in outputs}
+
+        with log_context(demo=f"{demo_obj.demo_type} ({demo_obj.demo_date.strftime('%m/%d/%Y')})", stage=name):
+            result = stage.func(demo_obj, *args, **kwargs)
+
+        state = self.load_state(demo_obj)
+        after = {path: file_hash(path) for path in stage.output_paths(demo_obj)}
+
+        # files this stage changed were changed by the pipeline, not by hand, so other stages that were up to date
+        # with the old version are up to date with the new one
+        for other, record in state.items():
+            if other == name or other not in self.stages:
+                continue
+            skip = self.stages[other].rewrite_paths(demo_obj)
+            for path, version in record["inputs"].items():
+                if path in after and path not in skip and version is not None and version == before.get(path):
+                    record["inputs"][path] = after[path]
+
+        state[name] = {"inputs": self._input_versions(demo_obj, name, state), "outputs": after}
+        self._save_state(demo_obj, state)
+        logger.info("Stage %s finished", name)
+        return result
+
+    def run(self, demo_obj: demo.Demo, force: bool = False) -> dict:
+        """Run every stage whose inputs or upstream stages changed.
+
+        Manual stages are left alone until they have been run from their own step, after that they rerun when their
+        inputs change. Stages that rewrite a file in place only rerun once an upstream stage wrote a new version of it.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param force: run every stage regardless, except manual stages that haven't run yet (default False)
+        :type force: bool
+        :return: results of the stages that ran
+        :rtype: dict
+        """
+        results = {}
+        for name, stage in self.stages.items():
+            missing = stage.missing_inputs(demo_obj)
+            if missing:
+                logger.info("Skipping stage %s, missing inputs: %s", name, missing)
+                continue
+
+            state = self.load_state(demo_obj)
+            if stage.manual and name not in state:
+                logger.info("Skipping stage %s, it hasn't been run from its step yet", name)
+                continue
+            if stage.rewrites and not force and not self.fresh_rewrites(demo_obj, name, state):
+                if self.stale(demo_obj, name, state):
+                    logger.info("Skipping stage %s, its files were already cleaned, run the step before it again to "
+                                "redo it", name)
+                continue
+
+            upstream_ran = any(dep in results for dep in self.dependencies(demo_obj, name))
+            if force or upstream_ran or self.stale(demo_obj, name, state):
+                logger.info("Running stage %s", name)
+                results[name] = self.run_stage(demo_obj, name)
+        metrics.log_summary()
+        return results
+
+
+# --------------------- DEMO STAGES --------------------- #
+def raw_data_path(demo_obj: demo.Demo) -> str:
+    """Path of the raw data file waiting to be processed."""
+    return demo_c.RAW_DATA_PATH
+
+
+def raw_copy_path(demo_obj: demo.Demo) -> str:
+    """Path of the raw data file once it's moved into the demo folder."""
+    return os.path.join(demo_obj.destination_path, os.path.basename(demo_c.RAW_DATA_PATH))
+
+
+def _manifest(name):
+    # the manifest lists every CSV part with its checksum, so it changes whenever any part does
+    return lambda demo_obj: demo_f.manifest_path(demo_obj, name(demo_obj))
+
+
+def _append_sfdc(demo_obj: demo.Demo, new_ids=None) -> None:
+    if new_ids is None:
+        new_ids = demo_f.sf_validation(demo_obj)
+    ArchiveMgr(demo_obj).append_sfdc(new_ids)
+
+
+def _append_counts(demo_obj: demo.Demo) -> None:
+    demo_a.sfdc_counts(demo_obj)
+    demo_a.udb_counts(demo_obj)
+    ArchiveMgr(demo_obj).append_counts()
+
+
+sf_path = attrgetter("sf_path")
+sf_exclude_path = attrgetter("sf_exclude_path")
+udb_path = attrgetter("udb_path")
+exclude_path = attrgetter("exclude_path")
+
+PIPELINE = Pipeline([
+    Stage("initial_counts", demo_f.initial_counts, inputs=[raw_data_path]),
+    Stage("flag_duplicates", dedup.flag_duplicates, inputs=[raw_data_path], outputs=[dedup.duplicates_path]),
+    Stage("check_emails", email_check.check_emails, inputs=[raw_data_path], outputs=[email_check.report_path]),
+    Stage("run_through_access", demo.Demo.run_through_access, inputs=[raw_data_path],
+          outputs=[sf_path, udb_path, exclude_path, sf_exclude_path]),
+    Stage("sfdc_pre_val", demo_f.sfdc_pre_val, inputs=[sf_path, sf_exclude_path, dedup.duplicates_path, raw_copy_path],
+          rewrites=[sf_path], optional=[sf_exclude_path, dedup.duplicates_path, raw_copy_path]),
+    Stage("udb_pre_val", demo_f.udb_pre_val, inputs=[sf_path, udb_path, exclude_path], rewrites=[udb_path]),
+    Stage("sfdc_post_val", demo_f.sfdc_post_val, inputs=[sf_path],
+          outputs=[sf_path, _manifest(lambda d: f"{d.sf_upload}-manifest")]),
+    Stage("udb_post_val", demo_f.udb_post_val, inputs=[udb_path],
+          outputs=[_manifest(lambda d: f"{d.udb_upload}-manifest")]),
+    Stage("validation_counts", demo_f.validation_counts, inputs=[demo_f.sf_validation_path, sf_path],
+          after=["sfdc_post_val"]),
+    Stage("generate_email", demo_f.generate_email, after=["validation_counts"], manual=True),
+    Stage("archive_raw", lambda demo_obj: ArchiveMgr(demo_obj).append_raw(), inputs=[raw_copy_path], manual=True),
+    Stage("archive_sfdc", _append_sfdc, inputs=[demo_f.sf_validation_path, sf_path], after=["validation_counts"],
+          manual=True),
+    Stage("archive_udb", lambda demo_obj: ArchiveMgr(demo_obj).append_udb(), inputs=[udb_path],
+          after=["udb_post_val"], manual=True),
+    Stage("archive_counts", _append_counts, inputs=[sf_path, udb_path, exclude_path],
+          after=["archive_raw", "archive_sfdc", "archive_udb"], manual=True),
+])
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import pandas as pd
+
+# column dtypes
+STRING = "string"
+CATEGORY = "category"
+FLAG = "flag"  # Y/N column, read as a boolean
+PRESENT = "present"  # any value in the column counts as True
+
+# the Y/N flag columns the Access queries add to the udb and exclude files
+_YN_FLAGS = ["FreshAddressBadEmail", "Undeliverable"]
+
+SFDC = {
+    "LastName": STRING,
+    "FirstName": STRING,
+    "Email": STRING,
+    "Domain": STRING,
+    "State": CATEGORY,
+    "Country": CATEGORY,
+    "PhoneNumber": STRING,
+    "PhoneExt": STRING,
+    "Existing Lead Phone": STRING,
+    "Company": STRING,
+    "Master Name": STRING,
+    "Existing Lead Compnay": STRING,
+    "CustomerTitle": STRING,
+    "AG": CATEGORY,
+    "TrackingCode": CATEGORY,
+    "PubCode": CATEGORY,
+    "LeadSource": CATEGORY,
+    "Record Type ID": CATEGORY,
+    "Current Lead Status": CATEGORY,
+    "Current Owner": CATEGORY,
+    "Current Owner ID": CATEGORY,
+    "Current Marketing Note": STRING,
+    "Current Sales Note": STRING,
+    "Current Secondary Description": STRING,
+    "Dead Reason": CATEGORY,
+    "Existing Lead ID": STRING,
+    "Existing Contact ID": STRING,
+    "EmailValidation": CATEGORY,
+    "LastNameValidation": CATEGORY,
+    "FirstNameValidation": CATEGORY,
+    "CompanyValidation": CATEGORY,
+    "TitleValidation": CATEGORY,
+}
+
+# State, PhoneNumber, Company, etc. stay strings here because udb_pre_val copies the sfdc values into them
+UDB = {
+    "LastName": STRING,
+    "FirstName": STRING,
+    "Email": STRING,
+    "State": STRING,
+    "PhoneNumber": STRING,
+    "PhoneExt": STRING,
+    "Company": STRING,
+    "CustomerTitle": STRING,
+    "TrackingCode": CATEGORY,
+    "LeadSource": CATEGORY,
+    "OppProduct": CATEGORY,
+    "Site": CATEGORY,
+    "SalesNotes": CATEGORY,
+    "MarketingNotes": CATEGORY,
+    "NewsletterIDs": CATEGORY,
+    "Current Owner": CATEGORY,
+    "Current Owner ID": CATEGORY,
+    "EmailValidation": CATEGORY,
+    "LastNameValidation": CATEGORY,
+    "FirstNameValidation": CATEGORY,
+    "CompanyValidation": CATEGORY,
+    "TitleValidation": CATEGORY,
+    **{col: CATEGORY for col in _YN_FLAGS},
+}
+
+# the exclude file is only read for counts, so its flags can be real booleans
+EXCLUDE = {
+    "Email": STRING,
+    "TrackingCode": CATEGORY,
+    "MasterSuppression": PRESENT,
+    "IsActiveFalse": PRESENT,
+    "HardBounce": PRESENT,
+    **{col: FLAG for col in _YN_FLAGS},
+}
+
+RAW = {
+    "Attended": CATEGORY,
+    "Last Name": STRING,
+    "First Name": STRING,
+    "Email Address": STRING,
+    "State/Province": CATEGORY,
+    "Phone": STRING,
+    "Organization": STRING,
+    "Job Title": STRING,
+    "Unsubscribed": CATEGORY,
+}
+
+# archive sheets are rewritten as is, so nothing in them is converted to a boolean
+ARCHIVE_RAW = {
+    **RAW,
+    "Type": CATEGORY,
+}
+
+ARCHIVE_SFDC = {
+    **SFDC,
+    "SFDC ID (18 digit)": STRING,
+    "Type": CATEGORY,
+}
+
+ARCHIVE_UDB = {
+    **UDB,
+    **{col: CATEGORY for col in ("State", "Company")},
+    "Type": CATEGORY,
+}
+
+ARCHIVE_COUNTS = {
+    "Type": CATEGORY,
+    "Pub_Code": CATEGORY,
+    "SF_TrackingCode": CATEGORY,
+    "UDB_TrackingCode": CATEGORY,
+}
+
+SCHEMAS = {
+    "sfdc": SFDC,
+    "udb": UDB,
+    "exclude": EXCLUDE,
+    "raw": RAW,
+    "archive_raw": ARCHIVE_RAW,
+    "archive_sfdc": ARCHIVE_SFDC,
+    "archive_udb": ARCHIVE_UDB,
+    "archive_counts": ARCHIVE_COUNTS,
+}
+
+
+def _as_text(column: pd.Series) -> pd.Series:
+    """Blank out missing values and convert everything else to text."""
+    return column.where(column.notnull(), '').astype(str)
+
+
+def apply_schema(data: pd.DataFrame, frame: str) -> pd.DataFrame:
+    """Set the registered dtypes on a frame.
+
+    String and category columns have missing values replaced with '', so the usual ``== ''`` checks keep working, and
+    every category column carries '' as a category so later ``fillna('')`` calls do not fail.
+
+    :param data: frame to convert
+    :type data: pd.DataFrame
+    :param frame: name of the registered schema (see SCHEMAS)
+    :type frame: str
+    :return: converted frame
+    :rtype: pd.DataFrame
+    """
+    schema = SCHEMAS[frame]
+    for col, dtype in schema.items():
+        if col not in data.columns:
+            continue
+
+        if dtype == STRING:
+            data[col] = _as_text(data[col]).astype(STRING)
+        elif dtype == CATEGORY:
+            column = _as_text(data[col]).astype(CATEGORY)
+            if '' not in column.cat.categories:
+                column = column.cat.add_categories([''])
+            data[col] = column
+        elif dtype == FLAG:
+            data[col] = _as_text(data[col]) == "Y"
+        elif dtype == PRESENT:
+            data[col] = data[col].notnull()
+        else:
+            raise ValueError(f"{dtype} is not a valid schema dtype.")
+    return data
+
+
+def read_excel(path: str | pd.ExcelFile, sheet: str | int, frame: str, **kwargs) -> pd.DataFrame:
+    """Read an Excel sheet with the registered dtypes applied.
+
+    Text columns are parsed as text so values such as phone numbers and IDs are not turned into floats.
+
+    :param path: path to the Excel file, or the file already opened to read several sheets
+    :type path: str | pd.ExcelFile
+    :param sheet: sheet name or position
+    :type sheet: str | int
+    :param frame: name of the registered schema (see SCHEMAS)
+    :type frame: str
+    :param kwargs: extra arguments passed on to pd.read_excel
+    :type kwargs: any
+    :return: data in the sheet
+    :rtype: pd.DataFrame
+    """
+    text_cols = {col: object for col, dtype in SCHEMAS[frame].items() if dtype in (STRING, CATEGORY)}
+    data = pd.read_excel(path, sheet_name=sheet, dtype=text_cols, **kwargs)
+    return apply_schema(data, frame)
+
+
+def read_csv(path: str, frame: str, **kwargs) -> pd.DataFrame:
+    """Read a CSV file with the registered dtypes applied, see read_excel.
+
+    :param path: path to the CSV file, compressed files are read by their extension
+    :type path: str
+    :param frame: name of the registered schema (see SCHEMAS)
+    :type frame: str
+    :param kwargs: extra arguments passed on to pd.read_csv
+    :type kwargs: any
+    :return: data in the file
+    :rtype: pd.DataFrame
+    """
+    text_cols = {col: object for col, dtype in SCHEMAS[frame].items() if dtype in (STRING, CATEGORY)}
+    data = pd.read_csv(path, dtype=text_cols, **kwargs)
+    return apply_schema(data, frame)
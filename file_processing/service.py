@@ -0,0 +1,475 @@
+from __future__ import annotations
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+import itertools
+import threading
+import socketserver
+from collections import deque
+from logs.log import logger, log_context
+from file_processing.settings import SETTINGS
+
+try:
+    import pythoncom
+except ImportError:
+    pythoncom = None
+
+HOST = "127.0.0.1"  # only operators on this machine, the shared files live here
+WAIT_SECONDS = 30  # longest a single wait request blocks, clients ask again until the job finishes
+JOB_RETENTION_SECONDS = 60 * 60  # how long a finished job can still be looked up
+DEMO_IDLE_SECONDS = 10 * 60  # how long a demo object is kept after its last job, for the next stage to reuse
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+RUN_CHANGED = "run"  # stage name that reruns every stage whose inputs changed, see Pipeline.run
+
+# what stages leave on the service's demo object for the operator, sent back as the job's result
+DEMO_RESULTS = ("flip_to_open",)
+
+# shared resources only one stage may use at a time, whatever demo it is for
+_access_lock = threading.Lock()
+_excel_lock = threading.Lock()
+_archive_lock = threading.Lock()
+STAGE_LOCKS = {
+    "run_through_access": _access_lock,
+    "sfdc_pre_val": _excel_lock,  # pivot tables are built through one Excel instance
+    "udb_pre_val": _excel_lock,
+    "archive_raw": _archive_lock,
+    "archive_sfdc": _archive_lock,
+    "archive_udb": _archive_lock,
+    "archive_counts": _archive_lock,
+}
+
+
+class ServiceError(Exception):
+    """Raised by the client when a request or a job fails in the service."""
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, demo_date: str, demo_type: str, stage: str):
+        """Initialize Job, one pipeline stage to run for one demo.
+
+        :param demo_date: date of the demo, YYYY-MM-DD
+        :type demo_date: str
+        :param demo_type: type of the demo
+        :type demo_type: str
+        :param stage: name of the pipeline stage, or RUN_CHANGED
+        :type stage: str
+        """
+        self.id = next(self._ids)
+        self.demo_date = demo_date
+        self.demo_type = demo_type
+        self.stage = stage
+        self.state = QUEUED
+        self.error = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def demo_key(self) -> tuple:
+        return self.demo_date, self.demo_type
+
+    def to_dict(self) -> dict:
+        return {"job": self.id, "date": self.demo_date, "type": self.demo_type, "stage": self.stage,
+                "state": self.state, "error": self.error, "result": self.result, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished}
+
+
+class JobQueue:
+    def __init__(self, workers: int):
+        """Initialize JobQueue.
+
+        Jobs for the same demo run one at a time in the order they were submitted, jobs for different demos run at
+        the same time on up to workers threads.
+
+        :param workers: number of worker threads
+        :type workers: int
+        """
+        self.workers = max(int(workers), 1)
+        self.jobs = {}
+        self._cond = threading.Condition()
+        self._pending = {}  # demo key: jobs waiting, in order
+        self._ready = deque()  # demo keys whose next job can start
+        self._busy = set()  # demo keys with a running job
+        self._demos = {}  # demo key: Demo, kept so caches on the demo are reused between jobs
+        self._idle = {}  # demo key: time its last queued job finished
+        self._threads = []
+        self._stopped = False
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"service-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the workers once their running jobs finish, queued jobs are left.
+
+        :return: None
+        :rtype: None
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, job: Job) -> Job:
+        """Queue a job behind the other jobs for its demo.
+
+        :param job: job to run
+        :type job: Job
+        :return: the job
+        :rtype: Job
+        """
+        with self._cond:
+            self._idle.pop(job.demo_key, None)
+            self._prune()
+            self.jobs[job.id] = job
+            waiting = self._pending.setdefault(job.demo_key, deque())
+            waiting.append(job)
+            if len(waiting) == 1 and job.demo_key not in self._busy:
+                self._ready.append(job.demo_key)
+                self._cond.notify_all()
+        logger.info("queued job %d: %s for %s %s", job.id, job.stage, job.demo_type, job.demo_date)
+        return job
+
+    def wait(self, job_id: int, timeout: float = None) -> Job:
+        """Wait for a job to finish.
+
+        :param job_id: id of the job
+        :type job_id: int
+        :param timeout: most seconds to wait (default no limit)
+        :type timeout: float
+        :return: the job, finished unless the timeout passed
+        :rtype: Job
+        """
+        with self._cond:
+            job = self.get(job_id)
+            self._cond.wait_for(lambda: job.state in FINISHED, timeout)
+            return job
+
+    def get(self, job_id: int) -> Job:
+        """Find a job that is queued, running, or finished less than JOB_RETENTION_SECONDS ago.
+
+        :param job_id: id of the job
+        :type job_id: int
+        :return: the job
+        :rtype: Job
+        """
+        with self._cond:
+            if job_id not in self.jobs:
+                raise ValueError(f"Job {job_id} is unknown, finished jobs are kept for "
+                                 f"{JOB_RETENTION_SECONDS // 60} minutes.")
+            return self.jobs[job_id]
+
+    def current(self) -> list:
+        """List the jobs that can still be looked up, oldest first.
+
+        :return: jobs
+        :rtype: list
+        """
+        with self._cond:
+            self._prune()
+            return list(self.jobs.values())
+
+    def _prune(self) -> None:
+        # called holding _cond, so neither the job list nor the demo cache grows for as long as the service runs
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.state in FINISHED and now - job.finished > JOB_RETENTION_SECONDS]:
+            del self.jobs[job_id]
+        for key in [key for key, since in self._idle.items() if now - since > DEMO_IDLE_SECONDS]:
+            del self._idle[key]
+            self._demos.pop(key, None)
+
+    def _next(self) -> Job | None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready or self._stopped)
+            if self._stopped:
+                return None
+            key = self._ready.popleft()
+            job = self._pending[key].popleft()
+            self._busy.add(key)
+            job.state = RUNNING
+            job.started = time.time()
+            return job
+
+    def _finish(self, job: Job) -> None:
+        with self._cond:
+            job.finished = time.time()
+            self._busy.discard(job.demo_key)
+            if self._pending[job.demo_key]:
+                self._ready.append(job.demo_key)
+            else:
+                del self._pending[job.demo_key]
+                self._idle[job.demo_key] = job.finished
+            self._prune()
+            self._cond.notify_all()
+
+    def _demo(self, job: Job):
+        import file_processing.demo as demo
+
+        if job.demo_key not in self._demos:
+            date = datetime.datetime.strptime(job.demo_date, "%Y-%m-%d")
+            self._demos[job.demo_key] = demo.Demo(date, demo_type=job.demo_type)
+        return self._demos[job.demo_key]
+
+    def _run(self, job: Job) -> None:
+        import file_processing.pipeline as pipeline
+
+        demo_obj = self._demo(job)
+        if job.stage == RUN_CHANGED:
+            with _access_lock, _excel_lock, _archive_lock:
+                job.result = list(pipeline.PIPELINE.run(demo_obj))
+            return
+        if job.stage not in pipeline.PIPELINE.stages:
+            raise ValueError(f"{job.stage} is not a pipeline stage.")
+
+        lock = STAGE_LOCKS.get(job.stage)
+        if lock is None:
+            pipeline.PIPELINE.run_stage(demo_obj, job.stage)
+        else:
+            with lock:
+                pipeline.PIPELINE.run_stage(demo_obj, job.stage)
+        job.result = {attr: getattr(demo_obj, attr) for attr in DEMO_RESULTS}
+
+    def _work(self) -> None:
+        # COM objects (Excel, Access) need COM initialized on the thread that uses them
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            while True:
+                job = self._next()
+                if job is None:
+                    break
+                try:
+                    with log_context(demo=f"{job.demo_type} ({job.demo_date})"):
+                        self._run(job)
+                    job.state = DONE
+                except Exception as e:
+                    logger.error("Job %d %s failed %s", job.id, job.stage, repr(e))
+                    job.error = str(e)
+                    job.state = FAILED
+                finally:
+                    self._finish(job)
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+
+# --------------------- SERVER --------------------- #
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        # one JSON request per line, answered by one JSON line
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                reply = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Service(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = None, workers: int = None):
+        """Initialize Service, the process that runs the pipeline for every operator on this machine.
+
+        :param port: localhost port to listen on (default from the settings)
+        :type port: int
+        :param workers: number of worker threads (default from the settings)
+        :type workers: int
+        """
+        super().__init__((HOST, port or SETTINGS.service_port), _Handler)
+        self.queue = JobQueue(workers or SETTINGS.service_workers)
+
+    def dispatch(self, request: dict) -> dict:
+        """Answer one request.
+
+        :param request: {"op": ..., ...}
+        :type request: dict
+        :return: reply, {"ok": True, ...} or {"ok": False, "error": ...}
+        :rtype: dict
+        """
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "workers": self.queue.workers}
+        if op == "submit":
+            job = self.queue.submit(Job(request["date"], request["type"], request["stage"]))
+            return {"ok": True, **job.to_dict()}
+        if op == "status":
+            return {"ok": True, **self.queue.get(int(request["job"])).to_dict()}
+        if op == "wait":
+            timeout = min(float(request.get("timeout") or WAIT_SECONDS), WAIT_SECONDS)
+            return {"ok": True, **self.queue.wait(int(request["job"]), timeout).to_dict()}
+        if op == "jobs":
+            return {"ok": True, "jobs": [job.to_dict() for job in self.queue.current()]}
+        raise ValueError(f"{op} is not a valid request.")
+
+    def serve(self) -> None:
+        """Run the workers and answer requests until interrupted.
+
+        :return: None
+        :rtype: None
+        """
+        import file_processing.archive_queue as archive_queue
+
+        self.queue.start()
+        archive_queue.COMMITTER.start()
+        logger.info("Service listening on %s:%d with %d workers", *self.server_address, self.queue.workers)
+        try:
+            self.serve_forever()
+        finally:
+            self.queue.stop()
+            archive_queue.COMMITTER.stop()
+            self.server_close()
+
+
+# --------------------- CLIENT --------------------- #
+class Client:
+    def __init__(self, port: int = None, timeout: float = WAIT_SECONDS + 10):
+        """Initialize Client.
+
+        :param port: localhost port of the service (default from the settings)
+        :type port: int
+        :param timeout: socket timeout in seconds
+        :type timeout: float
+        """
+        self.address = (HOST, port or SETTINGS.service_port)
+        self.timeout = timeout
+
+    def request(self, op: str, **kwargs) -> dict:
+        """Send one request.
+
+        :param op: operation, e.g. "submit"
+        :type op: str
+        :param kwargs: fields of the request
+        :type kwargs: any
+        :return: reply
+        :rtype: dict
+        """
+        try:
+            with socket.create_connection(self.address, timeout=self.timeout) as sock:
+                sock.sendall(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+                reply = sock.makefile('rb').readline()
+        except ConnectionRefusedError:
+            raise ServiceError(f"The service isn't running on port {self.address[1]}, start it with "
+                               f"python main.py --serve") from None
+        reply = json.loads(reply)
+        if not reply.pop("ok"):
+            raise ServiceError(reply["error"])
+        return reply
+
+    def submit(self, demo_date: datetime.datetime, demo_type: str, stage: str) -> int:
+        """Queue a stage for a demo.
+
+        :param demo_date: date of the demo
+        :type demo_date: datetime.datetime
+        :param demo_type: type of the demo
+        :type demo_type: str
+        :param stage: name of the pipeline stage, or RUN_CHANGED
+        :type stage: str
+        :return: job id
+        :rtype: int
+        """
+        return self.request("submit", date=demo_date.strftime("%Y-%m-%d"), type=demo_type, stage=stage)["job"]
+
+    def wait(self, job_id: int) -> dict:
+        """Wait for a job to finish.
+
+        :param job_id: job id
+        :type job_id: int
+        :return: finished job
+        :rtype: dict
+        """
+        while True:
+            job = self.request("wait", job=job_id, timeout=WAIT_SECONDS)
+            if job["state"] in FINISHED:
+                return job
+
+    def run_stage(self, demo_obj, stage: str):
+        """Run a stage for a demo on the service and wait for it, like Pipeline.run_stage.
+
+        :param demo_obj: current demo object
+        :type demo_obj: demo.Demo
+        :param stage: name of the pipeline stage, or RUN_CHANGED
+        :type stage: str
+        :return: result of the job, the names of the stages that ran for RUN_CHANGED, otherwise the DEMO_RESULTS
+            attributes of the service's demo object
+        :rtype: any
+        """
+        job = self.wait(self.submit(demo_obj.demo_date, demo_obj.demo_type, stage))
+        if job["state"] == FAILED:
+            raise ServiceError(job["error"])
+        return job["result"]
+
+
+# --------------------- CLI --------------------- #
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Demo Processor service")
+    parser.add_argument("--port", type=int, help="localhost port (default from the settings)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument("--workers", type=int, help="number of worker threads (default from the settings)")
+    submit = commands.add_parser("submit", help="queue stages for a demo")
+    submit.add_argument("date", help="demo date, MM/DD/YYYY")
+    submit.add_argument("stages", nargs="+", help=f"pipeline stages, or {RUN_CHANGED} for every changed stage")
+    submit.add_argument("--type", help="demo type if more than one demo was on the date")
+    submit.add_argument("--wait", action="store_true", help="wait for the stages to finish")
+    status = commands.add_parser("status", help="show jobs")
+    status.add_argument("job", nargs="?", type=int, help="job id (default every job)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        Service(args.port, args.workers).serve()
+        return 0
+
+    client = Client(args.port)
+    if args.command == "status":
+        jobs = [client.request("status", job=args.job)] if args.job else client.request("jobs")["jobs"]
+        for job in jobs:
+            print(f"{job['job']:>5}  {job['state']:<8} {job['date']} {job['type']:<15} {job['stage']}"
+                  f"{'  ' + job['error'] if job['error'] else ''}")
+        return 0
+
+    demo_date = datetime.datetime.strptime(args.date, "%m/%d/%Y")
+    demo_type = args.type
+    if demo_type is None:
+        import file_processing.demo as demo
+
+        schedule = demo.load_demo_info()
+        scheduled = schedule[schedule["Webinar Date"] == f"{demo_date.month}/{demo_date.day}/{demo_date.year}"]
+        if scheduled.empty:
+            raise SystemExit(f"No demo is scheduled on {args.date}")
+        demo_type = scheduled["Demo Type"].iloc[0]
+    ids = [client.submit(demo_date, demo_type, stage) for stage in args.stages]
+    print("queued jobs", ", ".join(map(str, ids)))
+    if not args.wait:
+        return 0
+    failed = 0
+    for job_id in ids:
+        job = client.wait(job_id)
+        print(f"job {job_id} {job['stage']}: {job['state']}{' ' + job['error'] if job['error'] else ''}")
+        failed += job["state"] == FAILED
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+from __future__ import annotations
+import os
+import json
+import weakref
+import threading
+from logs.log import logger
+import file_processing.file_paths as demo_paths
+
+# settings that may be missing from older settings files, 0 turns the upload caps and archive tiering off
+DEFAULTS = {
+    "Upload Max Rows": 50000,
+    "Upload Max MB": 100,
+    "Upload Delta Mode": "off",
+    "Watch Raw Data": "off",
+    "Service Mode": "off",
+    "Service Port": 8765,
+    "Service Workers": 2,
+    "Archive Hot Months": 12,
+}
+
+
+class Settings:
+    def __init__(self, path: str):
+        """Initialize Settings.
+
+        Reads the settings file on first use and again whenever its modified time changes, so edits made from the
+        settings window or by hand apply without restarting.
+
+        :param path: path to the settings json file
+        :type path: str
+        """
+        self.path = path
+        self._values = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+        self._subscribers = []
+
+    def reload(self, force: bool = False) -> dict:
+        """Read the settings file again if it changed since it was last read.
+
+        :param force: read the file even if its modified time is the same (default False)
+        :type force: bool
+        :return: settings that changed, setting: new value
+        :rtype: dict
+        """
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime and not force:
+                return {}
+
+            with open(self.path, 'r') as file:
+                values = json.load(file)
+
+            values = {**DEFAULTS, **values}
+            first_read = self._mtime is None
+            changed = {key: value for key, value in values.items() if self._values.get(key) != value}
+            self._values = values
+            self._mtime = mtime
+
+        if changed and not first_read:
+            logger.info("Settings changed: %s", ', '.join(changed))
+            self._notify(changed)
+        return changed
+
+    def get(self, key: str):
+        """Retrieve a setting, reading the file again first if it changed.
+
+        :param key: setting name as it appears in the settings file
+        :type key: str
+        :return: setting value
+        :rtype: any
+        """
+        self.reload()
+        try:
+            return self._values[key]
+        except KeyError:
+            raise KeyError(f"{key} is missing from the settings file {self.path}") from None
+
+    def text(self, key: str) -> str:
+        """Retrieve a setting as text without surrounding whitespace.
+
+        :param key: setting name
+        :type key: str
+        :return: setting value
+        :rtype: str
+        """
+        return str(self.get(key)).strip()
+
+    def number(self, key: str) -> float | None:
+        """Retrieve a numeric setting.
+
+        :param key: setting name
+        :type key: str
+        :return: setting value, None if it is blank or 0
+        :rtype: float | None
+        """
+        value = self.text(key)
+        if value == '':
+            return None
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"The setting {key} must be a number, not {value!r}") from None
+        return value or None
+
+    def path_value(self, key: str) -> str:
+        """Retrieve a setting that holds a file or folder path.
+
+        Quotes are removed, Windows' "Copy as path" puts them around the path.
+
+        :param key: setting name
+        :type key: str
+        :return: normalized path
+        :rtype: str
+        """
+        return os.path.normpath(self.text(key).strip('"'))
+
+    def all(self) -> dict:
+        """Retrieve a copy of every setting.
+
+        :return: settings
+        :rtype: dict
+        """
+        self.reload()
+        return dict(self._values)
+
+    def update(self, values: dict) -> dict:
+        """Write new values to the settings file and apply them.
+
+        :param values: setting: new value
+        :type values: dict
+        :return: settings that changed, setting: new value
+        :rtype: dict
+        """
+        with self._lock:
+            settings = self.all()
+            settings.update(values)
+            with open(self.path, 'w') as file:
+                json.dump(settings, file)
+        return self.reload(force=True)
+
+    def subscribe(self, callback) -> None:
+        """Call callback(changed) whenever settings change.
+
+        Bound methods are held weakly so subscribing doesn't keep their object alive.
+
+        :param callback: function taking a dictionary of the settings that changed
+        :type callback: callable
+        :return: None
+        :rtype: None
+        """
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        with self._lock:
+            self._subscribers.append(ref)
+
+    def unsubscribe(self, callback) -> None:
+        """Stop calling a callback added with subscribe.
+
+        :param callback: callback to remove
+        :type callback: callable
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._subscribers = [ref for ref in self._subscribers if ref() not in (None, callback)]
+
+    def _notify(self, changed: dict) -> None:
+        with self._lock:
+            self._subscribers = [ref for ref in self._subscribers if ref() is not None]
+            callbacks = [ref() for ref in self._subscribers]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error("Settings subscriber error %s", repr(e))
+
+    # --------------------- TYPED ACCESSORS --------------------- #
+    @property
+    def access_path(self) -> str:
+        return self.path_value("Access Database Path")
+
+    @property
+    def raw_data_path(self) -> str:
+        return self.path_value("Raw Data Path")
+
+    @property
+    def raw_data_sheet(self) -> str:
+        return self.text("Raw Data Sheet Name")
+
+    @property
+    def access_table(self) -> str:
+        return self.text("Import Access Table Name")
+
+    @property
+    def access_form(self) -> str:
+        return self.text("Access Form Name")
+
+    @property
+    def sf_upload(self) -> str:
+        return self.text("SF Upload File Name")
+
+    @property
+    def sf_exclude(self) -> str:
+        return self.text("SF Exclude File Name")
+
+    @property
+    def udb_upload(self) -> str:
+        return self.text("UDB Upload File Name")
+
+    @property
+    def udb_exclude(self) -> str:
+        return self.text("UDB Exclude File Name")
+
+    @property
+    def demo_dest_path(self) -> str:
+        return self.path_value("Demo Folder Destination Path")
+
+    @property
+    def sop_path(self) -> str:
+        return self.path_value("Demo SOP Path")
+
+    @property
+    def upload_max_rows(self) -> int | None:
+        value = self.number("Upload Max Rows")
+        return None if value is None else int(value)
+
+    @property
+    def upload_max_bytes(self) -> int | None:
+        value = self.number("Upload Max MB")
+        return None if value is None else int(value * 2 ** 20)
+
+    @property
+    def upload_delta_mode(self) -> str:
+        return self.text("Upload Delta Mode").lower()
+
+    @property
+    def watch_raw_data(self) -> bool:
+        return self.text("Watch Raw Data").lower() in ("on", "yes", "true", "1")
+
+    @property
+    def service_mode(self) -> bool:
+        return self.text("Service Mode").lower() in ("on", "yes", "true", "1")
+
+    @property
+    def service_port(self) -> int:
+        return int(self.number("Service Port"))
+
+    @property
+    def service_workers(self) -> int:
+        return int(self.number("Service Workers") or 1)
+
+    @property
+    def archive_hot_months(self) -> int | None:
+        value = self.number("Archive Hot Months")
+        return None if value is None else int(value)
+
+
+SETTINGS = Settings(demo_paths.SETTINGS_PATH)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import os
+import re
+import threading
+
+# [name] is replaced by the value of name, a line with [name?] is left out when name is 0 or blank,
+# brackets around anything else, e.g. [] left to be filled in by hand, are kept as they are
+PLACEHOLDER = re.compile(r"\[([A-Za-z_][A-Za-z0-9_ ]*?)(\?)?\]")
+
+# a line of a template without any [name?] is left out when a value right after a "- " bullet is 0, as before the
+# markers existed
+_BULLET = re.compile(r"-\s$")
+
+DIGEST_SEPARATOR = "\n\n" + "-" * 60 + "\n\n"
+
+
+def _is_zero(value) -> bool:
+    return value is None or str(value).strip() in ('', '0')
+
+
+class Template:
+    def __init__(self, text: str):
+        """Initialize Template, compiling the text once so rendering is a single pass over its pieces.
+
+        :param text: template text
+        :type text: str
+        """
+        self.lines = []
+        legacy = not any(flag for *_, flag in PLACEHOLDER.findall(text))
+        for line in text.splitlines(keepends=True):
+            pieces = PLACEHOLDER.split(line)
+            literals = pieces[0::3]
+            names = pieces[1::3]
+            optional = [flag == '?' or (legacy and _BULLET.search(literal) is not None)
+                        for flag, literal in zip(pieces[2::3], literals)]
+            raw = [match.group(0) for match in PLACEHOLDER.finditer(line)]
+            self.lines.append((literals, names, optional, raw))
+
+    def render_lines(self, values: dict):
+        """Render the template one line at a time.
+
+        :param values: placeholder name: value, names missing from it are left as they are
+        :type values: dict
+        :return: rendered lines
+        :rtype: generator
+        """
+        for literals, names, optional, raw in self.lines:
+            if not names:
+                yield literals[0]
+                continue
+            if any(opt and name in values and _is_zero(values[name]) for name, opt in zip(names, optional)):
+                continue
+
+            parts = [literals[0]]
+            for name, text, literal in zip(names, raw, literals[1:]):
+                parts.append(str(values[name]) if name in values else text)
+                parts.append(literal)
+            yield ''.join(parts)
+
+    def render(self, values: dict) -> str:
+        """Render the template.
+
+        :param values: placeholder name: value
+        :type values: dict
+        :return: rendered text
+        :rtype: str
+        """
+        return ''.join(self.render_lines(values))
+
+    def render_to(self, path: str, values: dict) -> None:
+        """Render the template straight to a file.
+
+        :param path: path to the output file
+        :type path: str
+        :param values: placeholder name: value
+        :type values: dict
+        :return: None
+        :rtype: None
+        """
+        with open(path, 'w') as file:
+            file.writelines(self.render_lines(values))
+
+    def render_many_to(self, path: str, values: list, separator: str = DIGEST_SEPARATOR) -> None:
+        """Render the template once per set of values into one file, e.g. a digest of several demos.
+
+        :param path: path to the output file
+        :type path: str
+        :param values: placeholder name: value per rendering
+        :type values: list
+        :param separator: text written between renderings (default DIGEST_SEPARATOR)
+        :type separator: str
+        :return: None
+        :rtype: None
+        """
+        with open(path, 'w') as file:
+            for i, demo_values in enumerate(values):
+                if i:
+                    file.write(separator)
+                file.writelines(self.render_lines(demo_values))
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load(path: str) -> Template:
+    """Compile a template file, reusing the compiled template until the file changes.
+
+    :param path: path to the template file
+    :type path: str
+    :return: compiled template
+    :rtype: Template
+    """
+    mtime = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with open(path, 'r') as file:
+        compiled = Template(file.read())
+    with _cache_lock:
+        _cache[path] = (mtime, compiled)
+    return compiled
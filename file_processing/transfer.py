@@ -0,0 +1,64 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from file_processing.keys import normalize_email
+from logs.log import logger
+
+REVIEW = "REVIEW "
+
+# (udb column, sfdc column, review) - the cleaned sfdc value replaces the udb value wherever it isn't blank, review
+# columns without an sfdc value are marked for manual review instead
+UDB_FROM_SFDC = [
+    ("FirstName", "FirstName", False),
+    ("LastName", "LastName", False),
+    ("State", "State", False),
+    ("PhoneNumber", "PhoneNumber", False),
+    ("Company", "Company", True),
+    ("CustomerTitle", "CustomerTitle", False),
+    ("PhoneExt", "PhoneExt", False),
+]
+
+
+def transfer(target: pd.DataFrame, source: pd.DataFrame, mappings: list, key: str = "Email") -> list:
+    """Copy the mapped fields of the matching source row into the target, in place.
+
+    Rows are matched on the normalized email with a single reindex of the source, the first source row wins if an
+    email appears more than once. Mappings whose columns are missing from either frame are skipped.
+
+    :param target: data to fill in, e.g. udb
+    :type target: pd.DataFrame
+    :param source: data to take the values from, e.g. sfdc
+    :type source: pd.DataFrame
+    :param mappings: (target column, source column, review) per field
+    :type mappings: list
+    :param key: email column in both frames (default "Email")
+    :type key: str
+    :return: target columns that were transferred
+    :rtype: list
+    """
+    mappings = [mapping for mapping in mappings if mapping[0] in target.columns and mapping[1] in source.columns]
+    if not mappings:
+        return []
+    target_cols = [mapping[0] for mapping in mappings]
+    source_cols = [mapping[1] for mapping in mappings]
+    review = np.array([mapping[2] for mapping in mappings])
+
+    source_keys = normalize_email(source[key])
+    duplicates = source_keys.duplicated() & (source_keys != '')
+    if duplicates.any():
+        logger.info("%d duplicate emails in the source, the first row of each is used", duplicates.sum())
+    unique = ~source_keys.duplicated() & (source_keys != '')
+    lookup = source.loc[unique.to_numpy(), source_cols].set_axis(source_keys[unique].to_numpy(), axis=0)
+    aligned = lookup.reindex(normalize_email(target[key]).to_numpy()).astype(object)
+
+    new = aligned.where(aligned.notna(), '').to_numpy(dtype=object)
+    current = target[target_cols].astype(object).where(target[target_cols].notna(), '').to_numpy(dtype=object)
+    found = new != ''
+
+    values = np.where(found, new, current)
+    if review.any():
+        marked = np.char.add(REVIEW, current[:, review].astype(str)).astype(object)
+        values[:, review] = np.where(found[:, review], values[:, review], marked)
+
+    target[target_cols] = pd.DataFrame(values, index=target.index, columns=target_cols)
+    return target_cols
@@ -1,9 +1,114 @@
 from __future__ import annotations
+import os
+import copy
 import json
 import datetime
+import threading
 from logs.log import logger
 import file_processing.file_paths as demo_paths
 
+# every count a demo has, and its value before the demo is processed
+DEFAULT_COUNTS = {
+    "a_initial_count": 0,
+    "na_initial_count": 0,
+    "a_internal_records": 0,
+    "na_internal_records": 0,
+    "a_null_phone": 0,
+    "na_null_phone": 0,
+    "a_contact_no_lead": 0,
+    "na_contact_no_lead": 0,
+    "a_new": 0,
+    "na_new": 0,
+    "a_lead_update": 0,
+    "na_lead_update": 0,
+    "a_contact_update": 0,
+    "na_contact_update": 0,
+    "flipped_open": 0,
+    "left_dead": 0,
+    "a_converted": 0,
+    "na_converted": 0,
+    "updated_leads": 0,
+    "as_requested": 0,
+    "requested_assign": "",
+    "tmattendee_code": "",
+    "tmattendee_count": 0,
+    "tmnonattendee_code": "",
+    "tmnonattendee_count": 0,
+    "total": 0,
+    "attendee_count": 0,
+    "nonattendee_count": 0,
+    "attendee_code": "",
+    "nonattendee_code": "",
+    "a_mastersupp": 0,
+    "na_mastersupp": 0,
+    "a_activefalse": 0,
+    "na_activefalse": 0,
+    "a_bad_email": 0,
+    "na_bad_email": 0,
+    "a_merged": 0,
+    "na_merged": 0,
+    "contact_no_lead": 0,
+    "null_phone": 0,
+    "converted": 0,
+    "udb_excluded": 0,
+    "udb_uploaded": 0,
+    "sf_excluded": 0,
+    "a_hardbounce": 0,
+    "na_hardbounce": 0,
+    "a_freshaddressbademail": 0,
+    "na_freshaddressbademail": 0,
+    "a_undeliverable": 0,
+    "na_undeliverable": 0,
+    "a_duplicates": 0,
+    "na_duplicates": 0,
+    "sf_duplicates": 0,
+    "sf_phones_recovered": 0,
+    "a_local_bad_email": 0,
+    "na_local_bad_email": 0,
+    "sf_cleaned": {},
+    "udb_cleaned": {},
+}
+
+_store_lock = threading.Lock()
+
+
+def load_counts() -> dict:
+    """Read the counts of every registered demo.
+
+    :return: demo id: counts, empty if the counts file doesn't exist yet
+    :rtype: dict
+    """
+    try:
+        with open(demo_paths.VALIDATION_COUNTS, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def register(demo_ids) -> list:
+    """Add default counts for the demos missing from the counts file, leaving the registered demos as they are.
+
+    The file is replaced in one step, so a failed write can't lose the counts of demos in progress.
+
+    :param demo_ids: ids of the demos, e.g. "Coder (10/5/2022)"
+    :type demo_ids: iterable
+    :return: ids that were added
+    :rtype: list
+    """
+    with _store_lock:
+        counts = load_counts()
+        missing = [idx for idx in dict.fromkeys(demo_ids) if idx not in counts]
+        if not missing:
+            return []
+
+        counts.update({idx: copy.deepcopy(DEFAULT_COUNTS) for idx in missing})
+        temp = f"{demo_paths.VALIDATION_COUNTS}.tmp"
+        with open(temp, 'w') as file:
+            json.dump(counts, file)
+        os.replace(temp, demo_paths.VALIDATION_COUNTS)
+    logger.info("registered %d demos: %s", len(missing), missing)
+    return missing
+
 
 class Validation:
     def __init__(self, demo_type, demo_date):
@@ -14,6 +119,14 @@ class Validation:
         """
         self.idx = f"{demo_type} ({demo_date.strftime('%#m/%#d/%Y')})"
 
+    def registered(self) -> bool:
+        """Check if the demo has counts in the counts file.
+
+        :return: whether the demo is registered
+        :rtype: bool
+        """
+        return self.idx in load_counts()
+
     def update_counts(self, **kwargs) -> None:
         """Update the demo specific variables.
 
@@ -22,15 +135,17 @@ class Validation:
         :return: None
         :rtype: None
         """
-        with open(demo_paths.VALIDATION_COUNTS, 'r+') as file:
+        # demos processed at the same time, e.g. by the service's workers, write to the same file
+        with _store_lock, open(demo_paths.VALIDATION_COUNTS, 'r+') as file:
             counts = json.load(file)
 
             for item, value in kwargs.items():
-                if item in counts[self.idx]:
+                # counts added since the counts file was initialized are filled in on first use
+                if item in counts[self.idx] or item in DEFAULT_COUNTS:
                     counts[self.idx][item] = value
-                    logger.info("count item: %s, count: %s", item, str(value))
                 else:
                     raise ValueError(f"{item} is not a valid metric.")
+            logger.info("counts updated: %s", kwargs)
 
             file.seek(0)
             json.dump(counts, file)
@@ -41,19 +156,21 @@ class Validation:
 
         :param item: variable name
         :type item: str
-        :return: variable value
+        :return: variable value, its default if the demo was registered before the variable existed
         :rtype: int | dict | list
         """
         with open(demo_paths.VALIDATION_COUNTS, 'r') as file:
             counts = json.loads(file.read())
+        if item not in counts[self.idx] and item in DEFAULT_COUNTS:
+            return copy.deepcopy(DEFAULT_COUNTS[item])
         return counts[self.idx][item]
 
     def retrieve_all(self) -> dict:
         """Retrieve all demo specific variables.
 
-        :return: dictionary of all variables
+        :return: dictionary of all variables, with defaults for any added after the demo was registered
         :rtype: dict
         """
         with open(demo_paths.VALIDATION_COUNTS, 'r') as file:
             counts = json.loads(file.read())
-        return counts[self.idx]
+        return {**copy.deepcopy(DEFAULT_COUNTS), **counts[self.idx]}
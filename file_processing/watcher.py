@@ -0,0 +1,291 @@
+from __future__ import annotations
+import os
+import time
+import queue
+import datetime
+import threading
+import pandas as pd
+import file_processing.demo as demo
+import file_processing.helpers as demo_f
+import file_processing.pipeline as pipeline
+from file_processing.settings import SETTINGS
+from logs.log import logger
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+try:
+    import pythoncom
+except ImportError:
+    pythoncom = None
+
+POLL_SECONDS = 5  # how often the raw file is checked without watchdog
+SAFETY_POLL_SECONDS = 60  # how often it is checked anyway with watchdog, in case an event is missed
+STABLE_SECONDS = 10  # how long the size and modified time must stay the same before the file counts as written
+MATCH_DAYS = 3  # how many days after a scheduled demo its raw export may arrive
+
+# stages step one runs
+STAGES = ("initial_counts", "flag_duplicates", "check_emails", "run_through_access")
+
+
+class WatchResult:
+    def __init__(self, path: str, demo_type: str | None, demo_date: datetime.datetime | None, ok: bool,
+                 message: str):
+        """Initialize WatchResult, what the watcher did with one raw file.
+
+        :param path: path of the raw file
+        :type path: str
+        :param demo_type: type of the matched demo, None if no demo matched
+        :type demo_type: str | None
+        :param demo_date: date of the matched demo, None if no demo matched
+        :type demo_date: datetime.datetime | None
+        :param ok: whether step one finished
+        :type ok: bool
+        :param message: what happened, for the operator
+        :type message: str
+        """
+        self.path = path
+        self.demo_type = demo_type
+        self.demo_date = demo_date
+        self.ok = ok
+        self.message = message
+
+    def __repr__(self):
+        return f"WatchResult({os.path.basename(self.path)!r}, {self.demo_type!r}, ok={self.ok})"
+
+
+def match_demo(when: datetime.datetime) -> tuple:
+    """Find the scheduled demo a raw export made at a given time belongs to.
+
+    The latest demo on or up to MATCH_DAYS days before the export is used.
+
+    :param when: when the raw file was last modified
+    :type when: datetime.datetime
+    :return: (demo date, demo types scheduled on it), (None, []) if no demo matches
+    :rtype: tuple
+    """
+    schedule = demo.load_demo_info()
+    dates = pd.to_datetime(schedule["Webinar Date"], format="%m/%d/%Y", errors='coerce')
+    day = pd.Timestamp(when.date())
+    recent = schedule[(dates <= day) & (dates >= day - pd.Timedelta(days=MATCH_DAYS))]
+    if recent.empty:
+        return None, []
+    recent_dates = dates[recent.index]
+    latest = recent_dates.max()
+    types = list(recent.loc[recent_dates == latest, "Demo Type"].dropna().unique())
+    return latest.to_pydatetime(), types
+
+
+class _Wake(FileSystemEventHandler):
+    def __init__(self, event: threading.Event):
+        super().__init__()
+        self.event = event
+
+    def on_any_event(self, event):
+        self.event.set()
+
+
+class RawDataWatcher:
+    def __init__(self, on_result=None, can_run=None, poll_seconds: float = None,
+                 stable_seconds: float = STABLE_SECONDS):
+        """Initialize RawDataWatcher.
+
+        Watches the raw data file from the settings and runs step one for its demo once a new export is fully
+        written. Uses watchdog (inotify on Linux) to notice the file straight away when it's installed, and polls the
+        file otherwise.
+
+        :param on_result: called with each WatchResult from the watcher thread, results are also put on self.results
+        :type on_result: callable
+        :param can_run: returns whether step one may run now, e.g. no other step is running (default always)
+        :type can_run: callable
+        :param poll_seconds: seconds between checks (default SAFETY_POLL_SECONDS with watchdog, else POLL_SECONDS)
+        :type poll_seconds: float
+        :param stable_seconds: seconds the file must stay unchanged (default STABLE_SECONDS)
+        :type stable_seconds: float
+        """
+        self.on_result = on_result
+        self.can_run = can_run
+        self.poll_seconds = poll_seconds or (SAFETY_POLL_SECONDS if Observer is not None else POLL_SECONDS)
+        self.stable_seconds = stable_seconds
+        self.results = queue.Queue()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._processing = threading.Event()
+        self._thread = None
+        self._observer = None
+        self._seen = None  # (signature, first time seen) of the file waiting to settle
+        self._done = None  # signature of the last file handled
+
+    @property
+    def processing(self) -> bool:
+        return self._processing.is_set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start watching on a background thread.
+
+        :return: None
+        :rtype: None
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        folder = os.path.dirname(SETTINGS.raw_data_path)
+        if Observer is not None and os.path.isdir(folder):
+            self._observer = Observer()
+            self._observer.schedule(_Wake(self._wake), folder, recursive=False)
+            self._observer.start()
+        # check straight away for a file that arrived while nothing was watching
+        self._wake.set()
+        self._thread = threading.Thread(target=self._loop, name="raw-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Watching %s (%s)", SETTINGS.raw_data_path, "watchdog" if self._observer else "polling")
+
+    def stop(self, wait: bool = True) -> None:
+        """Stop watching, a step one that is running finishes first.
+
+        :param wait: wait for the watcher thread to finish (default True)
+        :type wait: bool
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._thread = None
+
+    def _loop(self) -> None:
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            while not self._stop.is_set():
+                # while a file is settling, check again once it could have
+                timeout = self.poll_seconds if self._seen is None else min(self.poll_seconds, self.stable_seconds)
+                self._wake.wait(timeout)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error("Watcher error %s", repr(e))
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    # --------------------- CHECK --------------------- #
+    def ready(self, path: str, now: float = None) -> bool:
+        """Check if the raw file is new and finished being written.
+
+        The file is ready once its size and modified time haven't changed for stable_seconds, Excel isn't holding it
+        open and it can be opened for reading.
+
+        :param path: path to the raw file
+        :type path: str
+        :param now: current time.monotonic() (default now)
+        :type now: float
+        :return: whether the file is ready
+        :rtype: bool
+        """
+        now = time.monotonic() if now is None else now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._seen = None
+            return False
+
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self._done:
+            return False
+        if self._seen is None or self._seen[0] != signature:
+            self._seen = (signature, now)
+            return False
+        if now - self._seen[1] < self.stable_seconds:
+            return False
+
+        lock_file = os.path.join(os.path.dirname(path), "~$" + os.path.basename(path))
+        if stat.st_size == 0 or os.path.exists(lock_file):
+            return False
+        try:
+            with open(path, 'rb'):
+                pass
+        except OSError:
+            return False
+        return True
+
+    def check(self) -> WatchResult | None:
+        """Check the raw file once and process it if it's ready.
+
+        :return: result if the file was handled, None otherwise
+        :rtype: WatchResult | None
+        """
+        path = SETTINGS.raw_data_path
+        if not self.ready(path):
+            return None
+        if self.can_run is not None and not self.can_run():
+            logger.debug("Raw data is ready, waiting for the running step to finish")
+            return None
+
+        # a file saved again while this one is processed has a new signature and is handled next
+        self._done = self._seen[0]
+        self._seen = None
+        result = self.process(path)
+        if result is not None:
+            self.results.put(result)
+            if self.on_result is not None:
+                self.on_result(result)
+        return result
+
+    def process(self, path: str) -> WatchResult | None:
+        """Run step one for the demo the raw file belongs to.
+
+        :param path: path to the raw file
+        :type path: str
+        :return: result, None if step one already ran on this file
+        :rtype: WatchResult | None
+        """
+        modified = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        demo_date, types = match_demo(modified)
+        if demo_date is None:
+            return WatchResult(path, None, None, False,
+                               f"No demo is scheduled in the {MATCH_DAYS} days before {modified:%m/%d/%Y}, process "
+                               f"the raw data by hand.")
+        if len(types) > 1:
+            return WatchResult(path, None, demo_date, False,
+                               f"More than one demo was on {demo_date:%m/%d/%Y} ({', '.join(types)}), pick the demo "
+                               f"and process the raw data by hand.")
+
+        self._processing.set()
+        try:
+            demo_obj = demo.Demo(demo_date, demo_type=types[0])
+            if not pipeline.PIPELINE.stale(demo_obj, STAGES[0]):
+                logger.info("Step one already ran on this raw data for %s", demo_obj.destination_folder)
+                return None
+
+            logger.info("New raw data for %s, running step one", demo_obj.destination_folder)
+            try:
+                demo_f.create_destination(demo_obj.destination_path)
+                for stage in STAGES:
+                    pipeline.PIPELINE.run_stage(demo_obj, stage)
+            except Exception as e:
+                logger.error("Watcher step one error %s", repr(e))
+                return WatchResult(path, demo_obj.demo_type, demo_date, False,
+                                   f"Step one failed for the {demo_obj.demo_type} demo on {demo_date:%m/%d/%Y}: {e}")
+        finally:
+            self._processing.clear()
+
+        return WatchResult(path, demo_obj.demo_type, demo_date, True,
+                           f"The raw data for the {demo_obj.demo_type} demo on {demo_date:%m/%d/%Y} was processed "
+                           f"through Access, review the SFDC file and continue with step two.")
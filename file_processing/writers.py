@@ -0,0 +1,333 @@
+from __future__ import annotations
+import os
+import glob
+import json
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from logs.log import logger
+from logs import metrics
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+CSV = "csv"
+XLSX = "xlsx"
+MAX_WORKERS = 4
+
+
+class WriteJob:
+    def __init__(self, data: pd.DataFrame, target: str, fmt: str = None, sheet: str = None, append: bool = False,
+                 checksum: bool = False):
+        """Initialize WriteJob, one frame to write to one file or sheet.
+
+        :param data: data to write
+        :type data: pd.DataFrame
+        :param target: path of the file
+        :type target: str
+        :param fmt: CSV or XLSX (default from the file extension)
+        :type fmt: str
+        :param sheet: sheet name for XLSX jobs
+        :type sheet: str
+        :param append: add the sheet to an existing workbook, replacing a sheet with the same name (default False)
+        :type append: bool
+        :param checksum: find the sha256 of the file once it's written (default False)
+        :type checksum: bool
+        """
+        self.data = data
+        self.target = target
+        self.fmt = fmt or os.path.splitext(target)[1].lstrip('.').lower()
+        self.sheet = sheet
+        self.append = append
+        self.checksum = checksum
+        if self.fmt not in (CSV, XLSX):
+            raise ValueError(f"{self.fmt} is not a valid output format.")
+        if self.fmt == XLSX and sheet is None:
+            raise ValueError(f"A sheet name is needed to write {target}")
+
+
+class WriteResult:
+    def __init__(self, target: str, fmt: str, engine: str, rows: int, size: int, seconds: float, sha256: str = None):
+        """Initialize WriteResult, what was written to one file.
+
+        :param target: path of the file
+        :type target: str
+        :param fmt: CSV or XLSX
+        :type fmt: str
+        :param engine: library that wrote the file
+        :type engine: str
+        :param rows: data rows written
+        :type rows: int
+        :param size: size of the file in bytes
+        :type size: int
+        :param seconds: time taken to write the file
+        :type seconds: float
+        :param sha256: hex digest of the file, if it was asked for (default None)
+        :type sha256: str
+        """
+        self.target = target
+        self.fmt = fmt
+        self.engine = engine
+        self.rows = rows
+        self.size = size
+        self.seconds = seconds
+        self.sha256 = sha256
+
+    def __repr__(self):
+        return (f"WriteResult({os.path.basename(self.target)!r}, rows={self.rows}, bytes={self.size}, "
+                f"seconds={self.seconds:.3f}, engine={self.engine!r})")
+
+
+# --------------------- ENGINES --------------------- #
+def xlsx_engine(append: bool) -> str:
+    """Pick the Excel writer, xlsxwriter only writes new workbooks but is much faster than openpyxl.
+
+    :param append: whether the workbook already exists
+    :type append: bool
+    :return: pandas ExcelWriter engine
+    :rtype: str
+    """
+    return "xlsxwriter" if xlsxwriter is not None and not append else "openpyxl"
+
+
+def _write_csv(job: WriteJob) -> str:
+    job.data.to_csv(job.target, index=False)
+    return "pandas"
+
+
+def _write_xlsx(jobs: list) -> str:
+    # every job here has the same workbook, openpyxl can't have one file open by two writers
+    append = jobs[0].append and os.path.exists(jobs[0].target)
+    engine = xlsx_engine(append)
+    kwargs = {'mode': 'a', 'if_sheet_exists': 'replace'} if append else {'mode': 'w'}
+    with pd.ExcelWriter(jobs[0].target, engine=engine, **kwargs) as writer:
+        for job in jobs:
+            job.data.to_excel(writer, sheet_name=job.sheet, index=False)
+    return engine
+
+
+def file_sha256(path: str) -> str:
+    """Hash a written file so it can be checked against what the loader received.
+
+    :param path: path to the file
+    :type path: str
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _run(jobs: list) -> WriteResult:
+    start = time.perf_counter()
+    if jobs[0].fmt == CSV:
+        engine = _write_csv(jobs[0])
+    else:
+        engine = _write_xlsx(jobs)
+    sha256 = file_sha256(jobs[0].target) if any(job.checksum for job in jobs) else None
+    result = WriteResult(jobs[0].target, jobs[0].fmt, engine, sum(len(job.data) for job in jobs),
+                         os.path.getsize(jobs[0].target), time.perf_counter() - start, sha256)
+    logger.info("wrote %s: %d rows, %d bytes in %.2fs (%s)", os.path.basename(result.target), result.rows,
+                result.size, result.seconds, result.engine)
+    return result
+
+
+# --------------------- WRITE --------------------- #
+def write_all(jobs: list, max_workers: int = MAX_WORKERS) -> list:
+    """Write the jobs concurrently on a thread pool.
+
+    Sheets for the same workbook are written together by one thread, in the order given. Every file is attempted
+    before the first error is raised.
+
+    :param jobs: WriteJob per frame
+    :type jobs: list
+    :param max_workers: most files written at the same time (default MAX_WORKERS)
+    :type max_workers: int
+    :return: WriteResult per file, in the order the files first appear in jobs
+    :rtype: list
+    """
+    files = {}
+    for job in jobs:
+        files.setdefault(os.path.abspath(job.target), []).append(job)
+    for target, file_jobs in files.items():
+        if len(file_jobs) > 1 and any(job.fmt == CSV for job in file_jobs):
+            raise ValueError(f"More than one job writes the CSV {target}")
+
+    if not files:
+        return []
+    if len(files) == 1:
+        return [_run(next(iter(files.values())))]
+
+    spent = []
+
+    def run_counted(file_jobs: list) -> WriteResult:
+        cpu = time.thread_time()
+        try:
+            return _run(file_jobs)
+        finally:
+            spent.append(time.thread_time() - cpu)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files)), thread_name_prefix="writer") as pool:
+        # copy the context so the log records of the pool threads keep the demo and stage of the caller
+        futures = [pool.submit(contextvars.copy_context().run, run_counted, file_jobs) for file_jobs in files.values()]
+    # the caller's stage only measures its own thread
+    metrics.add_cpu(sum(spent))
+
+    results = []
+    errors = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
+
+
+# --------------------- CSV PARTS --------------------- #
+def _text_bytes(values: pd.Series) -> np.ndarray:
+    # bytes the csv writer uses for each value, quoted values gain 2 quotes plus an escape for every quote inside
+    text = values.astype(object).where(values.notna(), '').astype(str)
+    size = text.str.encode('utf-8').str.len().to_numpy()
+    quoted = text.str.contains('[",\r\n]', regex=True).to_numpy()
+    return size + quoted * (2 + text.str.count('"').to_numpy())
+
+
+def row_bytes(data: pd.DataFrame) -> np.ndarray:
+    """Estimate the size of each row once written as CSV.
+
+    :param data: data to write
+    :type data: pd.DataFrame
+    :return: bytes per row, including separators and the line terminator
+    :rtype: np.ndarray
+    """
+    sizes = np.full(len(data), max(len(data.columns) - 1, 0) + len(os.linesep), dtype=np.int64)
+    for col in data.columns:
+        sizes += _text_bytes(data[col])
+    return sizes
+
+
+def part_bounds(data: pd.DataFrame, max_rows: int = None, max_bytes: int = None) -> list:
+    """Find the row ranges of the parts a frame is split into.
+
+    Every part holds at least one row, so a single row larger than max_bytes gets a part of its own.
+
+    :param data: data to split
+    :type data: pd.DataFrame
+    :param max_rows: most data rows per part (default no limit)
+    :type max_rows: int
+    :param max_bytes: most bytes per part, header included (default no limit)
+    :type max_bytes: int
+    :return: (start, stop) row positions per part
+    :rtype: list
+    """
+    rows = len(data)
+    if max_bytes:
+        header = int(_text_bytes(pd.Series(data.columns)).sum()) + max(len(data.columns) - 1, 0) + len(os.linesep)
+        ends = np.concatenate([[0], np.cumsum(row_bytes(data))])
+
+    bounds = []
+    start = 0
+    while start < rows:
+        stop = rows if not max_rows else min(rows, start + max_rows)
+        if max_bytes:
+            # last row whose end still fits under the cap
+            fits = int(np.searchsorted(ends, ends[start] + max_bytes - header, side='right')) - 1
+            stop = min(stop, max(fits, start + 1))
+        bounds.append((start, stop))
+        start = stop
+    return bounds or [(0, 0)]
+
+
+def part_path(target: str, part: int, parts: int) -> str:
+    """Path of one numbered part, a frame that fits in one part keeps the target's name.
+
+    :param target: path the whole frame would be written to
+    :type target: str
+    :param part: part number, from 1
+    :type part: int
+    :param parts: number of parts
+    :type parts: int
+    :return: path of the part
+    :rtype: str
+    """
+    if parts == 1:
+        return target
+    root, ext = os.path.splitext(target)
+    return f"{root}-part{part:0{max(len(str(parts)), 2)}d}{ext}"
+
+
+def csv_part_jobs(data: pd.DataFrame, target: str, max_rows: int = None, max_bytes: int = None) -> list:
+    """Split a frame into numbered CSV parts under the row and byte caps.
+
+    Parts left by an earlier run of the same target are removed so they can't be uploaded twice.
+
+    :param data: data to write
+    :type data: pd.DataFrame
+    :param target: path the whole frame would be written to
+    :type target: str
+    :param max_rows: most data rows per part (default no limit)
+    :type max_rows: int
+    :param max_bytes: most bytes per part (default no limit)
+    :type max_bytes: int
+    :return: WriteJob per part
+    :rtype: list
+    """
+    root, ext = os.path.splitext(target)
+    for old in [target] + glob.glob(f"{glob.escape(root)}-part*{glob.escape(ext)}"):
+        if os.path.exists(old):
+            os.remove(old)
+
+    bounds = part_bounds(data, max_rows, max_bytes)
+    return [WriteJob(data.iloc[start:stop], part_path(target, part, len(bounds)), fmt=CSV, checksum=True)
+            for part, (start, stop) in enumerate(bounds, start=1)]
+
+
+def write_manifest(path: str, parts: dict, results: list, max_rows: int = None, max_bytes: int = None) -> dict:
+    """Record the rows, size and checksum of every part for validation against what the loader reports.
+
+    Nothing that changes from run to run, such as the time, is recorded, so the same parts give the same manifest and
+    the pipeline doesn't rerun the stages after it for nothing.
+
+    :param path: path to the manifest json file
+    :type path: str
+    :param parts: target: WriteJob per part, as made by csv_part_jobs
+    :type parts: dict
+    :param results: WriteResult per file from write_all
+    :type results: list
+    :param max_rows: row cap used to split the files
+    :type max_rows: int
+    :param max_bytes: byte cap used to split the files
+    :type max_bytes: int
+    :return: manifest
+    :rtype: dict
+    """
+    written = {os.path.abspath(result.target): result for result in results}
+    manifest = {
+        "max_rows": max_rows,
+        "max_bytes": max_bytes,
+        "files": {},
+    }
+    for target, jobs in parts.items():
+        entries = []
+        for job in jobs:
+            result = written[os.path.abspath(job.target)]
+            entries.append({"file": os.path.basename(result.target), "rows": result.rows, "bytes": result.size,
+                            "sha256": result.sha256})
+            if max_bytes and result.size > max_bytes and result.rows > 1:
+                logger.warning("%s is %d bytes, over the %d byte cap", entries[-1]["file"], result.size, max_bytes)
+        manifest["files"][os.path.basename(target)] = {"rows": sum(entry["rows"] for entry in entries),
+                                                       "parts": entries}
+
+    with open(path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
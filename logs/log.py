@@ -1,18 +1,81 @@
 import os
 import sys
+import queue
+import atexit
 import logging
+import contextlib
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-log_format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s", datefmt='%m/%d/%Y')
+MAX_BYTES = 5 * 2 ** 20
+BACKUP_COUNT = 5
+
+# structured fields added to every record, set with log_context
+demo_var = contextvars.ContextVar("demo", default="-")
+stage_var = contextvars.ContextVar("stage", default="-")
+
+log_format = logging.Formatter("%(asctime)s - %(levelname)s - [%(demo)s] [%(stage)s] - %(message)s",
+                               datefmt='%m/%d/%Y %H:%M:%S')
 logger = logging.getLogger()
 
 log_file = os.path.join(os.path.dirname(__file__), 'log.txt')
 
-file_handler = logging.FileHandler(log_file)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Add the demo and stage of the calling thread to the record."""
+        record.demo = demo_var.get()
+        record.stage = stage_var.get()
+        return True
+
+
+@contextlib.contextmanager
+def log_context(demo: str = None, stage: str = None):
+    """Tag every record logged inside the block with the demo and/or stage.
+
+    :param demo: demo id, e.g. "SelectCoder (10/5/2022)"
+    :type demo: str
+    :param stage: pipeline stage name
+    :type stage: str
+    """
+    tokens = []
+    if demo is not None:
+        tokens.append((demo_var, demo_var.set(demo)))
+    if stage is not None:
+        tokens.append((stage_var, stage_var.set(stage)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def queued(*handlers: logging.Handler) -> QueueHandler:
+    """Move handlers behind a queue written by a background thread.
+
+    The returned handler only puts records on the queue, so logging never waits on file or console I/O.
+
+    :param handlers: handlers the background thread writes to
+    :type handlers: logging.Handler
+    :return: handler to attach to a logger
+    :rtype: QueueHandler
+    """
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    handler = QueueHandler(records)
+    handler.addFilter(ContextFilter())
+    return handler
+
+
+file_handler = RotatingFileHandler(log_file, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
 file_handler.setFormatter(log_format)
-logger.addHandler(file_handler)
 
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(log_format)
-logger.addHandler(console_handler)
+
+logger.addHandler(queued(file_handler, console_handler))
 
 logger.setLevel(logging.INFO)
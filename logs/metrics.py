@@ -0,0 +1,228 @@
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import threading
+import functools
+from logging.handlers import RotatingFileHandler
+from logs.log import logger, queued, stage_var, MAX_BYTES, BACKUP_COUNT
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+metrics_file = os.path.join(os.path.dirname(__file__), 'metrics.jsonl')
+
+metrics_logger = logging.getLogger("metrics")
+metrics_logger.propagate = False
+metrics_handler = RotatingFileHandler(metrics_file, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+metrics_logger.addHandler(queued(metrics_handler))
+metrics_logger.setLevel(logging.INFO)
+
+_local = threading.local()
+_records = []
+_records_lock = threading.Lock()
+_listeners = []
+
+
+def peak_rss() -> int | None:
+    """Find the highest resident memory of the process so far, over its whole lifetime rather than one stage.
+
+    :return: peak memory in bytes, None if it can't be measured
+    :rtype: int | None
+    """
+    if psutil is not None:
+        # peak_wset is the Windows peak working set, other platforms' memory_info only has the current rss
+        peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        if peak is not None:
+            return peak
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+def rss() -> int | None:
+    """Find the resident memory of the process now.
+
+    :return: memory in bytes, None if it can't be measured
+    :rtype: int | None
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+
+def count_rows(rows_in: int = 0, rows_out: int = 0) -> None:
+    """Add to the row counts of the stage that is running.
+
+    :param rows_in: rows read by the stage
+    :type rows_in: int
+    :param rows_out: rows written by the stage
+    :type rows_out: int
+    :return: None
+    :rtype: None
+    """
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    stack[-1]["rows_in"] += int(rows_in)
+    stack[-1]["rows_out"] += int(rows_out)
+
+
+def add_cpu(seconds: float) -> None:
+    """Add cpu time spent on other threads for the stage running on this thread, e.g. by a thread pool it waited on.
+
+    cpu_s only counts the stage's own thread, so work handed to other threads has to be added back.
+
+    :param seconds: cpu seconds
+    :type seconds: float
+    :return: None
+    :rtype: None
+    """
+    # every stage on the stack, the stages that called this one include its time too
+    for record in getattr(_local, 'stack', ()):
+        record["pool_cpu_s"] += seconds
+
+
+def add_listener(listener) -> None:
+    """Call listener(event, record) whenever a stage starts or ends.
+
+    Listeners run on the thread running the stage; an exception raised on "start" stops the stage from running.
+
+    :param listener: function taking the event ("start" or "end") and the stage record
+    :type listener: callable
+    :return: None
+    :rtype: None
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener) -> None:
+    """Stop calling a listener added with add_listener.
+
+    :param listener: listener to remove
+    :type listener: callable
+    :return: None
+    :rtype: None
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _notify(event: str, record: dict) -> None:
+    for listener in list(_listeners):
+        listener(event, record)
+
+
+def timed(func=None, *, stage: str = None):
+    """Record wall time, cpu time, memory and row counts every time func runs.
+
+    cpu_s is the time of the calling thread plus what was added with add_cpu, so stages running at the same time on
+    other threads aren't counted. rss_delta_mb is the change in the process's resident memory from the start to the
+    end of the stage (stages running at the same time share it) and process_peak_mb the highest resident memory of
+    the process so far, not of the stage.
+
+    :param func: function to wrap
+    :type func: callable
+    :param stage: name to record the function under (default the function's qualified name)
+    :type stage: str
+    :return: wrapped function
+    :rtype: callable
+    """
+    if func is None:
+        return functools.partial(timed, stage=stage)
+
+    name = stage or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        record = {"stage": name, "depth": len(_local.stack), "rows_in": 0, "rows_out": 0, "pool_cpu_s": 0.0}
+        _notify("start", record)
+        _local.stack.append(record)
+        token = stage_var.set(name)
+        status = "ok"
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        start_rss = rss()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            stage_var.reset(token)
+            _local.stack.pop()
+            end_rss = rss()
+            delta = None if start_rss is None or end_rss is None else end_rss - start_rss
+            peak = peak_rss()
+            record.update(time=datetime.datetime.now().isoformat(timespec='seconds'),
+                          status=status,
+                          wall_s=round(time.perf_counter() - wall, 4),
+                          cpu_s=round(time.thread_time() - cpu + record.pop("pool_cpu_s"), 4),
+                          rss_delta_mb=None if delta is None else round(delta / 2 ** 20, 1),
+                          process_peak_mb=None if peak is None else round(peak / 2 ** 20, 1),
+                          thread=threading.current_thread().name)
+            with _records_lock:
+                _records.append(record)
+            metrics_logger.info(json.dumps(record))
+            _notify("end", record)
+
+    return wrapper
+
+
+def summary(reset: bool = True) -> str:
+    """Build a table of the stages recorded during this run.
+
+    :param reset: clear the recorded stages afterwards (default True)
+    :type reset: bool
+    :return: summary table
+    :rtype: str
+    """
+    with _records_lock:
+        records = list(_records)
+        if reset:
+            _records.clear()
+
+    header = (f"{'stage':<32}{'status':>7}{'wall s':>10}{'cpu s':>10}{'rss +MB':>10}{'proc peak MB':>14}"
+              f"{'rows in':>10}{'rows out':>10}")
+    lines = [header, '-' * len(header)]
+    for record in records:
+        delta = '' if record["rss_delta_mb"] is None else record["rss_delta_mb"]
+        peak = '' if record["process_peak_mb"] is None else record["process_peak_mb"]
+        stage = '  ' * record["depth"] + record["stage"]
+        lines.append(f"{stage:<32}{record['status']:>7}{record['wall_s']:>10}{record['cpu_s']:>10}"
+                     f"{delta:>10}{peak:>14}{record['rows_in']:>10}{record['rows_out']:>10}")
+    # nested stages are already included in the stage that called them
+    top = [record for record in records if record["depth"] == 0]
+    lines.append(f"{'total':<32}{'':>7}{round(sum(r['wall_s'] for r in top), 4):>10}"
+                 f"{round(sum(r['cpu_s'] for r in top), 4):>10}")
+    return '\n'.join(lines)
+
+
+def log_summary() -> None:
+    """Log the summary table of the run if any stage was recorded.
+
+    :return: None
+    :rtype: None
+    """
+    with _records_lock:
+        if not _records:
+            return
+    logger.info("Run summary:\n%s", summary())
@@ -1,11 +1,57 @@
+import os
+import sys
+import argparse
+import subprocess
 import tkinter as tk
-import ui.ui as ui
+
+# cold start budget for importing the ui, checked by --import-time
+IMPORT_BUDGET_MS = 400
+
+
+def import_time_report(budget_ms: int = IMPORT_BUDGET_MS, top: int = 15) -> int:
+    """Print the slowest imports of a cold start and check the total against the budget.
+
+    Runs ``python -X importtime`` in a fresh interpreter so nothing is already imported.
+
+    :param budget_ms: most milliseconds the ui may take to import (default IMPORT_BUDGET_MS)
+    :type budget_ms: int
+    :param top: number of modules to list (default 15)
+    :type top: int
+    :return: exit code, 1 if the budget was exceeded
+    :rtype: int
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import ui.ui"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        return result.returncode
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(self_us), int(cumulative_us), name.rstrip()))
+
+    # modules that aren't indented were imported directly by the interpreter, their cumulative times add up to the total
+    total_ms = sum(cumulative for _, cumulative, name in imports if not name.startswith("  ")) / 1000
+
+    print(f"{'self ms':>10}{'cumulative ms':>15}  module")
+    for self_us, cumulative_us, name in sorted(imports, reverse=True)[:top]:
+        print(f"{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}  {name.strip()}")
+    print(f"\nimport ui.ui took {total_ms:.1f} ms, budget {budget_ms} ms")
+
+    return 0 if total_ms <= budget_ms else 1
 
 
 def main():
+    import ui.ui as ui
+    from logs import metrics
+
     root = tk.Tk()
     root.title("Demo Processor")
-    root.geometry("410x345")
+    root.geometry("410x470")
     root.config(pady=10, padx=20)
 
     menubar = ui.DemoMenu(root)
@@ -14,7 +60,22 @@ def main():
     frame = ui.DemoFrame(root)
     frame.pack()
     root.mainloop()
+    # let an archive rewrite that is running finish, anything still queued is written next time
+    import file_processing.archive_queue as archive_queue
+    archive_queue.COMMITTER.stop()
+    metrics.log_summary()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Demo Processor")
+    parser.add_argument("--import-time", action="store_true", help="report the slowest imports at startup and exit")
+    parser.add_argument("--budget", type=int, default=IMPORT_BUDGET_MS, help="import time budget in milliseconds")
+    parser.add_argument("--serve", action="store_true", help="run the shared job service instead of the ui")
+    args = parser.parse_args()
+
+    if args.import_time:
+        sys.exit(import_time_report(args.budget))
+    if args.serve:
+        from file_processing import service
+        sys.exit(service.main(["serve"]))
     main()
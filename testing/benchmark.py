@@ -0,0 +1,407 @@
+"""Benchmark the file_processing helpers and archive on synthetic demo files.
+
+Usage (from the repository root):
+    python -m testing.benchmark --scales 1000 10000 100000
+    python -m testing.benchmark --compare          # compare the last two runs
+    python -m testing.benchmark --compare RUN_A RUN_B
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'bench_results.jsonl')
+SCALES = [1_000, 10_000, 100_000, 1_000_000]
+DEMO_TYPE = "Bench"
+DEMO_DATE = datetime.datetime(2022, 10, 5)
+SF_CODES = ("TMAC1", "TMBC1")
+UDB_CODES = ("UAC1", "UBC1")
+SF_UPLOAD = "SFDC_Upload"
+SF_EXCLUDE = "SFDC_Exclude"
+UDB_UPLOAD = "UDB_Upload"
+UDB_EXCLUDE = "UDB_Exclude"
+RAW_SHEET = "Sheet1"
+
+STATES = np.array(["NY", "CA", "TX", "FL", "IL", "PA", "OH", "GA", "NC", "MI"])
+DOMAINS = np.array(["hospital.org", "clinic.com", "health.net", "gmail.com", "yahoo.com", "medcenter.org"])
+OWNERS = np.array(["Ann Lee", "Bob Ray", "Cal Diaz", "Dee Park"])
+STATUSES = np.array(["Open", "Working", "Nurture", "Dead"])
+TITLES = np.array(["Coder", "Coding Manager", "HIM Director", "CDI Specialist / Coder", "Billing  Lead"])
+NOTES = np.array(["Cold Lead", "Warm Lead", "Demo Attendee", ""])
+
+
+# --------------------- SYNTHETIC DATA --------------------- #
+class BenchCounts:
+    def __init__(self):
+        """Initialize BenchCounts, an in-memory stand-in for validation.Validation."""
+        self.counts = {}
+
+    def update_counts(self, **kwargs) -> None:
+        self.counts.update(kwargs)
+
+    def retrieve_one(self, item: str):
+        return self.counts.get(item, 0)
+
+    def retrieve_all(self) -> dict:
+        return dict(self.counts)
+
+
+class BenchDemo:
+    def __init__(self, folder: str):
+        """Initialize BenchDemo, a stand-in for demo.Demo pointing at the synthetic files.
+
+        :param folder: folder holding the synthetic files
+        :type folder: str
+        """
+        stamp = DEMO_DATE.strftime('%m%d%y')
+        self.demo_date = DEMO_DATE
+        self.demo_type = DEMO_TYPE
+        self.sf_attend, self.sf_non_attend = SF_CODES
+        self.udb_attend, self.udb_non_attend = UDB_CODES
+        self.pub = "PUB1"
+        self.sf_upload = SF_UPLOAD
+        self.sf_exclude = SF_EXCLUDE
+        self.udb_upload = UDB_UPLOAD
+        self.udb_exclude = UDB_EXCLUDE
+        self.destination_folder = os.path.basename(folder)
+        self.destination_path = folder
+        self.sf_path = os.path.join(folder, f"{DEMO_TYPE}-{stamp}-{SF_UPLOAD}.xlsx")
+        self.sf_exclude_path = os.path.join(folder, f"{DEMO_TYPE}-{stamp}-{SF_EXCLUDE}.xlsx")
+        self.udb_path = os.path.join(folder, f"{DEMO_TYPE}-{stamp}-{UDB_UPLOAD}.xlsx")
+        self.exclude_path = os.path.join(folder, f"{DEMO_TYPE}-{stamp}-{UDB_EXCLUDE}.xlsx")
+        self.raw_path = os.path.join(folder, "raw_registrations.xlsx")
+        self.validation_path = os.path.join(folder, f"SF {DEMO_TYPE} Validation.xlsx")
+        self.archive_path = os.path.join(folder, "archive.xlsx")
+        self.flip_to_open = []
+        self.sf_validation_cache = None
+        self.counts = BenchCounts()
+
+
+def _pick(rng: np.random.Generator, choices: np.ndarray, n: int, blank: float = 0.0) -> np.ndarray:
+    values = rng.choice(choices, size=n)
+    if blank:
+        values[rng.random(n) < blank] = ''
+    return values
+
+
+def _ids(prefix: str, idx: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    return np.where(keep, np.char.add(prefix, np.char.zfill(idx.astype(str), 15)), '')
+
+
+def generate(rows: int, folder: str, seed: int = 0) -> BenchDemo:
+    """Write a synthetic set of demo files.
+
+    :param rows: number of raw registrations
+    :type rows: int
+    :param folder: folder to write the files to
+    :type folder: str
+    :param seed: random seed (default 0)
+    :type seed: int
+    :return: demo object pointing at the files
+    :rtype: BenchDemo
+    """
+    rng = np.random.default_rng(seed)
+    demo_obj = BenchDemo(folder)
+    idx = np.arange(rows)
+    attended = rng.random(rows) < 0.4
+    first = np.char.add("first", idx.astype(str))
+    last = np.char.add("last", idx.astype(str))
+    domain = _pick(rng, DOMAINS, rows)
+    email = np.char.add(np.char.add(np.char.add(first, "."), last), np.char.add("@", domain))
+    phone = np.char.add("555", np.char.zfill((idx % 10_000_000).astype(str), 7))
+    phone[rng.random(rows) < 0.05] = ''
+    state = _pick(rng, STATES, rows)
+    company = np.char.add("Org ", (idx % 997).astype(str))
+    title = _pick(rng, TITLES, rows)
+
+    raw = pd.DataFrame({
+        "Attended": np.where(attended, "Yes", "No"),
+        "Last Name": last,
+        "First Name": first,
+        "Email Address": email,
+        "State/Province": state,
+        "Phone": phone,
+        "Organization": company,
+        "Job Title": title,
+        "Unsubscribed": np.where(rng.random(rows) < 0.02, "Yes", "No"),
+    })
+    raw.to_excel(demo_obj.raw_path, sheet_name=RAW_SHEET, index=False)
+
+    # the Access queries drop roughly 10% of records into the excludes
+    excluded = rng.random(rows) < 0.1
+    up = ~excluded
+    n_up = int(up.sum())
+    has_lead = rng.random(n_up) < 0.5
+    has_contact = rng.random(n_up) < 0.2
+    sf_code = np.where(attended[up], SF_CODES[0], SF_CODES[1])
+    udb_code = np.where(attended[up], UDB_CODES[0], UDB_CODES[1])
+    sfdc = pd.DataFrame({
+        "LastName": last[up],
+        "FirstName": first[up],
+        "Email": email[up],
+        "Domain": domain[up],
+        "State": state[up],
+        "PhoneNumber": phone[up],
+        "PhoneExt": '',
+        "Existing Lead Phone": np.where(rng.random(n_up) < 0.5, phone[up], ''),
+        "Company": company[up],
+        "Master Name": np.where(rng.random(n_up) < 0.8, company[up], ''),
+        "Existing Lead Compnay": company[up],
+        "CustomerTitle": title[up],
+        "AG": _pick(rng, np.array(["Active", "Inactive"]), n_up),
+        "TrackingCode": sf_code,
+        "PubCode": demo_obj.pub,
+        "LeadSource": "Webinar",
+        "Record Type ID": "012000000000000AAA",
+        "Country": "US",
+        "Current Lead Status": _pick(rng, STATUSES, n_up),
+        "Current Owner": _pick(rng, OWNERS, n_up),
+        "Current Owner ID": "005000000000000AAA",
+        "Current Marketing Note": _pick(rng, NOTES, n_up),
+        "Current Sales Note": "",
+        "Current Secondary Description": _pick(rng, np.array(["Coder / Coder Auditor", "HIM / HIM", ""]), n_up),
+        "Dead Reason": np.where(rng.random(n_up) < 0.05, "No Interest", ''),
+        "Existing Lead ID": _ids("00Q", idx[up], has_lead),
+        "Existing Contact ID": _ids("003", idx[up], has_contact),
+        "EmailValidation": "TRUE",
+        "LastNameValidation": "TRUE",
+        "FirstNameValidation": "TRUE",
+        "CompanyValidation": "TRUE",
+        "TitleValidation": "TRUE",
+        "LastActivityDate": "",
+        "Prior Marketing Note": "",
+        "Prior Sales Note": "",
+        "Prior Description": "",
+        "Prior Secondary Description": "",
+        "Prior Lead Status": "",
+        "Existing Lead Owner": "",
+        "Existing Lead Owner ID": "",
+        "ID": idx[up],
+    })
+    sfdc.to_excel(demo_obj.sf_path, sheet_name=SF_UPLOAD, index=False)
+    sfdc.iloc[:0].to_excel(demo_obj.sf_exclude_path, sheet_name=SF_EXCLUDE, index=False)
+
+    flags = lambda n, p: np.where(rng.random(n) < p, "Y", '')
+    udb = pd.DataFrame({
+        "FirstName": first[up],
+        "LastName": last[up],
+        "Email": email[up],
+        "State": state[up],
+        "PhoneNumber": phone[up],
+        "PhoneExt": '',
+        "Company": company[up],
+        "CustomerTitle": title[up],
+        "TrackingCode": udb_code,
+        "OppProduct": "Coding",
+        "SalesNotes": "",
+        "MarketingNotes": "Demo",
+        "LeadSource": "Webinar",
+        "Site": "HC",
+        "ParentCompanyID": (idx[up] % 997).astype(str),
+        "NewsletterIDs": "12;14",
+        "FreshAddressBadEmail": flags(n_up, 0.02),
+        "Undeliverable": flags(n_up, 0.01),
+        "EmailValidation": np.where(rng.random(n_up) < 0.03, "FALSE", "TRUE"),
+        "Current Owner": _pick(rng, OWNERS, n_up),
+        "Current Owner ID": "005000000000000AAA",
+        "Master Name": company[up],
+    })
+    udb.to_excel(demo_obj.udb_path, sheet_name=UDB_UPLOAD, index=False)
+
+    n_ex = int(excluded.sum())
+    exclude = pd.DataFrame({
+        "Email": email[excluded],
+        "TrackingCode": np.where(attended[excluded], UDB_CODES[0], UDB_CODES[1]),
+        "MasterSuppression": flags(n_ex, 0.5),
+        "IsActiveFalse": flags(n_ex, 0.3),
+        "HardBounce": flags(n_ex, 0.2),
+        "FreshAddressBadEmail": flags(n_ex, 0.1),
+        "Undeliverable": flags(n_ex, 0.1),
+    }).replace('', np.nan)
+    exclude.to_excel(demo_obj.exclude_path, sheet_name=UDB_EXCLUDE, index=False)
+
+    converted = rng.random(n_up) < 0.05
+    validation = pd.DataFrame({
+        "Last Name": last[up],
+        "Email": email[up],
+        "Stage": '',
+        "Converted Date": np.where(converted, "10/06/2022", ''),
+        "Lead Owner": _pick(rng, OWNERS, n_up),
+        "SFDC ID (18 digit)": np.char.add("00Q", np.char.zfill(idx[up].astype(str), 15)),
+        "Tracking Code": sf_code,
+    }).replace('', np.nan)
+    with pd.ExcelWriter(demo_obj.validation_path, engine='openpyxl') as writer:
+        pd.DataFrame({"Report": ["SF validation export"]}).to_excel(writer, sheet_name="Summary", index=False)
+        validation.to_excel(writer, sheet_name="Data", index=False)
+
+    with pd.ExcelWriter(demo_obj.archive_path, engine='openpyxl') as writer:
+        raw.assign(Date="01/01/2022", Type="HC Demo").to_excel(writer, sheet_name="Raw_Data", index=False)
+        sfdc.assign(Date="01/01/2022", Type="HC Demo").to_excel(writer, sheet_name="SFDC_Uploads", index=False)
+        udb.assign(Date="01/01/2022", Type="HC Demo").to_excel(writer, sheet_name="UDB_Uploads", index=False)
+        pd.DataFrame({"Date": ["01/01/2022"], "Type": ["HC Demo"]}).to_excel(writer, sheet_name="Upload_Counts",
+                                                                             index=False)
+
+    return demo_obj
+
+
+# --------------------- BENCHMARK --------------------- #
+def _timed(results: list, op: str, func, *args):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    value = func(*args)
+    results.append({"op": op,
+                    "wall_s": round(time.perf_counter() - start_wall, 4),
+                    "cpu_s": round(time.process_time() - start_cpu, 4)})
+    print(f"  {op:<28}{results[-1]['wall_s']:>10}s")
+    return value
+
+
+def bench(rows: int, pivots: bool = False, seed: int = 0) -> list:
+    """Time every helper and archive operation on one synthetic demo.
+
+    :param rows: number of raw registrations
+    :type rows: int
+    :param pivots: also build the Excel pivot tables, needs Excel installed (default False)
+    :type pivots: bool
+    :param seed: random seed (default 0)
+    :type seed: int
+    :return: timings per operation
+    :rtype: list
+    """
+    import file_processing.helpers as demo_f
+    import file_processing.dedup as dedup
+    import file_processing.email_check as email_check
+    import file_processing.phones as phones
+    import file_processing.archive as demo_archive
+    import file_processing.archive_queue as archive_queue
+    import file_processing.archive_helpers as demo_a
+    import file_processing.constants as demo_c
+
+    folder = tempfile.mkdtemp(prefix=f"bench-{rows}-")
+    results = []
+    try:
+        demo_obj = _timed(results, "generate", generate, rows, folder, seed)
+
+        patches = [mock.patch.object(demo_c, "RAW_DATA_PATH", demo_obj.raw_path),
+                   mock.patch.object(demo_c, "RAW_DATA_SHEET", RAW_SHEET),
+                   mock.patch.object(demo_archive, "ARCHIVE_PATH", demo_obj.archive_path),
+                   mock.patch.object(archive_queue.const, "ARCHIVE_PATH", demo_obj.archive_path),
+                   mock.patch.object(archive_queue, "QUEUE_DIR", os.path.join(folder, "archive_queue")),
+                   mock.patch.object(email_check, "VERDICT_CACHE_PATH", os.path.join(folder, "email_verdicts.npz")),
+                   mock.patch.object(phones, "HISTORY_CACHE_PATH", os.path.join(folder, "phone_history.npz")),
+                   # the queue is committed below so the rewrite is timed on its own
+                   mock.patch.object(archive_queue.COMMITTER, "wake", lambda: None)]
+        if not pivots:
+            patches.append(mock.patch.object(demo_f, "pivot_table", lambda *args, **kwargs: None))
+        for patch in patches:
+            patch.start()
+        try:
+            archive_mgr = demo_archive.ArchiveMgr(demo_obj)
+            _timed(results, "initial_counts", demo_f.initial_counts, demo_obj)
+            _timed(results, "flag_duplicates", dedup.flag_duplicates, demo_obj)
+            _timed(results, "check_emails", email_check.check_emails, demo_obj)
+            _timed(results, "sfdc_pre_val", demo_f.sfdc_pre_val, demo_obj)
+            _timed(results, "udb_pre_val", demo_f.udb_pre_val, demo_obj)
+            _timed(results, "sfdc_post_val", demo_f.sfdc_post_val, demo_obj)
+            _timed(results, "udb_post_val", demo_f.udb_post_val, demo_obj)
+            new_ids = _timed(results, "validation_counts", demo_f.validation_counts, demo_obj)
+            _timed(results, "sfdc_counts", demo_a.sfdc_counts, demo_obj)
+            _timed(results, "udb_counts", demo_a.udb_counts, demo_obj)
+            _timed(results, "append_raw", archive_mgr.append_raw)
+            _timed(results, "append_sfdc", archive_mgr.append_sfdc, new_ids)
+            _timed(results, "append_udb", archive_mgr.append_udb)
+            _timed(results, "append_counts", archive_mgr.append_counts)
+            _timed(results, "archive_commit", archive_queue.commit)
+        finally:
+            for patch in patches:
+                patch.stop()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(scales: list, out: str = RESULTS_PATH, pivots: bool = False, seed: int = 0) -> str:
+    """Benchmark each scale and append the results to the results file.
+
+    :param scales: numbers of raw registrations to benchmark
+    :type scales: list
+    :param out: results file (default testing/bench_results.jsonl)
+    :type out: str
+    :param pivots: also build the Excel pivot tables (default False)
+    :type pivots: bool
+    :param seed: random seed (default 0)
+    :type seed: int
+    :return: id of the run
+    :rtype: str
+    """
+    run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    commit = _commit()
+    with open(out, 'a') as file:
+        for rows in scales:
+            print(f"{rows} rows")
+            for result in bench(rows, pivots=pivots, seed=seed):
+                result.update(run=run_id, commit=commit, rows=rows, pandas=pd.__version__)
+                file.write(json.dumps(result) + '\n')
+    return run_id
+
+
+def compare(out: str = RESULTS_PATH, base: str = None, head: str = None) -> pd.DataFrame:
+    """Compare the timings of two runs.
+
+    :param out: results file (default testing/bench_results.jsonl)
+    :type out: str
+    :param base: id of the earlier run (default second to last run)
+    :type base: str
+    :param head: id of the later run (default last run)
+    :type head: str
+    :return: wall time of each operation in both runs and the ratio head / base
+    :rtype: pd.DataFrame
+    """
+    results = pd.read_json(out, lines=True, dtype={"run": str})
+    runs = list(dict.fromkeys(results["run"]))
+    if base is None or head is None:
+        if len(runs) < 2:
+            raise ValueError("There need to be at least two runs to compare.")
+        base, head = runs[-2], runs[-1]
+
+    table = results[results["run"].isin([base, head])].pivot_table(index=["rows", "op"], columns="run",
+                                                                   values="wall_s", aggfunc="min")
+    table = table[[base, head]]
+    table["ratio"] = (table[head] / table[base]).round(2)
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", type=int, default=SCALES[:2], help="raw registrations per run")
+    parser.add_argument("--out", default=RESULTS_PATH, help="results file")
+    parser.add_argument("--pivots", action="store_true", help="also build the pivot tables (needs Excel)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", nargs="*", metavar="RUN", help="compare two runs instead of benchmarking")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        runs = args.compare + [None] * (2 - len(args.compare))
+        print(compare(args.out, *runs[:2]).to_string())
+    else:
+        run(args.scales, out=args.out, pivots=args.pivots, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import unittest
+import pandas as pd
+from file_processing.dedup import find_duplicates
+
+
+def registrations(*rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["Attended", "Email Address", "First Name", "Last Name", "Organization",
+                                       "Phone"])
+
+
+class TestFindDuplicates(unittest.TestCase):
+    def test_initial_does_not_bridge_names(self):
+        data = registrations(("No", "j.smith@acme.com", "J", "Smith", "Acme", ""),
+                             ("No", "john.smith@acme.com", "John", "Smith", "Acme", ""),
+                             ("Yes", "jane.smith@acme.com", "Jane", "Smith", "Acme", ""))
+        report = find_duplicates(data)
+        # J joins one of them, never both
+        self.assertEqual(2, len(report))
+        self.assertEqual(1, report["Cluster"].nunique())
+        self.assertFalse({1, 2} <= set(report["Row"]))
+
+    def test_conflicting_first_names_are_not_merged(self):
+        data = registrations(("Yes", "john@acme.com", "John", "Smith", "Acme", "555-123-4567"),
+                             ("Yes", "jane@acme.com", "Jane", "Smith", "Acme", "555-123-4567"))
+        self.assertEqual(0, len(find_duplicates(data)))
+
+    def test_survivor_is_first_attended(self):
+        data = registrations(("No", "jsmith@gmail.com", "John", "Smith", "Acme Inc.", ""),
+                             ("Yes", "john.smith@acme.com", "john", "smith", "ACME", ""),
+                             ("Yes", "JOHN.SMITH@acme.com", "John", "Smith", "Acme", ""))
+        report = find_duplicates(data).set_index("Row")
+        self.assertEqual(1, report["Cluster"].nunique())
+        self.assertEqual([False, True, False], report.loc[[0, 1, 2], "Survivor"].tolist())
+        self.assertIn("email", report.loc[2, "Matched On"])
+
+    def test_same_email_merges_whatever_the_name(self):
+        data = registrations(("Yes", "front.desk@clinic.org", "Ann", "Lee", "Clinic", ""),
+                             ("No", "front.desk@clinic.org", "Bob", "Lee", "Clinic", ""))
+        self.assertEqual(2, len(find_duplicates(data)))
+
+    def test_no_duplicates(self):
+        data = registrations(("Yes", "a@acme.com", "Ann", "Lee", "Acme", ""),
+                             ("No", "b@other.com", "Bob", "Stone", "Other", ""))
+        report = find_duplicates(data)
+        self.assertEqual(0, len(report))
+        self.assertEqual(["Row", "Cluster", "Survivor", "Matched On"], list(report.columns))
@@ -0,0 +1,60 @@
+import unittest
+import pandas as pd
+from file_processing.email_check import check, VerdictCache, INVALID, BAD_EMAIL, UNDELIVERABLE
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.empty = VerdictCache.empty()
+
+    def test_syntax(self):
+        verdicts = check(pd.Series(["jane.doe@example.com", "jane doe@example.com", "jane@", "@example.com",
+                                    "jane@example", "jane..doe@example.com"]), cache=self.empty)
+        self.assertEqual(["", "syntax", "syntax", "syntax", "syntax", "syntax"], verdicts["Reason"].tolist())
+        self.assertEqual(["TRUE"] + ["FALSE"] * 5, verdicts["EmailValidation"].tolist())
+
+    def test_domain_typo(self):
+        verdicts = check(pd.Series(["jane@gmial.com", "jane@googlemail.com", "jane@Gmail.com"]), cache=self.empty)
+        self.assertEqual(["gmail.com"] * 3, verdicts["Domain"].tolist())
+        self.assertEqual(["domain typo", "", ""], verdicts["Reason"].tolist())
+        self.assertEqual(["FALSE", "TRUE", "TRUE"], verdicts["EmailValidation"].tolist())
+
+    def test_disposable_and_role(self):
+        verdicts = check(pd.Series(["jane@mailinator.com", "info@example.com", "Sales+west@example.com",
+                                    "i.n.f.o@mailinator.com", "information@example.com"]), cache=self.empty)
+        self.assertEqual(["disposable domain", "role account", "role account", "disposable domain, role account", ""],
+                         verdicts["Reason"].tolist())
+        self.assertEqual(["Y", "Y", "Y", "Y", "N"], verdicts["FreshAddressBadEmail"].tolist())
+        self.assertEqual(["TRUE"] * 5, verdicts["EmailValidation"].tolist())
+
+    def test_archived_verdicts(self):
+        cache = VerdictCache.from_uploads(pd.DataFrame({
+            "Email": ["a@example.com", "b@example.com", "c@example.com", "a@example.com"],
+            "EmailValidation": ["FALSE", "TRUE", "TRUE", "TRUE"],
+            "FreshAddressBadEmail": ["N", "Y", "N", "N"],
+            "Undeliverable": ["N", "N", "Y", "N"],
+        }))
+        verdicts = check(pd.Series(["A@Example.com", "b@example.com", " c@example.com", "d@example.com"],
+                                   index=[10, 11, 12, 13]), cache=cache)
+        self.assertEqual([10, 11, 12, 13], verdicts.index.tolist())
+        self.assertEqual(["", "archived bad email", "archived undeliverable", ""], verdicts["Reason"].tolist())
+        self.assertEqual(["N", "Y", "N", "N"], verdicts["FreshAddressBadEmail"].tolist())
+        self.assertEqual(["N", "N", "Y", "N"], verdicts["Undeliverable"].tolist())
+
+
+class TestVerdictCache(unittest.TestCase):
+    def test_latest_upload_wins(self):
+        cache = VerdictCache.from_uploads(pd.DataFrame({
+            "Email": ["a@example.com", "b@example.com", "A@example.com"],
+            "EmailValidation": ["TRUE", "FALSE", "FALSE"],
+            "FreshAddressBadEmail": ["Y", "N", "Y"],
+        }))
+        self.assertEqual([INVALID | BAD_EMAIL, INVALID, 0],
+                         cache.lookup(pd.Series(["a@example.com", "b@example.com", "z@example.com"])).tolist())
+
+    def test_undeliverable(self):
+        cache = VerdictCache.from_uploads(pd.DataFrame({"Email": ["a@example.com"], "Undeliverable": ["y"]}))
+        self.assertEqual([UNDELIVERABLE], cache.lookup(pd.Series(["a@example.com"])).tolist())
+
+    def test_empty(self):
+        self.assertEqual([0, 0], VerdictCache.empty().lookup(pd.Series(["a@example.com", "b@example.com"])).tolist())
@@ -0,0 +1,41 @@
+import unittest
+import pandas as pd
+from file_processing.phones import normalize, PhoneIndex, recover
+
+
+class TestNormalize(unittest.TestCase):
+    def test_extensions(self):
+        number, ext = normalize(pd.Series(["(555) 123-4567 ext. 89", "555.123.4567x12", "555 123 4567 #7",
+                                           "555-123-4567, Extension 4410", "555-123-4567"]))
+        self.assertEqual(["555-123-4567"] * 5, number.tolist())
+        self.assertEqual(["89", "12", "7", "4410", ""], ext.tolist())
+
+    def test_country_code(self):
+        number, _ = normalize(pd.Series(["1-555-123-4567", "+1 (555) 123-4567", "+44 20 7946 0958"]))
+        self.assertEqual(["555-123-4567", "555-123-4567", "+442079460958"], number.tolist())
+
+    def test_placeholders(self):
+        number, ext = normalize(pd.Series(["0000000000", "111-111-1111", "123", "", None, "n/a"]))
+        self.assertEqual([''] * 6, number.tolist())
+        self.assertEqual([''] * 6, ext.tolist())
+
+    def test_other_numbers_kept(self):
+        number, _ = normalize(pd.Series(["555-1234", " 02 9374 4000 "]))
+        self.assertEqual(["555-1234", "02 9374 4000"], number.tolist())
+
+
+class TestRecover(unittest.TestCase):
+    def test_last_phone_wins_and_first_index_first(self):
+        raw = PhoneIndex.from_frame(pd.Series(["A@x.com", "b@x.com", "a@x.com"]),
+                                    pd.Series(["5551112222", "", "555-333-4444 x9"]))
+        archived = PhoneIndex.from_frame(pd.Series(["a@x.com", "c@x.com"]), pd.Series(["5559990000", "5558887777"]))
+        data = pd.DataFrame({"Email": ["a@x.com", "b@x.com", "c@x.com", "d@x.com"],
+                             "PhoneNumber": ["", "", "", "555-000-1234"], "PhoneExt": ["", "", "", ""]})
+
+        self.assertEqual(2, recover(data, [raw, archived]))
+        self.assertEqual(["555-333-4444", "", "555-888-7777", "555-000-1234"], data["PhoneNumber"].tolist())
+        self.assertEqual(["9", "", "", ""], data["PhoneExt"].tolist())
+
+    def test_empty_index(self):
+        data = pd.DataFrame({"Email": ["a@x.com"], "PhoneNumber": [""], "PhoneExt": [""]})
+        self.assertEqual(0, recover(data, [PhoneIndex.empty()]))
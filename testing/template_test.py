@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from file_processing.template import Template, load
+
+
+class TestTemplate(unittest.TestCase):
+    def test_placeholders(self):
+        template = Template("Hi [demo type] team\nAttendees: [a_initial_count]\n")
+        self.assertEqual("Hi HC team\nAttendees: 12\n", template.render({"demo type": "HC", "a_initial_count": 12}))
+
+    def test_optional_line_left_out_when_zero(self):
+        template = Template("Total: [total]\nConverted: [converted?]\nDead: [left_dead?]\n")
+        self.assertEqual("Total: 0\nDead: 3\n", template.render({"total": 0, "converted": 0, "left_dead": 3}))
+        self.assertEqual("Total: 5\n", template.render({"total": 5, "converted": '', "left_dead": None}))
+
+    def test_legacy_bullet_left_out_when_zero(self):
+        # templates without [name?] leave out a line whose value right after "- " is 0
+        template = Template("Counts:\n- [null_phone] null phone\n- [left_dead] left dead\nTotal [total]\n")
+        self.assertEqual("Counts:\n- 4 left dead\nTotal 0\n",
+                         template.render({"null_phone": 0, "left_dead": 4, "total": 0}))
+
+    def test_markers_turn_off_legacy_rule(self):
+        template = Template("- [null_phone] null phone\n- [left_dead?] left dead\n")
+        self.assertEqual("- 0 null phone\n", template.render({"null_phone": 0, "left_dead": 0}))
+
+    def test_unknown_brackets_kept(self):
+        template = Template("Owner: []\nCode: [tracking]\n")
+        self.assertEqual("Owner: []\nCode: [tracking]\n", template.render({}))
+
+    def test_load_reuses_until_changed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "template.txt")
+            with open(path, 'w') as file:
+                file.write("[a]\n")
+            first = load(path)
+            self.assertIs(first, load(path))
+
+            with open(path, 'w') as file:
+                file.write("[a] [b]\n")
+            os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+            self.assertEqual("1 2\n", load(path).render({"a": 1, "b": 2}))
@@ -1,19 +1,39 @@
 import os
-import json
+import sys
 import shutil
+import threading
 import subprocess
 import tkinter as tk
-from tkinter import messagebox
-from tkcalendar import DateEntry
+from tkinter import ttk, messagebox
 from datetime import datetime
-import file_processing.demo as demo
-import file_processing.helpers as demo_f
 import file_processing.constants as demo_c
-import file_processing.file_paths as demo_p
-import file_processing.archive_helpers as demo_a
-from file_processing.archive import ArchiveMgr
-from file_processing.initialize_data import initialize
+from file_processing.settings import SETTINGS
 from logs.log import logger
+from logs import metrics
+from ui.worker import StepWorker
+
+
+# pandas, pywin32 and pyodbc are imported in the functions that use them, so the window shows before they are loaded.
+# These are plain imports, which wait for each other across threads, so a module first used by the worker and the
+# archive-resume thread at once is only run once
+def resume_archive() -> None:
+    """Start the archive committer, which writes appends left queued by an earlier run.
+
+    :return: None
+    :rtype: None
+    """
+    import file_processing.archive_queue as archive_queue
+    archive_queue.COMMITTER.start()
+
+
+def initialize() -> None:
+    """Register the demos of the schedule that aren't in the counts file yet.
+
+    :return: None
+    :rtype: None
+    """
+    import file_processing.initialize_data as init_data
+    init_data.initialize()
 
 
 class DemoFrame(tk.Frame):
@@ -30,16 +50,17 @@ class DemoFrame(tk.Frame):
         super().__init__(parent, *args, **kwargs)
         self.parent = parent
 
-        today = datetime.now().date()
         button_width = 35
 
         lbl = tk.Label(text="Date of demo:")
         lbl.pack()
 
-        self.cal = DateEntry(self, selectmode="day", year=today.year, month=today.month, day=today.day,
-                             width=button_width + 5)
-        self.cal.pack(pady=5)
-        self.cal.bind("<<DateEntrySelected>>", self.create_demo)
+        # tkcalendar (and babel) is built into this frame once the window has been drawn
+        self.cal_frame = tk.Frame(self)
+        self.cal_frame.pack(pady=5)
+        self.cal = None
+        self.cal_width = button_width + 5
+        self.after_idle(self.after, 0, self.build_calendar)
 
         self.m_demos_val = tk.BooleanVar()
         self.m_demos = tk.Checkbutton(self,
@@ -68,10 +89,49 @@ class DemoFrame(tk.Frame):
         step_six = tk.Button(self, text="Archive", width=button_width, command=self.sixth_step)
         step_six.pack(pady=10)
 
+        rerun = tk.Button(self, text="Rerun changed steps", width=button_width, command=self.rerun_changed)
+        rerun.pack()
+
+        self.progress = ttk.Progressbar(self, orient=tk.HORIZONTAL, length=button_width * 7, mode="determinate")
+        self.progress.pack(pady=(10, 0))
+
+        self.status = tk.StringVar(value="Ready")
+        tk.Label(self, textvariable=self.status).pack()
+
+        self.cancel_btn = tk.Button(self, text="Cancel", width=15, state=tk.DISABLED, command=self.cancel_step)
+        self.cancel_btn.pack()
+
+        self.expected_stages = ()
+        self.worker = StepWorker(self, on_stage=self.stage_event, on_finish=self.step_finished)
+        self.dialogs = self.worker.dialogs
+
         self.demo_obj = None
         self.demo_obj_type = None
         self.new_id_data = None
-        self.archive_obj = None
+
+        # runs step one by itself when a new raw data file arrives, if turned on in the settings
+        self.watcher = None
+        SETTINGS.subscribe(self.settings_changed)
+        self.after_idle(self.toggle_watcher)
+
+        # writes archive appends left queued by an earlier run, loaded off the main loop since it imports pandas
+        threading.Thread(target=resume_archive, name="archive-resume", daemon=True).start()
+
+    def build_calendar(self) -> None:
+        """Create the date picker, does nothing if it already exists.
+
+        :return: None
+        :rtype: None
+        """
+        if self.cal is not None:
+            return
+        from tkcalendar import DateEntry
+
+        today = datetime.now().date()
+        self.cal = DateEntry(self.cal_frame, selectmode="day", year=today.year, month=today.month, day=today.day,
+                             width=self.cal_width)
+        self.cal.pack()
+        self.cal.bind("<<DateEntrySelected>>", self.create_demo)
 
     def create_demo(self, event) -> None:
         """Create and validate demo object.
@@ -81,12 +141,12 @@ class DemoFrame(tk.Frame):
         :return: None
         :rtype: None
         """
+        self.build_calendar()
         logger.debug(self.cal.get_date().strftime('%m/%d/%Y'))
+        import file_processing.demo as demo
         try:
             self.demo_obj_type = self.demo_obj_type
             self.demo_obj = demo.Demo(self.cal.get_date(), demo_type=self.demo_obj_type)
-            self.archive_obj = ArchiveMgr(self.demo_obj)
-
         except Exception as e:
             self.demo_obj = None
             messagebox.showerror("Invalid Date", str(e))
@@ -96,11 +156,131 @@ class DemoFrame(tk.Frame):
         """Validates the date selected in case it changed."""
 
         def wrapper(self, *args, **kwargs):
+            # the running step still uses the current demo object
+            if self.worker.busy or (self.watcher is not None and self.watcher.processing):
+                messagebox.showinfo("Step Running", "Another step is still running, wait for it to finish or cancel "
+                                                    "it.")
+                return
             self.create_demo(None)
             return func(self, *args, **kwargs)
 
         return wrapper
 
+    def in_background(*stages):
+        """Runs the step on the worker thread, the progress bar moves as each of the given stages finishes."""
+
+        def decorator(func):
+            def wrapper(self, *args, **kwargs):
+                self.expected_stages = stages
+                if stages:
+                    self.progress.config(mode="determinate", maximum=len(stages), value=0)
+                else:
+                    self.progress.config(mode="indeterminate")
+                    self.progress.start()
+                self.status.set("Starting...")
+                self.cancel_btn.config(state=tk.NORMAL)
+                return self.worker.start(func.__name__, func, self, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stage_event(self, event: str, record: dict) -> None:
+        """Update the progress bar from the worker's stage events.
+
+        :param event: "start" or "end"
+        :type event: str
+        :param record: stage record from logs.metrics
+        :type record: dict
+        :return: None
+        :rtype: None
+        """
+        if event == "start":
+            self.status.set(f"Running {record['stage']}...")
+        elif record["stage"] in self.expected_stages and self.progress["mode"] == "determinate":
+            self.progress.step(1)
+
+    def step_finished(self, name: str) -> None:
+        """Reset the progress widgets once the worker finishes a step.
+
+        :param name: name of the step
+        :type name: str
+        :return: None
+        :rtype: None
+        """
+        self.progress.stop()
+        self.progress.config(mode="determinate", maximum=1, value=1)
+        self.status.set(f"Finished {name.replace('_', ' ')}")
+        self.cancel_btn.config(state=tk.DISABLED)
+
+    def cancel_step(self) -> None:
+        """Cancel the running step before its next stage.
+
+        :return: None
+        :rtype: None
+        """
+        self.status.set("Cancelling after the current stage...")
+        self.worker.cancel()
+
+    def run_stage(self, name: str, *args):
+        """Run a pipeline stage for the current demo, on the shared service when service mode is on.
+
+        :param name: name of the stage
+        :type name: str
+        :param args: extra arguments for the stage function, not sent to the service
+        :type args: any
+        :return: what the stage returns, None from the service
+        :rtype: any
+        """
+        if SETTINGS.service_mode:
+            import file_processing.service as service
+            # what the stage set on the service's demo, e.g. the dead attendees to flip to open, is copied over
+            for attr, value in service.Client().run_stage(self.demo_obj, name).items():
+                setattr(self.demo_obj, attr, value)
+            return None
+        import file_processing.pipeline as pipeline
+        return pipeline.PIPELINE.run_stage(self.demo_obj, name, *args)
+
+    def settings_changed(self, changed: dict) -> None:
+        """Restart the raw data watcher when its settings change, may be called from any thread.
+
+        :param changed: settings that changed, setting: new value
+        :type changed: dict
+        :return: None
+        :rtype: None
+        """
+        if "Watch Raw Data" in changed or "Raw Data Path" in changed:
+            self.worker.post(self.toggle_watcher)
+
+    def toggle_watcher(self) -> None:
+        """Start or stop the raw data watcher to match the settings, must run on the main loop.
+
+        :return: None
+        :rtype: None
+        """
+        if self.watcher is not None:
+            self.watcher.stop(wait=False)
+            self.watcher = None
+        if SETTINGS.watch_raw_data:
+            import file_processing.watcher as watcher
+            self.watcher = watcher.RawDataWatcher(on_result=lambda result: self.worker.post(self.watch_result, result),
+                                                  can_run=lambda: not self.worker.busy)
+            self.watcher.start()
+
+    def watch_result(self, result) -> None:
+        """Tell the operator what the raw data watcher did, must run on the main loop.
+
+        :param result: what the watcher did with a raw data file
+        :type result: watcher.WatchResult
+        :return: None
+        :rtype: None
+        """
+        self.status.set(f"Raw data {'processed' if result.ok else 'needs review'}")
+        if result.ok:
+            messagebox.showinfo("Raw Data Processed", result.message)
+        else:
+            messagebox.showwarning("Raw Data Needs Review", result.message)
+
     @invalid_date
     def multi_demos(self) -> None:
         """Handle the case where multiple demos fall on one day.
@@ -108,7 +288,9 @@ class DemoFrame(tk.Frame):
         :return: None
         :rtype: None
         """
-        demos = demo.DEMO_INFO[(demo.DEMO_INFO["Webinar Date"] == self.demo_obj.demo_date.strftime('%#m/%#d/%Y'))]
+        import file_processing.demo as demo
+        schedule = demo.load_demo_info()
+        demos = schedule[(schedule["Webinar Date"] == self.demo_obj.demo_date.strftime('%#m/%#d/%Y'))]
         demos = list(demos["Demo Type"].unique())
         win = tk.Toplevel(self.parent)
         win.title("Choose")
@@ -135,6 +317,7 @@ class DemoFrame(tk.Frame):
         tk.Button(frame, text="Ok", width=15, command=update_demo).pack(pady=5)
 
     @invalid_date
+    @in_background("initial_counts", "flag_duplicates", "check_emails", "Demo.run_through_access")
     def first_step(self) -> None:
         """Process the raw file and handle errors through the ui.
 
@@ -142,25 +325,39 @@ class DemoFrame(tk.Frame):
         :rtype: None
         """
         logger.info("Demo type selected %s, and actual %s", self.demo_obj_type, self.demo_obj.demo_type)
-        try:
-            demo_f.initial_counts(self.demo_obj)
-        except Exception as e:
-            messagebox.showerror("Validation Error", str(e))
-            logger.error("Validation Error %s", repr(e))
-
+        import file_processing.helpers as demo_f
         try:
             demo_f.create_destination(self.demo_obj.destination_path)
         except AttributeError:
             logger.error("Create file AttributeError")
             return
         except Exception as e:
-            messagebox.showerror("Folder Creation Error", str(e))
+            self.dialogs.showerror("Folder Creation Error", str(e))
             logger.error("Folder Creation Error %s", repr(e))
             return
 
         try:
-            self.demo_obj.run_through_access()
-        except BaseException as e:
+            self.run_stage("initial_counts")
+        except Exception as e:
+            self.dialogs.showerror("Validation Error", str(e))
+            logger.error("Validation Error %s", repr(e))
+
+        try:
+            self.run_stage("flag_duplicates")
+        except Exception as e:
+            self.dialogs.showerror("Duplicate Error",
+                                   f"There was an error finding duplicate registrations:\n\n{str(e)}")
+            logger.error("Duplicate Error %s", repr(e))
+
+        try:
+            self.run_stage("check_emails")
+        except Exception as e:
+            self.dialogs.showerror("Email Check Error", f"There was an error checking the emails:\n\n{str(e)}")
+            logger.error("Email Check Error %s", repr(e))
+
+        try:
+            self.run_stage("run_through_access")
+        except Exception as e:
             if len(e.args) == 2:
                 error = e.args[1]
             elif len(e.args) == 4:
@@ -169,23 +366,23 @@ class DemoFrame(tk.Frame):
                 error = str(e)
 
             if "You already have the database open" in error:
-                messagebox.showerror("Access Error",
-                                     "This program accidentally left Access open the last time it was used. The issue "
-                                     "is fixed now, so please disregard this error and run the program again.")
+                self.dialogs.showerror("Access Error",
+                                       "This program accidentally left Access open the last time it was used. The "
+                                       "issue is fixed now, so please disregard this error and run the program again.")
 
             elif "such file or directory" in error:
-                messagebox.showerror("Access Error",
-                                     f"There was no file {demo_c.RAW_DATA_PATH}\n\n"
-                                     f"Put the raw data file here with the same name and run the program again.")
+                self.dialogs.showerror("Access Error",
+                                       f"There was no file {demo_c.RAW_DATA_PATH}\n\n"
+                                       f"Put the raw data file here with the same name and run the program again.")
 
             elif "fill" in error and "form" in error:
-                messagebox.showerror("Access Error",
-                                     f"Open the Access DB, click 'Enable Content' at the top, close Access, "
-                                     f"and run the program again.")
+                self.dialogs.showerror("Access Error",
+                                       f"Open the Access DB, click 'Enable Content' at the top, close Access, "
+                                       f"and run the program again.")
             else:
-                messagebox.showerror("Access Error",
-                                     f"The following error was raised from the Access Database:\n\n{error}\n\nFix the "
-                                     f"issue in Access and run the program again.")
+                self.dialogs.showerror("Access Error",
+                                       f"The following error was raised from the Access Database:\n\n{error}\n\nFix "
+                                       f"the issue in Access and run the program again.")
             logger.error("Access Error: %s", repr(e))
             return
 
@@ -194,14 +391,15 @@ class DemoFrame(tk.Frame):
             new_data_path = os.path.join(self.demo_obj.destination_path, data_name)
             shutil.move(demo_c.RAW_DATA_PATH, new_data_path)
         except Exception as e:
-            messagebox.showerror("Data Transfer Error",
-                                 f"The following error occurred when attempting to move the raw data to the new folder:"
-                                 f"\n{str(e)}")
+            self.dialogs.showerror("Data Transfer Error",
+                                   f"The following error occurred when attempting to move the raw data to the new "
+                                   f"folder:\n{str(e)}")
             logger.error("Data Transfer Error: %s", repr(e))
 
-        messagebox.showinfo("Access Completed", "The access database has finished, run the next step.")
+        self.dialogs.showinfo("Access Completed", "The access database has finished, run the next step.")
 
     @invalid_date
+    @in_background("pivot_table", "sfdc_pre_val")
     def second_step(self) -> None:
         """Process sfdc file for review and handle errors through the ui.
 
@@ -209,22 +407,23 @@ class DemoFrame(tk.Frame):
         :rtype: None
         """
         try:
-            demo_f.sfdc_pre_val(self.demo_obj)
+            self.run_stage("sfdc_pre_val")
         except Exception as e:
             if "COM object" or "com_error" in repr(e):
-                messagebox.showerror("SFDC File Error", "There was an issue creating the validation pivot tables. "
-                                                        "You will have to create them manually.")
+                self.dialogs.showerror("SFDC File Error", "There was an issue creating the validation pivot tables. "
+                                                          "You will have to create them manually.")
             else:
-                messagebox.showerror("SFDC File Error", str(e))
+                self.dialogs.showerror("SFDC File Error", str(e))
             logger.error("SFDC File Error: %s", repr(e))
 
         if len(self.demo_obj.flip_to_open) > 0:
             emails = '\n'.join(self.demo_obj.flip_to_open)
-            messagebox.showinfo("Flip to open",
-                                f"The following email address(es) attended the demo but are marked dead in SalesForce "
-                                f"and need to be flipped to open:\n\n{emails}")
+            self.dialogs.showinfo("Flip to open",
+                                  f"The following email address(es) attended the demo but are marked dead in "
+                                  f"SalesForce and need to be flipped to open:\n\n{emails}")
 
     @invalid_date
+    @in_background("pivot_table", "udb_pre_val")
     def third_step(self) -> None:
         """Process udb file for review and handle errors through the ui.
 
@@ -232,16 +431,17 @@ class DemoFrame(tk.Frame):
         :rtype: None
         """
         try:
-            demo_f.udb_pre_val(self.demo_obj)
+            self.run_stage("udb_pre_val")
         except Exception as e:
             if "COM object" in str(e):
-                messagebox.showerror("UDB File Error", "There was an issue creating the validation pivot tables. "
-                                                       "Run the process again or create them manually.")
+                self.dialogs.showerror("UDB File Error", "There was an issue creating the validation pivot tables. "
+                                                         "Run the process again or create them manually.")
             else:
-                messagebox.showerror("UDB File Error", str(e))
+                self.dialogs.showerror("UDB File Error", str(e))
             logger.error("UDB File Error: %s", repr(e))
 
     @invalid_date
+    @in_background("sfdc_post_val", "udb_post_val")
     def fourth_step(self) -> None:
         """Prepare files for upload and handle errors through the ui.
 
@@ -249,22 +449,23 @@ class DemoFrame(tk.Frame):
         :rtype: None
         """
         try:
-            demo_f.sfdc_post_val(self.demo_obj)
+            self.run_stage("sfdc_post_val")
         except Exception as e:
-            messagebox.showerror("SFDC File Error", str(e))
+            self.dialogs.showerror("SFDC File Error", str(e))
             logger.error("SFDC File Error %s", repr(e))
             return
 
         try:
-            demo_f.udb_post_val(self.demo_obj)
+            self.run_stage("udb_post_val")
         except Exception as e:
-            messagebox.showerror("UDB File Error", str(e))
+            self.dialogs.showerror("UDB File Error", str(e))
             logger.error("UDB File Error: %s", repr(e))
             return
 
         subprocess.Popen(f'explorer {self.demo_obj.destination_path}')
 
     @invalid_date
+    @in_background("validation_counts", "generate_email")
     def fifth_step(self) -> None:
         """Prepare files for upload and handle errors through the ui.
 
@@ -272,23 +473,30 @@ class DemoFrame(tk.Frame):
         :rtype: None
         """
         try:
-            self.new_id_data = demo_f.validation_counts(self.demo_obj)
+            self.new_id_data = self.run_stage("validation_counts")
         except Exception as e:
-            messagebox.showerror("Validation Error", str(e))
+            self.dialogs.showerror("Validation Error", str(e))
             logger.error("Validation Error %s", repr(e))
 
         try:
-            demo_f.generate_email(self.demo_obj)
+            self.run_stage("generate_email")
         except Exception as e:
             if 'out of range' in str(e):
-                messagebox.showerror("Validation Error",
-                                     f"A necessary file was not found in {self.demo_obj.destination_folder}, "
-                                     f"be sure to include all files necessary to the demo.")
+                self.dialogs.showerror("Validation Error",
+                                       f"A necessary file was not found in {self.demo_obj.destination_folder}, "
+                                       f"be sure to include all files necessary to the demo.")
             else:
-                messagebox.showerror("Validation Error", str(e))
+                self.dialogs.showerror("Validation Error", str(e))
             logger.error("Validation Error %s", repr(e))
 
-        # validation pop up
+        self.worker.post(self.show_validation)
+
+    def show_validation(self) -> None:
+        """Show the validation counts pop up, must run on the main loop.
+
+        :return: None
+        :rtype: None
+        """
         counts = self.demo_obj.counts.retrieve_all()
         win = tk.Toplevel(self.parent)
         win.title("Validation")
@@ -302,20 +510,24 @@ class DemoFrame(tk.Frame):
         # sfdc counts
         tk.Label(win, text="SFDC").grid(column=0, row=2)
         tk.Label(win, text=f"excluded: {counts['sf_excluded']}").grid(column=0, row=3, sticky=tk.W, padx=5)
-        tk.Label(win, text=f"null_phone: {counts['null_phone']}").grid(column=0, row=4, sticky=tk.W, padx=5)
+        tk.Label(win, text=f"null_phone: {counts['null_phone']} ({counts['sf_phones_recovered']} recovered)") \
+            .grid(column=0, row=4, sticky=tk.W, padx=5)
         tk.Label(win, text=f"contact_no_lead: {counts['contact_no_lead']}").grid(column=0, row=5, sticky=tk.W, padx=5)
         tk.Label(win, text=f"left_dead: {counts['left_dead']}").grid(column=0, row=6, sticky=tk.W, padx=5)
         tk.Label(win, text=f"converted: {counts['converted']}").grid(column=0, row=7, sticky=tk.W, padx=5)
         tk.Label(win, text=f"updated_leads: {counts['updated_leads']}").grid(column=0, row=8, sticky=tk.W, padx=5)
         tk.Label(win, text=f"as_requested: {counts['as_requested']}").grid(column=0, row=9, sticky=tk.W, padx=5)
+        tk.Label(win, text=f"duplicates: {counts['sf_duplicates']}").grid(column=0, row=10, sticky=tk.W, padx=5)
 
         sfdc_total_count = int(counts['a_internal_records']) + int(counts['na_internal_records']) + int(
             counts['null_phone']) + int(counts['contact_no_lead']) + int(counts['left_dead']) + int(
             counts['a_converted']) + int(counts['na_converted']) + int(counts['updated_leads']) + int(
-            counts['as_requested']) + int(counts['sf_excluded'])
-        tk.Label(win, text=f"total: {sfdc_total_count}").grid(column=0, row=10, sticky=tk.W, padx=5)
+            counts['as_requested']) + int(counts['sf_excluded']) + int(counts['sf_duplicates'])
+        tk.Label(win, text=f"total: {sfdc_total_count}").grid(column=0, row=11, sticky=tk.W, padx=5)
         tk.Label(win, text=f"variance: {sfdc_total_count - counts['a_initial_count'] - counts['na_initial_count']}") \
-            .grid(column=0, row=11, sticky=tk.W, padx=5)
+            .grid(column=0, row=12, sticky=tk.W, padx=5)
+        tk.Label(win, text=f"cleaned values: {sum(counts.get('sf_cleaned', {}).values())}") \
+            .grid(column=0, row=13, sticky=tk.W, padx=5)
 
         # udb counts
         tk.Label(win, text="UDB").grid(column=1, row=2)
@@ -329,53 +541,118 @@ class DemoFrame(tk.Frame):
         tk.Label(win, text=f"total: {udb_total_count}").grid(column=1, row=5, sticky=tk.W, padx=5)
         tk.Label(win, text=f"variance: {udb_total_count - counts['a_initial_count'] - counts['na_initial_count']}") \
             .grid(column=1, row=6, sticky=tk.W, padx=5)
+        tk.Label(win, text=f"cleaned values: {sum(counts.get('udb_cleaned', {}).values())}") \
+            .grid(column=1, row=7, sticky=tk.W, padx=5)
+        tk.Label(win, text=f"bad emails (local): {counts['a_local_bad_email'] + counts['na_local_bad_email']}") \
+            .grid(column=1, row=8, sticky=tk.W, padx=5)
+
+        tk.Button(win, text="Explain variance", width=15, command=self.explain_variance) \
+            .grid(column=0, columnspan=2, row=14, pady=(10, 0))
+
+    def explain_variance(self) -> None:
+        """Show the records that explain the validation variance, must run on the main loop.
+
+        :return: None
+        :rtype: None
+        """
+        import file_processing.lineage as lineage
+        try:
+            report = lineage.explain(self.demo_obj)
+        except FileNotFoundError:
+            self.dialogs.showerror("Validation Error", "This demo has no lineage, process the raw data again to start "
+                                                       "one.")
+            return
+
+        win = tk.Toplevel(self.parent)
+        win.title("Variance")
+        text = tk.Text(win, width=120, height=30, wrap=tk.NONE)
+        scroll = ttk.Scrollbar(win, orient=tk.VERTICAL, command=text.yview)
+        text.config(yscrollcommand=scroll.set)
+        text.grid(column=0, row=0, sticky=tk.NSEW)
+        scroll.grid(column=1, row=0, sticky=tk.NS)
+        text.insert(tk.END, "Every record reconciles." if report.empty else report.to_string(index=False))
+        text.config(state=tk.DISABLED)
 
     @invalid_date
+    @in_background("ArchiveMgr.append_raw", "ArchiveMgr.append_sfdc", "ArchiveMgr.append_udb", "sfdc_counts",
+                   "udb_counts", "ArchiveMgr.append_counts")
     def sixth_step(self) -> None:
         """Archive counts and handle errors through the ui.
 
         :return: None
         :rtype: None
         """
-        # archive raw data
+        # archive raw data, the appends are queued and written once the archive file is free
         try:
-            self.archive_obj.append_raw()
+            self.run_stage("archive_raw")
         except Exception as e:
-            if "Permission" in str(e):
-                messagebox.showerror("Archive Error", "The UDB Validation Archive file is open. Ensure the file is "
-                                                      "closed by all users, then run again.")
-            else:
-                messagebox.showerror("Archive Error", f"There was an error archiving the raw data:\n\n{str(e)}")
-
+            self.dialogs.showerror("Archive Error", f"There was an error archiving the raw data:\n\n{str(e)}")
             logger.error("Archive Error %s", repr(e))
             return
 
         # archive sfdc upload
         try:
-            self.archive_obj.append_sfdc(self.new_id_data)
+            self.run_stage("archive_sfdc", self.new_id_data)
         except Exception as e:
-            messagebox.showerror("Archive Error", f"There was an error archiving the sfdc upload data:\n\n{str(e)}")
+            self.dialogs.showerror("Archive Error", f"There was an error archiving the sfdc upload data:\n\n{str(e)}")
             logger.error("Archive Error %s", repr(e))
             return
 
         # archive udb upload
         try:
-            self.archive_obj.append_udb()
+            self.run_stage("archive_udb")
         except Exception as e:
-            messagebox.showerror("Archive Error", f"There was an error archiving the udb upload data:\n\n{str(e)}")
+            self.dialogs.showerror("Archive Error", f"There was an error archiving the udb upload data:\n\n{str(e)}")
             logger.error("Archive Error %s", repr(e))
             return
 
         # archive upload counts
         try:
-            demo_a.sfdc_counts(self.demo_obj)
-            demo_a.udb_counts(self.demo_obj)
-            self.archive_obj.append_counts()
+            self.run_stage("archive_counts")
         except Exception as e:
-            messagebox.showerror("Archive Error", str(e))
+            self.dialogs.showerror("Archive Error", str(e))
             logger.error("Archive Error %s", repr(e))
 
-        messagebox.showinfo("Archive Completed", "All data has been archived.")
+        import file_processing.archive_queue as archive_queue
+        if archive_queue.COMMITTER.flush():
+            self.dialogs.showinfo("Archive Completed", "All data has been archived.")
+        else:
+            self.dialogs.showinfo("Archive Queued", "The UDB Validation Archive file is open, the data was queued and "
+                                                    "will be archived as soon as the file is closed.")
+        bad = archive_queue.set_aside()
+        if bad:
+            self.dialogs.showwarning("Archive Queue Error",
+                                     f"{len(bad)} queued archive file(s) could not be read and were NOT archived. They "
+                                     f"were set aside in {archive_queue.QUEUE_DIR}:\n\n" +
+                                     "\n".join(os.path.basename(path) for path in bad))
+        metrics.log_summary()
+
+    @invalid_date
+    @in_background()
+    def rerun_changed(self) -> None:
+        """Rerun only the steps whose input files changed and handle errors through the ui.
+
+        :return: None
+        :rtype: None
+        """
+        import file_processing.service as service
+        import file_processing.pipeline as pipeline
+        try:
+            results = service.Client().run_stage(self.demo_obj, service.RUN_CHANGED) if SETTINGS.service_mode else \
+                pipeline.PIPELINE.run(self.demo_obj)
+        except Exception as e:
+            self.dialogs.showerror("Rerun Error", str(e))
+            logger.error("Rerun Error %s", repr(e))
+            return
+
+        # the service only sends back the names of the stages it ran
+        if "validation_counts" in results and isinstance(results, dict):
+            self.new_id_data = results["validation_counts"]
+
+        if results:
+            self.dialogs.showinfo("Rerun Completed", "The following steps were rerun:\n\n" + '\n'.join(results))
+        else:
+            self.dialogs.showinfo("Rerun Completed", "Nothing changed since the last run.")
 
 
 class DemoMenu(tk.Menu):
@@ -409,8 +686,7 @@ class DemoMenu(tk.Menu):
         new = tk.Toplevel(self.parent)
         new.title("Settings")
         new.config(pady=10, padx=10)
-        with open(demo_p.SETTINGS_PATH, 'r') as file:
-            settings = json.load(file)
+        settings = SETTINGS.all()
         entries = {}
 
         def update_settings():
@@ -419,10 +695,9 @@ class DemoMenu(tk.Menu):
                                           "the Access Database will also need to be reflected""in the database. Are "
                                           "you sure you wish to proceed?")
             if sure == 'yes':
-                for config, entry_box in entries.items():
-                    settings[config] = entry_box.get()
-                with open(demo_p.SETTINGS_PATH, 'w') as new_file:
-                    json.dump(settings, new_file)
+                # applies straight away, open demos pick up the new paths through their subscription
+                changed = SETTINGS.update({config: entry_box.get() for config, entry_box in entries.items()})
+                logger.info("Settings updated: %s", ', '.join(changed) or "no changes")
 
         for idx, (setting, value) in enumerate(settings.items()):
             tk.Label(new, text=f"{setting}:", font="Ariel 10 bold").grid(row=idx, column=0, pady=2, sticky="w")
@@ -430,5 +705,5 @@ class DemoMenu(tk.Menu):
             entries[setting].insert(0, value)
             entries[setting].grid(row=idx, column=1, columnspan=2, padx=2, sticky="w")
 
-        tk.Button(new, text="Update Settings", font='Ariel 10 bold', command=update_settings).grid(row=11, column=1,
-                                                                                                   pady=5)
+        tk.Button(new, text="Update Settings", font='Ariel 10 bold', command=update_settings).grid(row=len(settings),
+                                                                                                   column=1, pady=5)
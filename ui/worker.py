@@ -0,0 +1,150 @@
+from __future__ import annotations
+import queue
+import threading
+from tkinter import messagebox
+from logs.log import logger
+from logs import metrics
+
+try:
+    import pythoncom
+except ImportError:
+    pythoncom = None
+
+POLL_MS = 100
+
+
+class StepCancelled(BaseException):
+    """Raised in the worker thread when the operator cancels a step.
+
+    Derives from BaseException so the steps' ``except Exception`` error handling doesn't swallow it.
+    """
+
+
+class Dialogs:
+    def __init__(self, worker: StepWorker):
+        """Initialize Dialogs, a thread safe stand-in for tkinter.messagebox.
+
+        :param worker: worker that owns the queue back to the main loop
+        :type worker: StepWorker
+        """
+        self.worker = worker
+
+    def showerror(self, title: str, message: str) -> None:
+        self.worker.post(messagebox.showerror, title, message)
+
+    def showwarning(self, title: str, message: str) -> None:
+        self.worker.post(messagebox.showwarning, title, message)
+
+    def showinfo(self, title: str, message: str) -> None:
+        self.worker.post(messagebox.showinfo, title, message)
+
+
+class StepWorker:
+    def __init__(self, root, on_stage=None, on_finish=None):
+        """Initialize StepWorker.
+
+        Runs one step at a time on a background thread. Anything the step needs done on the tkinter main loop is put
+        on a queue that the main loop drains every POLL_MS milliseconds.
+
+        :param root: tkinter widget used to schedule the queue polling
+        :type root: tk.Misc
+        :param on_stage: called on the main loop with (event, record) for every stage the step runs
+        :type on_stage: callable
+        :param on_finish: called on the main loop with the step's name once it finishes
+        :type on_finish: callable
+        """
+        self.root = root
+        self.on_stage = on_stage
+        self.on_finish = on_finish
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.dialogs = Dialogs(self)
+        metrics.add_listener(self._stage_event)
+        self.root.after(POLL_MS, self._poll)
+
+    @property
+    def busy(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def post(self, callback, *args) -> None:
+        """Run callback(*args) on the main loop.
+
+        :param callback: function to call
+        :type callback: callable
+        :param args: arguments for the function
+        :type args: any
+        :return: None
+        :rtype: None
+        """
+        self.queue.put((callback, args))
+
+    def start(self, name: str, func, *args) -> bool:
+        """Run func(*args) on the worker thread.
+
+        :param name: name of the step
+        :type name: str
+        :param func: step to run
+        :type func: callable
+        :param args: arguments for the step
+        :type args: any
+        :return: whether the step was started
+        :rtype: bool
+        """
+        if self.busy:
+            messagebox.showinfo("Step Running", "Another step is still running, wait for it to finish or cancel it.")
+            return False
+
+        self.cancel_event.clear()
+        self.thread = threading.Thread(target=self._run, args=(name, func) + args, name=f"step-{name}", daemon=True)
+        self.thread.start()
+        return True
+
+    def cancel(self) -> None:
+        """Ask the running step to stop before its next stage.
+
+        :return: None
+        :rtype: None
+        """
+        if self.busy:
+            logger.info("Cancel requested")
+            self.cancel_event.set()
+
+    def _run(self, name: str, func, *args) -> None:
+        # COM objects (Excel, Access) need COM initialized on the thread that uses them
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            func(*args)
+        except StepCancelled:
+            logger.warning("Step %s was cancelled", name)
+            self.dialogs.showwarning("Cancelled", "The step was cancelled. Files may be partially processed, run the "
+                                                  "step again before moving on.")
+        except Exception as e:
+            logger.error("Step Error %s", repr(e))
+            self.dialogs.showerror("Step Error", str(e))
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+            if self.on_finish is not None:
+                self.post(self.on_finish, name)
+
+    def _stage_event(self, event: str, record: dict) -> None:
+        if threading.current_thread() is not self.thread:
+            return
+        if event == "start" and self.cancel_event.is_set():
+            raise StepCancelled(record["stage"])
+        if self.on_stage is not None:
+            self.post(self.on_stage, event, dict(record))
+
+    def _poll(self) -> None:
+        try:
+            while True:
+                callback, args = self.queue.get_nowait()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    logger.error("UI callback error %s", repr(e))
+        except queue.Empty:
+            pass
+        self.root.after(POLL_MS, self._poll)